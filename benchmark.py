@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# coding=utf-8
+###############################################################################
+
+"""
+Throughput benchmark of the publish path, from Collector.publish through
+Handler._process and Handler._flush, for the network handlers.
+
+A synthetic collector publishes a fixed number of metrics per run, at a
+controlled rate, to one handler at a time. The handlers talk to local
+stand-ins for their remote ends (TCP carbon/TSDB sink, UDP sink, HTTP server,
+statsd listener), so the benchmark measures diamond and not the network.
+
+    ./benchmark.py
+    ./benchmark.py -H graphite,graphitepickle -m 5000 -r 20 --rate 50000
+"""
+
+import os
+import sys
+import time
+import socket
+import resource
+import optparse
+import logging
+import threading
+import configobj
+import SocketServer
+import BaseHTTPServer
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             'src')))
+
+from diamond.collector import Collector
+from diamond.instrumentation import get_process_metrics
+from diamond.util import load_class_from_name
+from diamond.util import percentile
+
+
+###############################################################################
+# Local sinks
+
+class Sink(object):
+    """
+    A local server counting what it receives
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.messages = 0
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    def received(self, data):
+        self.lock.acquire()
+        try:
+            self.bytes += len(data)
+            self.messages += 1
+        finally:
+            self.lock.release()
+
+    def start(self):
+        self.server = self.create_server()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        return self.server.server_address[1]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(5)
+
+
+class TCPSink(Sink):
+    """
+    Stands in for carbon and TSDB: reads and discards whole streams
+    """
+
+    def create_server(self):
+        sink = self
+
+        class RequestHandler(SocketServer.BaseRequestHandler):
+
+            def handle(self):
+                while True:
+                    data = self.request.recv(65536)
+                    if not data:
+                        return
+                    sink.received(data)
+
+        server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0),
+                                                 RequestHandler)
+        server.daemon_threads = True
+        return server
+
+
+class UDPSink(Sink):
+    """
+    Stands in for carbon over UDP and for statsd
+    """
+
+    def create_server(self):
+        sink = self
+
+        class RequestHandler(SocketServer.BaseRequestHandler):
+
+            def handle(self):
+                sink.received(self.request[0])
+
+        return SocketServer.UDPServer(('127.0.0.1', 0), RequestHandler)
+
+
+class HTTPSink(Sink):
+    """
+    Stands in for HTTP endpoints: answers 200 to every POST
+    """
+
+    def create_server(self):
+        sink = self
+
+        class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                length = int(self.headers.getheader('content-length', 0))
+                sink.received(self.rfile.read(length))
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RequestHandler)
+
+
+###############################################################################
+# Handlers under test: name -> (class, sink, extra config)
+
+HANDLERS = {
+    'graphite': ('diamond.handler.graphite.GraphiteHandler', TCPSink,
+                 {'proto': 'tcp', 'batch': 100}),
+    'graphite_async': ('diamond.handler.graphite.GraphiteHandler', TCPSink,
+                       {'proto': 'tcp', 'batch': 100, 'transport': 'async'}),
+    'graphite_udp': ('diamond.handler.graphite.GraphiteHandler', UDPSink,
+                     {'proto': 'udp', 'batch': 1}),
+    'graphite_udp_packed': ('diamond.handler.graphite.GraphiteHandler',
+                            UDPSink, {'proto': 'udp', 'batch': 100,
+                                      'udp_mtu': 1432}),
+    'graphitepickle': ('diamond.handler.graphitepickle.GraphitePickleHandler',
+                       TCPSink, {'batch': 100}),
+    'tsdb': ('diamond.handler.tsdb.TSDBHandler', TCPSink, {'batch': 100}),
+    'tsdb_http': ('diamond.handler.tsdb.TSDBHandler', HTTPSink,
+                  {'batch': 100, 'protocol': 'http'}),
+    'http': ('diamond.handler.httpHandler.HttpPostHandler', HTTPSink,
+             {'batch': 100}),
+    'statsd': ('diamond.handler.stats_d.StatsdHandler', UDPSink,
+               {'batch': 100}),
+    'statsd_packed': ('diamond.handler.stats_d.StatsdHandler', UDPSink,
+                      {'batch': 100, 'udp_mtu': 1432}),
+}
+
+
+def create_handler(name, port, options):
+    fqcn, sink_cls, extra = HANDLERS[name]
+    cls = load_class_from_name(fqcn)
+    if (getattr(sys.modules[cls.__module__], 'statsd', True) is None
+            and not extra.get('udp_mtu')):
+        raise ImportError("python-statsd is not installed")
+
+    config = configobj.ConfigObj()
+    config.merge(extra)
+    config['host'] = '127.0.0.1'
+    config['port'] = port
+    config['url'] = 'http://127.0.0.1:%d/' % port
+    config['queue_size'] = options.queue_size
+    return cls(config)
+
+
+###############################################################################
+# Synthetic collector
+
+class SyntheticCollector(Collector):
+    """
+    Publishes metrics_per_run metrics per run, timing every publish call
+    """
+
+    def __init__(self, config, handlers, metrics_per_run):
+        Collector.__init__(self, config, handlers)
+        self.names = ['bench.group%d.metric%d' % (i % 10, i)
+                      for i in range(metrics_per_run)]
+        self.latencies = []
+        self.value = 0
+
+    def collect(self):
+        self.value += 1
+        latencies = self.latencies
+        for name in self.names:
+            start = time.time()
+            self.publish(name, self.value)
+            latencies.append(time.time() - start)
+
+
+def create_collector(handler, options):
+    config = configobj.ConfigObj()
+    config['server'] = {}
+    config['server']['collectors_config_path'] = ''
+    config['collectors'] = {}
+    config['collectors']['default'] = {
+        'hostname': 'benchmark.host',
+        'interval': 10,
+    }
+    return SyntheticCollector(config, [handler], options.metrics)
+
+
+###############################################################################
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def rss():
+    metrics = get_process_metrics()
+    return metrics.get('rss', metrics.get('max_rss', 0))
+
+
+def benchmark(name, options):
+    """
+    Run the benchmark for one handler and return its results
+    """
+    sink = HANDLERS[name][1]()
+    port = sink.start()
+    try:
+        handler = create_handler(name, port, options)
+        collector = create_collector(handler, options)
+
+        rss_before = rss()
+        cpu_before = cpu_time()
+        start = time.time()
+        for i in range(options.runs):
+            run_start = time.time()
+            collector._run()
+            if options.rate > 0:
+                # Sleep until the run is due at the requested rate
+                due = run_start + float(options.metrics) / options.rate
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+        handler._shutdown(30)
+        elapsed = time.time() - start
+        cpu = cpu_time() - cpu_before
+        rss_growth = rss() - rss_before
+
+        # Let the sink read what is still in flight
+        time.sleep(0.2)
+    finally:
+        sink.stop()
+
+    total = options.runs * options.metrics
+    latencies = collector.latencies
+    return {
+        'handler': name,
+        'metrics': total,
+        'rate': total / elapsed,
+        'p50': percentile(latencies, 50) * 1000000,
+        'p99': percentile(latencies, 99) * 1000000,
+        'cpu': cpu / total * 1000000,
+        'rss': rss_growth / 1024,
+        'received': sink.bytes,
+    }
+
+
+def report(results):
+    print "%-20s %10s %12s %10s %10s %12s %10s %12s" % (
+        'handler', 'metrics', 'metrics/s', 'p50 us', 'p99 us',
+        'cpu us/metr', 'rss +KB', 'sink bytes')
+    for result in results:
+        print ("%(handler)-20s %(metrics)10d %(rate)12.0f %(p50)10.1f "
+               "%(p99)10.1f %(cpu)12.2f %(rss)10d %(received)12d" % result)
+
+
+###############################################################################
+
+if __name__ == "__main__":
+    # Keep handler errors out of the report
+    log = logging.getLogger("diamond")
+    log.addHandler(logging.StreamHandler(sys.stderr))
+    log.setLevel(logging.ERROR)
+
+    # Initialize Options
+    parser = optparse.OptionParser()
+    parser.add_option("-H",
+                      "--handlers",
+                      dest="handlers",
+                      default=','.join(sorted(HANDLERS)),
+                      help="Comma separated handlers to benchmark, out of %s"
+                           % ', '.join(sorted(HANDLERS)))
+    parser.add_option("-m",
+                      "--metrics",
+                      dest="metrics",
+                      type="int",
+                      default=1000,
+                      help="Metrics published per collector run")
+    parser.add_option("-r",
+                      "--runs",
+                      dest="runs",
+                      type="int",
+                      default=20,
+                      help="Number of collector runs")
+    parser.add_option("--rate",
+                      dest="rate",
+                      type="float",
+                      default=0,
+                      help="Target metrics per second, 0 for as fast as "
+                           "possible")
+    parser.add_option("-q",
+                      "--queue-size",
+                      dest="queue_size",
+                      type="int",
+                      default=0,
+                      help="Handler dispatch queue size")
+
+    # Parse Command Line Args
+    (options, args) = parser.parse_args()
+
+    results = []
+    for name in options.handlers.split(','):
+        name = name.strip()
+        if name not in HANDLERS:
+            parser.error("Unknown handler: %s" % name)
+        try:
+            results.append(benchmark(name, options))
+        except (ImportError, socket.error), e:
+            print >> sys.stderr, "Skipped %s: %s" % (name, e)
+
+    report(results)
@@ -18,7 +18,6 @@ import diamond.collector
 import diamond.convertor
 import time
 import os
-import re
 
 try:
     import psutil
@@ -71,6 +70,16 @@ class DiskUsageCollector(diamond.collector.Collector):
         })
         return config
 
+    def get_default_config_types(self):
+        config_types = super(DiskUsageCollector,
+                             self).get_default_config_types()
+        config_types.update({
+            'devices': diamond.collector.str_to_regex,
+            'sector_size': int,
+            'send_zero': diamond.collector.str_to_bool,
+        })
+        return config_types
+
     def get_disk_statistics(self):
         """
         Create a map of disks in the machine.
@@ -127,17 +136,18 @@ class DiskUsageCollector(diamond.collector.Collector):
                 self.log.error('Unable to import psutil')
                 return None
 
+            sector_size = self.settings.sector_size
             disks = psutil.disk_io_counters(True)
             for disk in disks:
                     result[(0, len(result))] = {
                         'device': disk,
                         'reads': disks[disk].read_count,
                         'reads_sectors': (disks[disk].read_bytes
-                                          / int(self.config['sector_size'])),
+                                          / sector_size),
                         'reads_milliseconds': disks[disk].read_time,
                         'writes': disks[disk].write_count,
                         'writes_sectors': (disks[disk].write_bytes
-                                           / int(self.config['sector_size'])),
+                                           / sector_size),
                         'writes_milliseconds': disks[disk].write_time,
                         'io_milliseconds':
                         disks[disk].read_time + disks[disk].write_time,
@@ -151,15 +161,16 @@ class DiskUsageCollector(diamond.collector.Collector):
 
         # Handle collection time intervals correctly
         CollectTime = time.time()
-        time_delta = float(self.config['interval'])
+        time_delta = float(self.settings.interval)
         if self.LastCollectTime:
             time_delta = CollectTime - self.LastCollectTime
         if not time_delta:
-            time_delta = float(self.config['interval'])
+            time_delta = float(self.settings.interval)
         self.LastCollectTime = CollectTime
 
-        exp = self.config['devices']
-        reg = re.compile(exp)
+        reg = self.settings.devices
+        byte_units = self.settings.byte_unit
+        sectors_per_kb = 1024 / self.settings.sector_size
 
         results = self.get_disk_statistics()
         if not results:
@@ -177,12 +188,12 @@ class DiskUsageCollector(diamond.collector.Collector):
                     continue
                 oldkey = key
 
-                for unit in self.config['byte_unit']:
+                for unit in byte_units:
                     key = oldkey
 
                     if key.endswith('sectors'):
                         key = key.replace('sectors', unit)
-                        value /= (1024 / int(self.config['sector_size']))
+                        value /= sectors_per_kb
                         value = diamond.convertor.binary.convert(value=value,
                                                                  oldUnit='kB',
                                                                  newUnit=unit)
@@ -213,7 +224,7 @@ class DiskUsageCollector(diamond.collector.Collector):
             metrics['reads_per_second'] = metrics['reads'] / time_delta
             metrics['writes_per_second'] = metrics['writes'] / time_delta
 
-            for unit in self.config['byte_unit']:
+            for unit in byte_units:
                 metric_name = 'read_%s_per_second' % unit
                 key = 'reads_%s' % unit
                 metrics[metric_name] = metrics[key] / time_delta
@@ -250,7 +261,7 @@ class DiskUsageCollector(diamond.collector.Collector):
             else:
                 metrics['write_await'] = 0
 
-            for unit in self.config['byte_unit']:
+            for unit in byte_units:
                 rkey = 'reads_%s' % unit
                 wkey = 'writes_%s' % unit
                 metric_name = 'average_request_size_%s' % unit
@@ -280,7 +291,7 @@ class DiskUsageCollector(diamond.collector.Collector):
                                              / 1000.0)
 
             # Only publish when we have io figures
-            if (metrics['io'] > 0 or self.config['send_zero']):
+            if (metrics['io'] > 0 or self.settings.send_zero):
                 for key in metrics:
                     metric_name = '.'.join([info['device'], key]).replace(
                         '/', '_')
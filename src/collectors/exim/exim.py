@@ -49,7 +49,7 @@ class EximCollector(diamond.collector.Collector):
         if str_to_bool(self.config['use_sudo']):
             command.insert(0, self.config['sudo_cmd'])
 
-        queuesize = subprocess.Popen(
+        queuesize = self.popen(
             command, stdout=subprocess.PIPE).communicate()[0].split()
 
         if not len(queuesize):
@@ -113,7 +113,7 @@ class GridEngineCollector(diamond.collector.Collector):
         self._collect_queue_stats()
 
     def _capture_output(self, cmd):
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        p = self.popen(cmd, stdout=subprocess.PIPE)
         bytestr = p.communicate()[0]
         output = bytestr.decode(sys.getdefaultencoding())
         return output
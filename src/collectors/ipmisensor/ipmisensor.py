@@ -54,8 +54,8 @@ class IPMISensorCollector(diamond.collector.Collector):
         if self.config['use_sudo'] and getpass.getuser() != 'root':
             command.insert(0, self.config['sudo_cmd'])
 
-        p = subprocess.Popen(command,
-                             stdout=subprocess.PIPE).communicate()[0][:-1]
+        p = self.popen(command,
+                       stdout=subprocess.PIPE).communicate()[0][:-1]
 
         for i, v in enumerate(p.split("\n")):
             data = v.split("|")
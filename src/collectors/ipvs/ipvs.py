@@ -34,8 +34,8 @@ class IPVSCollector(diamond.collector.Collector):
             self.statcommand.insert(1, '-n')
             self.concommand.insert(1, '-n')
 
-        p = subprocess.Popen(self.statcommand, stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
+        p = self.popen(self.statcommand, stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE)
         p.wait()
 
         if p.returncode == 255:
@@ -74,8 +74,8 @@ class IPVSCollector(diamond.collector.Collector):
             self.log.error("%s is not executable", self.config['sudo_cmd'])
             return False
 
-        p = subprocess.Popen(self.statcommand,
-                             stdout=subprocess.PIPE).communicate()[0][:-1]
+        p = self.popen(self.statcommand,
+                       stdout=subprocess.PIPE).communicate()[0][:-1]
 
         columns = {
             'conns': 2,
@@ -117,8 +117,8 @@ class IPVSCollector(diamond.collector.Collector):
 
                 self.publish(metric_name, metric_value)
 
-        p = subprocess.Popen(self.concommand,
-                             stdout=subprocess.PIPE).communicate()[0][:-1]
+        p = self.popen(self.concommand,
+                       stdout=subprocess.PIPE).communicate()[0][:-1]
 
         columns = {
             'active': 4,
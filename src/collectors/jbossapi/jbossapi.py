@@ -328,9 +328,9 @@ class JbossApiCollector(diamond.collector.Collector):
             current_user, current_pword))
 
         try:
-            attributes = subprocess.Popen(the_cmd, shell=True,
-                                          stdout=subprocess.PIPE
-                                          ).communicate()[0]
+            attributes = self.popen(the_cmd, shell=True,
+                                    stdout=subprocess.PIPE
+                                    ).communicate()[0]
             output = json.loads(attributes)
         except Exception, e:
             self.log.error("JbossApiCollector: There was an exception %s", e)
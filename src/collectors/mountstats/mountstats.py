@@ -118,8 +118,8 @@ class MountStatsCollector(diamond.collector.Collector):
                 return None
 
             command = [self.config['sudo_cmd'], '/bin/cat', self.MOUNTSTATS]
-            p = subprocess.Popen(command,
-                                 stdout=subprocess.PIPE).communicate()[0][:-1]
+            p = self.popen(command,
+                           stdout=subprocess.PIPE).communicate()[0][:-1]
             lines = p.split("\n")
 
         else:
@@ -81,8 +81,8 @@ class NagiosStatsCollector(diamond.collector.Collector):
         if str_to_bool(self.config['use_sudo']):
             command.insert(0, self.config['sudo_cmd'])
 
-        p = subprocess.Popen(command,
-                             stdout=subprocess.PIPE).communicate()[0][:-1]
+        p = self.popen(command,
+                       stdout=subprocess.PIPE).communicate()[0][:-1]
 
         for i, v in enumerate(p.split("\n")):
             metric_name = self.config['vars'][i]
@@ -15,7 +15,7 @@ both of these should come installed with swift
 """
 
 import diamond.collector
-from subprocess import Popen, PIPE
+from subprocess import PIPE
 
 try:
     import json
@@ -61,7 +61,7 @@ class OpenstackSwiftCollector(diamond.collector.Collector):
     def collect(self):
         # dispersion report.  this can take easily >60s. beware!
         if (self.config['enable_dispersion_report']):
-            p = Popen(
+            p = self.popen(
                 ['swift-dispersion-report', '-j'],
                 stdout=PIPE,
                 stderr=PIPE)
@@ -80,7 +80,7 @@ class OpenstackSwiftCollector(diamond.collector.Collector):
                        '-U', account,
                        '-K', self.config['password'],
                        'stat', container]
-                p = Popen(cmd, stdout=PIPE, stderr=PIPE)
+                p = self.popen(cmd, stdout=PIPE, stderr=PIPE)
                 stdout, stderr = p.communicate()
                 stats = {}
                 # stdout is some lines in 'key   : val' format
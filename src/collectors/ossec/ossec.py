@@ -51,7 +51,7 @@ class OssecCollector(diamond.collector.Collector):
             command.insert(0, self.config['sudo_cmd'])
 
         try:
-            p = subprocess.Popen(command, stdout=subprocess.PIPE)
+            p = self.popen(command, stdout=subprocess.PIPE)
             res = p.communicate()[0]
         except Exception, e:
             self.log.error('Unable to exec cmd: %s, because %s' % (' '.join(command), str(e)))
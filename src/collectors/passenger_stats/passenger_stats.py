@@ -63,7 +63,7 @@ class PassengerCollector(diamond.collector.Collector):
             command.insert(0, self.config["sudo_cmd"])
 
         try:
-            proc1 = subprocess.Popen(command, stdout=subprocess.PIPE)
+            proc1 = self.popen(command, stdout=subprocess.PIPE)
             (std_out, std_err) = proc1.communicate()
         except OSError as exception:
             return {}
@@ -119,7 +119,7 @@ class PassengerCollector(diamond.collector.Collector):
         Execute % top; and return STDOUT.
         """
         try:
-            proc1 = subprocess.Popen(
+            proc1 = self.popen(
                 ["top", "-b", "-n", "2"],
                 stdout=subprocess.PIPE)
             (std_out, std_err) = proc1.communicate()
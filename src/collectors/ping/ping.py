@@ -79,7 +79,7 @@ class PingCollector(diamond.collector.Collector):
                 if str_to_bool(self.config['use_sudo']):
                     command.insert(0, self.config['sudo_cmd'])
 
-                ping = subprocess.Popen(
+                ping = self.popen(
                     command, stdout=subprocess.PIPE).communicate()[0].strip(
                     ).split("\n")[-1]
 
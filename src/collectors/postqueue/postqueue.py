@@ -45,8 +45,8 @@ class PostqueueCollector(diamond.collector.Collector):
             if str_to_bool(self.config['use_sudo']):
                 command.insert(0, self.config['sudo_cmd'])
 
-            return subprocess.Popen(command,
-                                    stdout=subprocess.PIPE).communicate()[0]
+            return self.popen(command,
+                              stdout=subprocess.PIPE).communicate()[0]
         except OSError:
             return ""
 
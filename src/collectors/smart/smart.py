@@ -58,7 +58,7 @@ class SmartCollector(diamond.collector.Collector):
                 if str_to_bool(self.config['use_sudo']):
                     command.insert(0, self.config['sudo_cmd'])
 
-                attributes = subprocess.Popen(
+                attributes = self.popen(
                     command,
                     stdout=subprocess.PIPE
                 ).communicate()[0].strip().splitlines()
@@ -52,8 +52,8 @@ class UPSCollector(diamond.collector.Collector):
         if str_to_bool(self.config['use_sudo']):
             command.insert(0, self.config['sudo_cmd'])
 
-        p = subprocess.Popen(command,
-                             stdout=subprocess.PIPE).communicate()[0]
+        p = self.popen(command,
+                       stdout=subprocess.PIPE).communicate()[0]
 
         for ln in p.strip().splitlines():
             datapoint = ln.split(": ")
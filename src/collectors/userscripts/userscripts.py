@@ -68,9 +68,9 @@ class UserScriptsCollector(diamond.collector.Collector):
             out = None
             self.log.debug("Executing %s" % absolutescriptpath)
             try:
-                proc = subprocess.Popen([absolutescriptpath],
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE)
+                proc = self.popen([absolutescriptpath],
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE)
                 (out, err) = proc.communicate()
             except subprocess.CalledProcessError, e:
                 self.log.error("%s error launching: %s; skipping" %
@@ -171,8 +171,8 @@ class VarnishCollector(diamond.collector.Collector):
             if str_to_bool(self.config['use_sudo']):
                 command.insert(0, self.config['sudo_cmd'])
 
-            output = subprocess.Popen(command,
-                                      stdout=subprocess.PIPE).communicate()[0]
+            output = self.popen(command,
+                                stdout=subprocess.PIPE).communicate()[0]
         except OSError:
             output = ""
 
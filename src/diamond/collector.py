@@ -5,14 +5,24 @@ The Collector class is a base class for all metric collectors.
 """
 
 import os
+import re
+import math
 import socket
 import platform
 import logging
 import configobj
 import traceback
+import threading
 import time
+from collections import deque
 
 from diamond.metric import Metric
+from diamond.metricfilter import MetricFilter
+from diamond.util import LRUCache
+from diamond.util import percentile
+from diamond.util import load_class_from_name
+from diamond import profiler
+from diamond import timeout
 from error import DiamondException
 
 # Detect the architecture of the system and set the counters for MAX_VALUES
@@ -125,11 +135,87 @@ def str_to_bool(value):
     return value
 
 
+def str_to_list(value):
+    """
+    Converts a whitespace separated string to a list
+    """
+    if isinstance(value, basestring):
+        return value.split()
+    return list(value)
+
+
+def str_to_regex(value):
+    """
+    Compiles a regular expression
+    """
+    if isinstance(value, basestring):
+        return re.compile(value)
+    return value
+
+
+class Settings(object):
+    """
+    A read-only snapshot of a collector config, with the values converted to
+    their declared type. Values are read as attributes, or as items for names
+    that aren't valid identifiers.
+    """
+
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+    def __setattr__(self, name, value):
+        raise TypeError("Settings are read-only")
+
+    def __delattr__(self, name):
+        raise TypeError("Settings are read-only")
+
+    def __getitem__(self, name):
+        return self.__dict__[name]
+
+    def __contains__(self, name):
+        return name in self.__dict__
+
+    def get(self, name, default=None):
+        return self.__dict__.get(name, default)
+
+
+class CollectorConfig(configobj.ConfigObj):
+    """
+    The config of a collector. Calls on_change when a top level value is set
+    to a different value or deleted, so that the collector rebuilds its
+    settings. Changes within nested sections are not tracked.
+    """
+
+    on_change = None
+
+    def __setitem__(self, key, value, unrepr=False):
+        changed = (self.on_change is not None
+                   and (not dict.__contains__(self, key)
+                        or dict.__getitem__(self, key) != value))
+        configobj.ConfigObj.__setitem__(self, key, value, unrepr)
+        if changed:
+            self.on_change()
+
+    def __delitem__(self, key):
+        configobj.ConfigObj.__delitem__(self, key)
+        if self.on_change is not None:
+            self.on_change()
+
+
 class Collector(object):
     """
     The Collector class is a base class for all metric collectors.
     """
 
+    # Maximum number of metric paths memoized by get_metric_path
+    METRIC_PATH_CACHE_SIZE = 10000
+
+    # Number of run times kept for the percentiles
+    RUN_TIME_SAMPLES = 100
+
+    # Number of recent runs the adaptive interval is based on
+    ADAPTIVE_MIN_SAMPLES = 5
+
     def __init__(self, config, handlers):
         """
         Create a new instance of the Collector class
@@ -139,13 +225,12 @@ class Collector(object):
         # Initialize Members
         self.name = self.__class__.__name__
         self.handlers = handlers
-        self.last_values = {}
 
         # Get Collector class
         cls = self.__class__
 
         # Initialize config
-        self.config = configobj.ConfigObj()
+        self.config = CollectorConfig()
 
         # Check if default config is defined
         if self.get_default_config() is not None:
@@ -176,8 +261,53 @@ class Collector(object):
         self.config['measure_collector_time'] = str_to_bool(
             self.config['measure_collector_time'])
 
+        self.config['align'] = str_to_bool(self.config['align'])
+
+        self.config['adaptive_interval'] = str_to_bool(
+            self.config['adaptive_interval'])
+
+        # Typed copy of the config, for the hot paths, rebuilt whenever the
+        # config is changed
+        self.load_settings()
+        self.config.on_change = self._config_changed
+
+        # Initialize the store holding the previous value of every counter
+        store_cls = load_class_from_name(self.settings.counter_store)
+        self.last_values = store_cls(
+            ttl=self.settings.counter_ttl,
+            max_size=self.settings.counter_max_size)
+
+        self.counter_state_saved = time.time()
+        self.load_counter_state()
+
+        # Counters are keyed by name and instance rather than by their full
+        # path, unless the collector builds paths its own way
+        self._counter_keys_by_path = (cls.get_metric_path.im_func
+                                      is not Collector.get_metric_path.im_func)
+
         self.collect_running = False
 
+        # Run statistics
+        self.runs = 0
+        self.errors = 0
+        self.metrics_emitted = 0
+        self.metrics_filtered = 0
+        self.run_times = deque(maxlen=self.RUN_TIME_SAMPLES)
+        self.overruns = 0
+        self.skipped_runs = 0
+        self.timeouts = 0
+        # Threads of runs abandoned after a timeout, whose metrics are dropped
+        self.abandoned_threads = set()
+        # Metrics published during a run, handed to the handlers as a single
+        # batch at its end. None outside of runs.
+        self.run_batch = None
+        # Interval chosen in adaptive mode, None until it differs from the
+        # configured one
+        self.adapted_interval = None
+
+        # Set by the server for collectors run with method ProcessPool
+        self.process_pool = None
+
     def get_default_config_help(self):
         """
         Returns the help text for the configuration options for this collector
@@ -185,7 +315,41 @@ class Collector(object):
         return {
             'enabled': 'Enable collecting these metrics',
             'byte_unit': 'Default numeric output(s)',
-            'measure_collector_time': 'Collect the collector run time in ms',
+            'method': ('Threading model: Sequential, Threaded, Forked, '
+                       'Pooled (runs on the server thread pool) or '
+                       'ProcessPool (runs on the server worker processes)'),
+            'max_concurrent': ('Maximum number of runs of this collector '
+                               'queued or running on the thread pool'),
+            'align': ('Run at multiples of the interval on the wall clock, '
+                      'offset by splay'),
+            'timeout': ('Abandon runs taking longer than this many seconds '
+                        'and kill the processes they started. 0 disables'),
+            'measure_collector_time': ('Collect the collector run time in ms,'
+                                       ' its percentiles, overruns, skipped'
+                                       ' runs and the counter store size'),
+            'adaptive_interval': ('Stretch the interval when the collector '
+                                  'keeps running for longer than '
+                                  'adaptive_threshold of it'),
+            'adaptive_threshold': ('Fraction of the interval the median run '
+                                   'time may use in adaptive mode'),
+            'adaptive_max_factor': ('Largest multiple of the configured '
+                                    'interval used in adaptive mode'),
+            'counter_store': 'Class used to store previous counter values',
+            'counter_ttl': ('Number of runs a counter that is not updated is'
+                            ' remembered for. 0 remembers it forever'),
+            'counter_max_size': ('Maximum number of counters remembered. 0 '
+                                 'means unbounded'),
+            'counter_state_path': ('Directory to save counter values to, so '
+                                   'they survive restarts. Empty to disable'),
+            'counter_state_max_age': ('Discard saved counter values older than'
+                                      ' this many seconds'),
+            'counter_state_save_interval': ('How often to save counter values'
+                                            ' (seconds)'),
+            'metrics_whitelist': ('Regex or list of regexes matching the '
+                                  'names of the only metrics to publish'),
+            'metrics_blacklist': ('Regex or list of regexes matching the '
+                                  'names of metrics not to publish. Ignored '
+                                  'when metrics_whitelist is set'),
         }
 
     def get_default_config(self):
@@ -227,19 +391,117 @@ class Collector(object):
             # Default Poll Interval (seconds)
             'interval': 300,
 
+            # Align runs on the wall clock, so an interval of 60 runs on the
+            # minute (plus splay)
+            'align': False,
+
             # Default Event TTL (interval multiplier)
             'ttl_multiplier': 2,
 
             # Default collector threading model
             'method': 'Sequential',
 
+            # Runs of the collector allowed on the thread pool at once
+            'max_concurrent': 1,
+
             # Default numeric output
             'byte_unit': 'byte',
 
+            # Abandon runs taking longer than this (seconds), 0 to disable
+            'timeout': 0,
+
             # Collect the collector run time in ms
             'measure_collector_time': False,
+
+            # Stretch the interval of collectors that can't keep up
+            'adaptive_interval': False,
+            'adaptive_threshold': 0.8,
+            'adaptive_max_factor': 4,
+
+            # Store for previous counter values, and its eviction policy
+            'counter_store': 'diamond.counterstore.CounterStore',
+            'counter_ttl': 0,
+            'counter_max_size': 100000,
+
+            # Directory to persist counter values across restarts
+            'counter_state_path': '',
+            'counter_state_max_age': 900,
+            'counter_state_save_interval': 300,
+
+            # Only publish the metrics matching the whitelist, or drop the
+            # ones matching the blacklist
+            'metrics_whitelist': None,
+            'metrics_blacklist': None,
+        }
+
+    def get_default_config_types(self):
+        """
+        Return the type of the config options read in hot paths, as functions
+        converting a config value. Options without a type are copied as is
+        to the settings.
+        """
+        return {
+            'enabled': str_to_bool,
+            'byte_unit': str_to_list,
+            'splay': int,
+            'interval': int,
+            'align': str_to_bool,
+            'ttl_multiplier': float,
+            'max_concurrent': int,
+            'timeout': float,
+            'measure_collector_time': str_to_bool,
+            'adaptive_interval': str_to_bool,
+            'adaptive_threshold': float,
+            'adaptive_max_factor': int,
+            'counter_ttl': int,
+            'counter_max_size': int,
+            'counter_state_max_age': float,
+            'counter_state_save_interval': float,
         }
 
+    def _config_changed(self):
+        self._settings_stale = True
+
+    @property
+    def settings(self):
+        """
+        The typed read-only snapshot of the config used by the hot paths
+        """
+        if self._settings_stale:
+            self.load_settings()
+        return self._settings
+
+    def load_settings(self):
+        """
+        Build the settings, and forget what was derived from the previous
+        config. Called on the first use of the settings after the config
+        changed.
+        """
+        types = self.get_default_config_types()
+        values = {}
+        for name, value in self.config.items():
+            if name in types:
+                value = types[name](value)
+            if isinstance(value, list):
+                value = tuple(value)
+            values[name] = value
+        settings = self._settings = Settings(values)
+        self._settings_stale = False
+
+        # Get metric TTL
+        self.metric_ttl = settings.interval * settings.ttl_multiplier
+
+        metric_filter = MetricFilter(settings.metrics_whitelist,
+                                     settings.metrics_blacklist,
+                                     self.METRIC_PATH_CACHE_SIZE)
+        if metric_filter:
+            self.metric_filter = metric_filter
+        else:
+            self.metric_filter = None
+
+        # Metric paths are built lazily from the config
+        self._reset_path_cache()
+
     def get_stats_for_upload(self, config=None):
         if config is None:
             config = self.config
@@ -264,30 +526,31 @@ class Collector(object):
         # collector function args, splay, interval)
         return {self.__class__.__name__: (self._run,
                                           None,
-                                          int(self.config['splay']),
-                                          int(self.config['interval']))}
+                                          self.settings.splay,
+                                          self.settings.interval)}
 
-    def get_metric_path(self, name, instance=None):
+    def _reset_path_cache(self):
         """
-        Get metric path.
-        Instance indicates that this is a metric for a
-            virtual machine and should have a different
-            root prefix.
+        Forget the precomputed path prefixes and the memoized metric paths.
+        Must be called whenever the path related config is changed.
+        """
+        self._path_prefixes = None
+        self._path_cache = LRUCache(self.METRIC_PATH_CACHE_SIZE)
+
+    def _get_path_prefixes(self):
+        """
+        Compute the (prefix, instance prefix, collector path) tuple used to
+        build metric paths
         """
         if 'path' in self.config:
             path = self.config['path']
         else:
             path = self.__class__.__name__
 
-        if instance is not None:
-            if 'instance_prefix' in self.config:
-                prefix = self.config['instance_prefix']
-            else:
-                prefix = 'instances'
-            if path == '.':
-                return '.'.join([prefix, instance, name])
-            else:
-                return '.'.join([prefix, instance, path, name])
+        if 'instance_prefix' in self.config:
+            instance_prefix = self.config['instance_prefix']
+        else:
+            instance_prefix = 'instances'
 
         if 'path_prefix' in self.config:
             prefix = self.config['path_prefix']
@@ -310,10 +573,38 @@ class Collector(object):
         if suffix:
             prefix = '.'.join((prefix, suffix))
 
-        if path == '.':
-            return '.'.join([prefix, name])
+        return (prefix, instance_prefix, path)
+
+    def get_metric_path(self, name, instance=None):
+        """
+        Get metric path.
+        Instance indicates that this is a metric for a
+            virtual machine and should have a different
+            root prefix.
+        """
+        if self._settings_stale:
+            self.load_settings()
+        key = (name, instance)
+        metric_path = self._path_cache.get(key)
+        if metric_path is not None:
+            return metric_path
+
+        if self._path_prefixes is None:
+            self._path_prefixes = self._get_path_prefixes()
+        prefix, instance_prefix, path = self._path_prefixes
+
+        if instance is not None:
+            if path == '.':
+                metric_path = '.'.join([instance_prefix, instance, name])
+            else:
+                metric_path = '.'.join([instance_prefix, instance, path, name])
+        elif path == '.':
+            metric_path = '.'.join([prefix, name])
         else:
-            return '.'.join([prefix, path, name])
+            metric_path = '.'.join([prefix, path, name])
+
+        self._path_cache.put(key, metric_path)
+        return metric_path
 
     def get_hostname(self):
         return get_hostname(self.config)
@@ -329,18 +620,32 @@ class Collector(object):
         """
         Publish a metric with the given name
         """
+        if self._settings_stale:
+            self.load_settings()
+        if (self.metric_filter is not None
+                and not self.metric_filter.accepts(name)):
+            self.metrics_filtered += 1
+            return
+
         # Get metric Path
         path = self.get_metric_path(name, instance=instance)
 
-        # Get metric TTL
-        ttl = float(self.config['interval']) * float(
-            self.config['ttl_multiplier'])
+        ttl = self.metric_ttl
 
-        # Create Metric
+        # Create Metric, skipping validation for the common numeric case
         try:
-            metric = Metric(path, value, raw_value=raw_value, timestamp=None,
-                            precision=precision, host=self.get_hostname(),
-                            metric_type=metric_type, ttl=ttl)
+            if (isinstance(value, (int, long, float))
+                    and metric_type in Metric._METRIC_TYPES):
+                metric = Metric.trusted(path, value, int(time.time()),
+                                        precision=precision,
+                                        host=self.get_hostname(),
+                                        metric_type=metric_type, ttl=ttl,
+                                        raw_value=raw_value)
+            else:
+                metric = Metric(path, value, raw_value=raw_value,
+                                timestamp=None, precision=precision,
+                                host=self.get_hostname(),
+                                metric_type=metric_type, ttl=ttl)
         except DiamondException:
             self.log.error(('Error when creating new Metric: path=%r, '
                             'value=%r'), path, value)
@@ -353,10 +658,80 @@ class Collector(object):
         """
         Publish a Metric object
         """
+        if (self.abandoned_threads
+                and threading.currentThread() in self.abandoned_threads):
+            return
+        self.metrics_emitted += 1
+        if self.run_batch is not None:
+            self.run_batch.append(metric)
+            return
         # Process Metric
         for handler in self.handlers:
             handler._process(metric)
 
+    def publish_many(self, metrics, precision=0, metric_type='GAUGE',
+                     instance=None):
+        """
+        Publish several metrics at once
+
+        Takes a dict or an iterable of (name, value) pairs sharing the same
+        precision, metric type and instance. Every handler receives the whole
+        batch in a single call.
+        """
+        if self._settings_stale:
+            self.load_settings()
+        if isinstance(metrics, dict):
+            metrics = metrics.iteritems()
+
+        # Values shared by the whole batch
+        ttl = self.metric_ttl
+        host = self.get_hostname()
+        timestamp = int(time.time())
+        trusted = metric_type in Metric._METRIC_TYPES
+        metric_filter = self.metric_filter
+
+        batch = []
+        for name, value in metrics:
+            if metric_filter is not None and not metric_filter.accepts(name):
+                self.metrics_filtered += 1
+                continue
+            path = self.get_metric_path(name, instance=instance)
+            try:
+                if trusted and isinstance(value, (int, long, float)):
+                    metric = Metric.trusted(path, value, timestamp,
+                                            precision=precision, host=host,
+                                            metric_type=metric_type, ttl=ttl)
+                else:
+                    metric = Metric(path, value, raw_value=None,
+                                    timestamp=timestamp, precision=precision,
+                                    host=host, metric_type=metric_type,
+                                    ttl=ttl)
+            except DiamondException:
+                self.log.error(('Error when creating new Metric: path=%r, '
+                                'value=%r'), path, value)
+                raise
+            batch.append(metric)
+
+        # Publish Metrics
+        self.publish_metrics(batch)
+
+    def publish_metrics(self, metrics):
+        """
+        Publish a list of Metric objects
+        """
+        if not metrics:
+            return
+        if (self.abandoned_threads
+                and threading.currentThread() in self.abandoned_threads):
+            return
+        self.metrics_emitted += len(metrics)
+        if self.run_batch is not None:
+            self.run_batch.extend(metrics)
+            return
+        # Process Metrics
+        for handler in self.handlers:
+            handler._process_batch(metrics)
+
     def publish_gauge(self, name, value, precision=0, instance=None):
         return self.publish(name, value, precision=precision,
                             metric_type='GAUGE', instance=instance)
@@ -364,6 +739,12 @@ class Collector(object):
     def publish_counter(self, name, value, precision=0, max_value=0,
                         time_delta=True, interval=None, allow_negative=False,
                         instance=None):
+        if self._settings_stale:
+            self.load_settings()
+        if (self.metric_filter is not None
+                and not self.metric_filter.accepts(name)):
+            self.metrics_filtered += 1
+            return
         raw_value = value
         value = self.derivative(name, value, max_value=max_value,
                                 time_delta=time_delta, interval=interval,
@@ -379,11 +760,20 @@ class Collector(object):
         """
         Calculate the derivative of the metric.
         """
-        # Format Metric Path
-        path = self.get_metric_path(name, instance=instance)
-
-        if path in self.last_values:
-            old = self.last_values[path]
+        # Format Counter Key
+        if self._counter_keys_by_path:
+            key = self.get_metric_path(name, instance=instance)
+        elif instance is None:
+            key = name
+        else:
+            key = (instance, name)
+        # A run abandoned after a timeout must not change the stored values
+        # the next runs compute their rates from
+        abandoned = (self.abandoned_threads and threading.currentThread()
+                     in self.abandoned_threads)
+
+        if key in self.last_values:
+            old = self.last_values[key]
             # Check for rollover
             if new < old:
                 old = old - max_value
@@ -392,7 +782,16 @@ class Collector(object):
 
             # If we pass in a interval, use it rather then the configured one
             if interval is None:
-                interval = int(self.config['interval'])
+                interval = self.settings.interval
+                # Values loaded from disk were recorded before a restart, so
+                # use the time that actually elapsed since then
+                if self.last_values.restored:
+                    if abandoned:
+                        recorded = self.last_values.restored.get(key)
+                    else:
+                        recorded = self.last_values.restored.pop(key, None)
+                    if recorded is not None and time.time() > recorded:
+                        interval = time.time() - recorded
 
             # Get Change in Y (time)
             if time_delta:
@@ -407,45 +806,222 @@ class Collector(object):
             result = 0
 
         # Store Old Value
-        self.last_values[path] = new
+        if not abandoned:
+            self.last_values[key] = new
 
         # Return result
         return result
 
     def _run(self):
+        """
+        Run the collector, profiling the run during a profiling session.
+        Returns the interval to use from now on in adaptive mode.
+        """
+        session = profiler.session
+        if session is not None:
+            return session.run_collector(self.__class__.__name__,
+                                         self._run_collection)
+        return self._run_collection()
+
+    def _run_collection(self):
         """
         Run the collector unless it's already running
         """
         if self.collect_running:
-            return
+            self.skipped_runs += 1
+            self.log.warning("Skipped run of %s, the previous run has not "
+                             "finished", self.__class__.__name__)
+            return self.adapted_interval
         # Log
         self.log.debug("Collecting data from: %s" % self.__class__.__name__)
         try:
             try:
                 start_time = time.time()
                 self.collect_running = True
+                self.run_batch = []
 
                 # Collect Data
-                self.collect()
+                run_timeout = self.settings.timeout
+                if self.process_pool is not None:
+                    self.process_pool.collect(self, run_timeout)
+                elif run_timeout > 0:
+                    timeout.run_with_timeout(self.collect, run_timeout,
+                                             self.__class__.__name__)
+                else:
+                    self.collect()
 
                 end_time = time.time()
 
-                if 'measure_collector_time' in self.config:
-                    if self.config['measure_collector_time']:
-                        metric_name = 'collector_time_ms'
-                        metric_value = int((end_time - start_time) * 1000)
-                        self.publish(metric_name, metric_value)
+                self.record_run_time(end_time - start_time)
+
+                if self.settings.measure_collector_time:
+                    self.publish_run_stats(end_time - start_time)
 
+            except timeout.CollectorTimeout, e:
+                self.timeouts += 1
+                self.log.error(str(e))
+                if e.thread is not None:
+                    self.abandoned_threads.add(e.thread)
+                self.publish('collector_timeouts', self.timeouts)
             except Exception:
                 # Log Error
                 self.log.error(traceback.format_exc())
+                self.errors += 1
         finally:
+            # Hand what the run published to the handlers in one batch
+            batch = self.run_batch
+            self.run_batch = None
+            if batch:
+                for handler in self.handlers:
+                    handler._process_batch(batch)
+            self.runs += 1
+            # Forget abandoned runs once they are over
+            for thread in list(self.abandoned_threads):
+                if not thread.isAlive():
+                    self.abandoned_threads.discard(thread)
+            # Evict counters that were not seen for a while
+            self.last_values.next_cycle()
+            # Periodically save the counters
+            if (time.time() - self.counter_state_saved
+                    >= self.settings.counter_state_save_interval):
+                self.save_counter_state()
             self.collect_running = False
             # After collector run, invoke a flush
             # method on each handler.
             for handler in self.handlers:
                 handler._flush()
 
+        if self.settings.adaptive_interval:
+            self.adapt_interval()
+        return self.adapted_interval
+
+    def get_interval(self):
+        """
+        Return the interval the collector currently runs at
+        """
+        if self.adapted_interval is not None:
+            return self.adapted_interval
+        return self.settings.interval
+
+    def record_run_time(self, run_time):
+        """
+        Remember how long a run took, and whether it overran the interval
+        """
+        self.run_times.append(run_time)
+        if run_time > self.get_interval():
+            self.overruns += 1
+            self.log.warning("%s took %.1fs, longer than its %ds interval",
+                             self.__class__.__name__, run_time,
+                             self.get_interval())
+
+    def get_internal_metrics(self):
+        """
+        Return the run statistics of the collector, for the internal metrics
+        """
+        metrics = {
+            'runs': self.runs,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'overruns': self.overruns,
+            'skipped_runs': self.skipped_runs,
+            'metrics_emitted': self.metrics_emitted,
+            'metrics_filtered': self.metrics_filtered,
+            'interval': self.get_interval(),
+            'counter_store_size': len(self.last_values),
+        }
+        if self.run_times:
+            metrics['run_time_ms'] = int(self.run_times[-1] * 1000)
+        return metrics
+
+    def publish_run_stats(self, run_time):
+        """
+        Publish the run time statistics of the collector
+        """
+        self.publish('collector_time_ms', int(run_time * 1000))
+        run_times = list(self.run_times)
+        for percent in (50, 90, 99):
+            self.publish('collector_time_p%d_ms' % percent,
+                         int(percentile(run_times, percent) * 1000))
+        self.publish('collector_overruns', self.overruns)
+        self.publish('collector_skipped_runs', self.skipped_runs)
+        self.publish('collector_interval', self.get_interval())
+        self.publish('counter_store_size', len(self.last_values))
+
+    def adapt_interval(self):
+        """
+        Stretch the interval while the median run time exceeds the allowed
+        fraction of it, and shrink it back once the collector is fast again
+        """
+        if len(self.run_times) < self.ADAPTIVE_MIN_SAMPLES:
+            return
+        recent = list(self.run_times)[-self.ADAPTIVE_MIN_SAMPLES:]
+        median = percentile(recent, 50)
+        threshold = self.settings.adaptive_threshold
+        configured = self.settings.interval
+        current = self.get_interval()
+
+        wanted = max(configured, int(math.ceil(median / threshold)))
+        wanted = min(wanted,
+                     configured * self.settings.adaptive_max_factor)
+        # Only shrink once the collector is well within the interval
+        if wanted < current and median > threshold * current / 2:
+            return
+        if wanted == current:
+            return
+
+        self.log.info("Changing the interval of %s from %ds to %ds, median "
+                      "run time is %.1fs", self.__class__.__name__, current,
+                      wanted, median)
+        self.adapted_interval = wanted
+        # Forget the samples taken at the old interval
+        self.run_times.clear()
+
+    def get_counter_state_file(self):
+        """
+        Return the file counter values are saved to, or None if disabled
+        """
+        if not self.config['counter_state_path']:
+            return None
+        return os.path.join(self.config['counter_state_path'],
+                            self.__class__.__name__ + '.counters')
+
+    def load_counter_state(self):
+        """
+        Load counter values saved by a previous run of the daemon
+        """
+        filename = self.get_counter_state_file()
+        if filename is None or not os.path.exists(filename):
+            return
+        try:
+            loaded = self.last_values.load(
+                filename, self.settings.counter_state_max_age)
+            self.log.debug("Loaded %d counters for %s from %s", loaded,
+                           self.__class__.__name__, filename)
+        except Exception:
+            self.log.error("Failed to load counters from %s. %s", filename,
+                           traceback.format_exc())
+
+    def save_counter_state(self):
+        """
+        Save counter values, so rates resume right after a restart
+        """
+        self.counter_state_saved = time.time()
+        filename = self.get_counter_state_file()
+        if filename is None:
+            return
+        try:
+            self.last_values.save(filename)
+        except Exception:
+            self.log.error("Failed to save counters to %s. %s", filename,
+                           traceback.format_exc())
+
+    def popen(self, *args, **kwargs):
+        """
+        Start a child process with subprocess.Popen. Processes started this
+        way are killed when a run exceeds the collector timeout.
+        """
+        return timeout.popen(*args, **kwargs)
+
     def find_binary(self, binary):
         """
         Scan and return the first path to a binary that we can find
@@ -0,0 +1,155 @@
+# coding=utf-8
+
+"""
+Storage for the previous value of every counter a collector derives.
+
+Collectors whose metric paths churn (per process, per container, per index
+...) would otherwise keep the last value of every path they have ever seen.
+The store remembers in which collection cycle each counter was last updated
+and evicts counters that have not been seen for `ttl` cycles, as well as the
+least recently seen counters once it holds more than `max_size` of them.
+
+The store can be saved to disk and loaded back, so that counters survive a
+daemon restart and rates resume on the first run after it.
+"""
+
+import os
+import time
+import tempfile
+
+try:
+    import cPickle as pickle
+    pickle  # workaround for pyflakes issue #13
+except ImportError:
+    import pickle as pickle
+
+STATE_VERSION = 1
+
+
+class CounterStore(object):
+    """
+    A dict-like mapping of counter key to last value with cycle based eviction
+    """
+
+    def __init__(self, ttl=0, max_size=0):
+        """
+        ttl: number of collection cycles a counter is kept without being
+             updated. 0 keeps counters forever.
+        max_size: maximum number of counters kept. 0 means unbounded.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cycle = 0
+        self.evicted = 0
+        # Time at which the current cycle started
+        self.now = time.time()
+        # key -> [value, cycle, cycle start time]
+        self.values = {}
+        # key -> time the value was recorded, for counters loaded from disk
+        # that have not been updated since
+        self.restored = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def __getitem__(self, key):
+        return self.values[key][0]
+
+    def __setitem__(self, key, value):
+        self.values[key] = [value, self.cycle, self.now]
+
+    def __delitem__(self, key):
+        del self.values[key]
+        self.restored.pop(key, None)
+
+    def get(self, key, default=None):
+        entry = self.values.get(key)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def clear(self):
+        self.values.clear()
+        self.restored.clear()
+
+    def next_cycle(self):
+        """
+        Finish the current collection cycle and evict stale counters
+        """
+        if self.ttl > 0:
+            oldest = self.cycle - self.ttl
+            stale = [key for key, entry in self.values.iteritems()
+                     if entry[1] < oldest]
+            for key in stale:
+                del self.values[key]
+            self.evicted += len(stale)
+
+        if self.max_size > 0 and len(self.values) > self.max_size:
+            excess = len(self.values) - self.max_size
+            entries = sorted(self.values.iteritems(),
+                             key=lambda item: item[1][1])
+            for key, entry in entries[:excess]:
+                del self.values[key]
+            self.evicted += excess
+
+        self.cycle += 1
+        self.now = time.time()
+        # Restored counters are either updated by now, or gone
+        self.restored.clear()
+
+    def save(self, filename):
+        """
+        Atomically write all counters and the time they were recorded to
+        filename
+        """
+        counters = {}
+        for key, entry in dict(self.values).iteritems():
+            counters[key] = (entry[0], entry[2])
+        state = {
+            'version': STATE_VERSION,
+            'saved': time.time(),
+            'counters': counters,
+        }
+
+        # Write to a temporary file first, so that a crash never leaves a
+        # truncated state file behind
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                       prefix='.counters')
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmpname, filename)
+        except:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            raise
+
+    def load(self, filename, max_age):
+        """
+        Load the counters saved in filename, discarding those recorded more
+        than max_age seconds ago. Returns the number of counters loaded.
+        """
+        f = open(filename, 'rb')
+        try:
+            state = pickle.load(f)
+        finally:
+            f.close()
+
+        if state.get('version') != STATE_VERSION:
+            return 0
+
+        oldest = time.time() - max_age
+        loaded = 0
+        for key, (value, timestamp) in state['counters'].iteritems():
+            if timestamp < oldest or key in self.values:
+                continue
+            self.values[key] = [value, self.cycle, timestamp]
+            self.restored[key] = timestamp
+            loaded += 1
+        return loaded
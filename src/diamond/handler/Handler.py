@@ -6,6 +6,10 @@ import traceback
 from configobj import ConfigObj
 import time
 
+from dispatch import DispatchQueue
+from diamond.instrumentation import Stats
+from diamond import profiler
+
 
 class Handler(object):
     """
@@ -35,6 +39,33 @@ class Handler(object):
         # Initialize Lock
         self.lock = threading.Lock()
 
+        # Internal metrics, updated with the lock held
+        self.stats = Stats()
+        # Name of the profile of the handler during profiling sessions
+        self._profile_key = 'handler-' + self.__class__.__name__
+
+        # Initialize the optional asynchronous dispatch queue
+        self.dispatch_queue = None
+        queue_size = int(self.config['queue_size'])
+        if queue_size > 0:
+            self.dispatch_queue = DispatchQueue(
+                self.__class__.__name__,
+                self._process_queued,
+                self._flush_locked,
+                queue_size,
+                overflow=self.config['queue_overflow'].lower().strip(),
+                block_timeout=float(self.config['queue_block_timeout']))
+
+        # Flush policy. Handlers with a linger time are flushed by the server
+        # flusher thread rather than after every collector run
+        self.flush_linger = float(self.config['flush_linger'])
+        self.flush_max_batch = int(self.config['flush_max_batch'])
+        self.flush_max_bytes = int(self.config['flush_max_bytes'])
+        # Metrics processed since the last flush
+        self.pending_metrics = 0
+        self.pending_bytes = 0
+        self.pending_since = 0
+
     def get_default_config_help(self):
         """
         Returns the help text for the configuration options for this handler
@@ -43,6 +74,19 @@ class Handler(object):
             'get_default_config_help': 'get_default_config_help',
             'server_error_interval': ('How frequently to send repeated server '
                                       'errors'),
+            'queue_size': ('Size of the asynchronous dispatch queue. 0 '
+                           'processes metrics in the collector thread'),
+            'queue_overflow': ('What to do when the dispatch queue is full: '
+                               'drop_oldest, drop_newest or block'),
+            'queue_block_timeout': ('How long to block a collector on a full '
+                                    'queue before dropping the metric'),
+            'flush_linger': ('Flush at most this many seconds after the first '
+                             'unflushed metric, instead of after every '
+                             'collector run. 0 flushes after every run'),
+            'flush_max_batch': ('Flush as soon as this many metrics are '
+                                'unflushed. 0 for no limit'),
+            'flush_max_bytes': ('Flush as soon as the unflushed metrics add '
+                                'up to this many bytes. 0 for no limit'),
         }
 
     def get_default_config(self):
@@ -52,16 +96,68 @@ class Handler(object):
         return {
             'get_default_config': 'get_default_config',
             'server_error_interval': 120,
+            'queue_size': 0,
+            'queue_overflow': 'drop_oldest',
+            'queue_block_timeout': 1,
+            'flush_linger': 0,
+            'flush_max_batch': 0,
+            'flush_max_bytes': 0,
         }
 
     def _process(self, metric):
         """
         Decorator for processing handlers with a lock, catching exceptions
         """
+        if self.dispatch_queue is not None:
+            self.dispatch_queue.put(metric)
+            return
         try:
             try:
+                start = time.time()
                 self.lock.acquire()
-                self.process(metric)
+                acquired = time.time()
+                session = profiler.session
+                if session is None:
+                    self.process(metric)
+                else:
+                    session.call(self._profile_key, self.process, metric)
+                self._track_pending((metric,))
+                self.stats.timing('lock_wait', acquired - start)
+                self.stats.timing('process', time.time() - acquired)
+            except Exception:
+                self.log.error(traceback.format_exc())
+        finally:
+            if self.lock.locked():
+                self.lock.release()
+
+    def _process_batch(self, metrics):
+        """
+        Decorator for processing a list of metrics with a single lock
+        acquisition, catching exceptions
+        """
+        if self.dispatch_queue is not None:
+            self.dispatch_queue.put_many(metrics)
+            return
+        self._process_queued(metrics)
+
+    def _process_queued(self, metrics):
+        """
+        Process metrics with the lock held, catching exceptions
+        """
+        try:
+            try:
+                start = time.time()
+                self.lock.acquire()
+                acquired = time.time()
+                session = profiler.session
+                if session is None:
+                    self.process_batch(metrics)
+                else:
+                    session.call(self._profile_key, self.process_batch,
+                                 metrics)
+                self._track_pending(metrics)
+                self.stats.timing('lock_wait', acquired - start)
+                self.stats.timing('process', time.time() - acquired)
             except Exception:
                 self.log.error(traceback.format_exc())
         finally:
@@ -76,14 +172,86 @@ class Handler(object):
         """
         raise NotImplementedError
 
+    def process_batch(self, metrics):
+        """
+        Process a list of metrics
+
+        Optional: Should be overridden in subclasses that can serialize a
+        whole batch at once. Falls back to calling process for each metric.
+        """
+        for metric in metrics:
+            try:
+                self.process(metric)
+            except Exception:
+                self.log.error(traceback.format_exc())
+
+    def _track_pending(self, metrics):
+        """
+        Account for processed metrics and flush once the batch or byte limit
+        is reached. Must be called with the lock held.
+        """
+        if not self.pending_metrics:
+            self.pending_since = time.time()
+        self.pending_metrics += len(metrics)
+        if self.flush_max_bytes > 0:
+            for metric in metrics:
+                self.pending_bytes += len(str(metric))
+
+        if ((self.flush_max_batch > 0
+                and self.pending_metrics >= self.flush_max_batch)
+                or (self.flush_max_bytes > 0
+                    and self.pending_bytes >= self.flush_max_bytes)):
+            self.flush()
+            self._reset_pending()
+
+    def _reset_pending(self):
+        self.pending_metrics = 0
+        self.pending_bytes = 0
+
     def _flush(self):
+        """
+        Called after every collector run. Flushes the handler, unless it has a
+        linger time, in which case the flusher thread takes care of it.
+        """
+        if self.flush_linger > 0:
+            return
+        self._request_flush()
+
+    def _flush_if_due(self, now):
+        """
+        Flush the handler if its oldest unflushed metric has lingered long
+        enough
+        """
+        if (self.pending_metrics
+                and now - self.pending_since >= self.flush_linger):
+            self._request_flush()
+
+    def _request_flush(self):
         """
         Decorator for flushing handlers with an lock, catching exceptions
         """
+        if self.dispatch_queue is not None:
+            self.dispatch_queue.request_flush()
+            return
+        self._flush_locked()
+
+    def _flush_locked(self):
+        """
+        Flush the handler with the lock held, catching exceptions
+        """
         try:
             try:
+                start = time.time()
                 self.lock.acquire()
-                self.flush()
+                acquired = time.time()
+                session = profiler.session
+                if session is None:
+                    self.flush()
+                else:
+                    session.call(self._profile_key, self.flush)
+                self._reset_pending()
+                self.stats.timing('lock_wait', acquired - start)
+                self.stats.timing('flush', time.time() - acquired)
             except Exception:
                 self.log.error(traceback.format_exc())
         finally:
@@ -98,6 +266,40 @@ class Handler(object):
         """
         pass
 
+    def get_queue_stats(self):
+        """
+        Return the depth and drop count of the dispatch queue
+        """
+        if self.dispatch_queue is None:
+            return {'depth': 0, 'dropped': 0}
+        return {
+            'depth': self.dispatch_queue.qsize(),
+            'dropped': self.dispatch_queue.dropped,
+        }
+
+    def get_internal_metrics(self):
+        """
+        Return the metrics of the handler itself: process and flush latency,
+        lock wait time, backlog and whatever the handler counts in self.stats
+        """
+        metrics = self.stats.snapshot()
+        queue_stats = self.get_queue_stats()
+        metrics['queue_depth'] = queue_stats['depth']
+        metrics['queue_dropped'] = queue_stats['dropped']
+        metrics['unflushed'] = self.pending_metrics
+        return metrics
+
+    def _shutdown(self, timeout=None):
+        """
+        Flush what is left and stop the dispatch queue, if any
+        """
+        if self.dispatch_queue is not None:
+            if self.flush_linger > 0:
+                self.dispatch_queue.request_flush()
+            self.dispatch_queue.stop(timeout)
+        elif self.flush_linger > 0:
+            self._flush_locked()
+
     def _throttle_error(self, msg, *args, **kwargs):
         """
         Avoids sending errors repeatedly. Waits at least
@@ -0,0 +1,74 @@
+# coding=utf-8
+
+"""
+Pack newline terminated lines into as few UDP datagrams as possible.
+
+Line based UDP protocols (graphite plaintext, statsd) accept several lines
+per datagram. Filling each datagram up to the MTU instead of sending a
+datagram per line cuts the number of packets and system calls, and keeps
+every datagram small enough not to be fragmented or rejected.
+"""
+
+import socket
+
+
+def datagram_ranges(lines, mtu):
+    """
+    Group lines, which must end with a newline, into datagrams of at most
+    mtu bytes. Returns the (start, end) slice of lines of every datagram. A
+    line longer than the mtu is sent alone.
+    """
+    ranges = []
+    start = 0
+    size = 0
+    for i, line in enumerate(lines):
+        length = len(line)
+        if size and size + length > mtu:
+            ranges.append((start, i))
+            start = i
+            size = 0
+        size += length
+    if size:
+        ranges.append((start, len(lines)))
+    return ranges
+
+
+def pack_datagrams(lines, mtu):
+    """
+    Join lines into datagrams of at most mtu bytes
+    """
+    return [''.join(lines[start:end])
+            for start, end in datagram_ranges(lines, mtu)]
+
+
+class DatagramSender(object):
+    """
+    Sends packed lines to host:port over UDP
+    """
+
+    def __init__(self, host, port, mtu):
+        self.address = (host, port)
+        self.mtu = mtu
+        self.socket = None
+        self.datagrams_sent = 0
+
+    def send(self, lines):
+        """
+        Send lines in as few datagrams as the mtu allows. Returns the number
+        of bytes sent.
+        """
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sent = 0
+        # Python has no sendmmsg, so one sendto per datagram
+        sendto = self.socket.sendto
+        address = self.address
+        for datagram in pack_datagrams(lines, self.mtu):
+            sent += sendto(datagram, address)
+            self.datagrams_sent += 1
+        return sent
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+        self.socket = None
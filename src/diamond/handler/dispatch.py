@@ -0,0 +1,213 @@
+# coding=utf-8
+
+"""
+Bounded, in-memory dispatch queue used to decouple collectors from handlers.
+
+When a handler is configured with a `queue_size` greater than zero, metrics
+published by collectors are only appended to the handler's queue. A dedicated
+worker thread drains the queue and feeds the metrics to the handler, so a slow
+or unreachable sink no longer stalls the collector threads.
+"""
+
+import threading
+import time
+from collections import deque
+
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_BLOCK = 'block'
+
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST,
+                     OVERFLOW_DROP_NEWEST,
+                     OVERFLOW_BLOCK)
+
+
+class DispatchQueue(object):
+    """
+    A bounded queue with its own worker thread.
+
+    `process` is called by the worker with a list of queued items, and
+    `flush` is called once the queue has been drained after a flush has been
+    requested.
+    """
+
+    def __init__(self, name, process, flush, maxsize,
+                 overflow=OVERFLOW_DROP_OLDEST, block_timeout=1.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Invalid queue overflow policy: %r" % overflow)
+
+        self.name = name
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        self._process = process
+        self._flush = flush
+        self._queue = deque()
+        self._cond = threading.Condition(threading.Lock())
+        self._flush_requested = False
+        self._busy = False
+        self._running = False
+        self._thread = None
+
+        # Statistics
+        self.dropped = 0
+        self.processed = 0
+
+    def qsize(self):
+        """
+        Return the number of queued items
+        """
+        return len(self._queue)
+
+    def put(self, item):
+        """
+        Queue a single item, applying the overflow policy if the queue is full
+        """
+        self._cond.acquire()
+        try:
+            self._start()
+            if len(self._queue) >= self.maxsize:
+                if not self._make_room():
+                    self.dropped += 1
+                    return False
+            self._queue.append(item)
+            self._cond.notify()
+            return True
+        finally:
+            self._cond.release()
+
+    def put_many(self, items):
+        """
+        Queue several items with a single lock acquisition
+        """
+        self._cond.acquire()
+        try:
+            self._start()
+            for item in items:
+                if len(self._queue) >= self.maxsize:
+                    if not self._make_room():
+                        self.dropped += 1
+                        continue
+                self._queue.append(item)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def request_flush(self):
+        """
+        Ask the worker to flush the handler once the queue has been drained
+        """
+        self._cond.acquire()
+        try:
+            self._start()
+            self._flush_requested = True
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def join(self, timeout=None):
+        """
+        Wait until the queue is empty and the worker is idle. Returns True if
+        the queue was drained in time.
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self._cond.acquire()
+        try:
+            while self._queue or self._busy or self._flush_requested:
+                if not self._running:
+                    return False
+                if timeout is None:
+                    self._cond.wait(1.0)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            return True
+        finally:
+            self._cond.release()
+
+    def stop(self, timeout=None):
+        """
+        Drain the queue and stop the worker thread
+        """
+        self.join(timeout)
+        self._cond.acquire()
+        try:
+            self._running = False
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _make_room(self):
+        """
+        Apply the overflow policy. Must be called with the lock held. Returns
+        True if the new item can be appended.
+        """
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            self._queue.popleft()
+            self.dropped += 1
+            return True
+
+        if self.overflow == OVERFLOW_BLOCK:
+            deadline = time.time() + self.block_timeout
+            while len(self._queue) >= self.maxsize and self._running:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return len(self._queue) < self.maxsize
+
+        return False
+
+    def _start(self):
+        """
+        Start the worker thread on first use. Must be called with the lock
+        held.
+        """
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._worker,
+                                        name='%s-dispatch' % self.name)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _worker(self):
+        while True:
+            self._cond.acquire()
+            try:
+                while (self._running
+                        and not self._queue
+                        and not self._flush_requested):
+                    self._cond.wait(1.0)
+                if not self._running and not self._queue:
+                    return
+                items = list(self._queue)
+                self._queue.clear()
+                flush = self._flush_requested
+                self._flush_requested = False
+                self._busy = True
+                # Wake up producers blocked on a full queue
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
+
+            try:
+                if items:
+                    self._process(items)
+                    self.processed += len(items)
+                if flush:
+                    self._flush()
+            finally:
+                self._cond.acquire()
+                try:
+                    self._busy = False
+                    self._cond.notifyAll()
+                finally:
+                    self._cond.release()
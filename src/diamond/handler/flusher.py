@@ -0,0 +1,69 @@
+# coding=utf-8
+
+"""
+Central flusher for handlers with a flush linger time.
+
+Handlers configured with `flush_linger` are not flushed after every collector
+run. Instead a single thread checks them periodically and flushes those whose
+oldest unflushed metric has waited for `flush_linger` seconds, so that metrics
+published by many collectors are sent in fewer, larger writes.
+"""
+
+import threading
+import time
+
+
+class HandlerFlusher(object):
+    """
+    A thread flushing lingering handlers when their linger time is up
+    """
+
+    # Bounds of the time between two checks
+    MIN_TICK = 0.05
+    MAX_TICK = 1.0
+
+    def __init__(self, handlers):
+        self.handlers = [handler for handler in handlers
+                         if handler.flush_linger > 0]
+        self.tick = self.MAX_TICK
+        if self.handlers:
+            # Check often enough to flush within a tenth of the linger time
+            shortest = min([handler.flush_linger for handler in self.handlers])
+            self.tick = max(self.MIN_TICK, min(self.MAX_TICK, shortest / 10))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start the flusher thread, if any handler lingers
+        """
+        if not self.handlers or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='handler-flusher')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the flusher thread
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def flush_due(self):
+        """
+        Flush the handlers whose linger time is up
+        """
+        now = time.time()
+        for handler in self.handlers:
+            handler._flush_if_due(now)
+
+    def _run(self):
+        while not self._stop.isSet():
+            self.flush_due()
+            self._stop.wait(self.tick)
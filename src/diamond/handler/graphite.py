@@ -17,6 +17,11 @@ use it.
 """
 
 from Handler import Handler
+from datagram import datagram_ranges
+from spool import Spool
+from spool import SpoolDrainer
+from transport import AsyncTransport
+import os
 import socket
 
 
@@ -43,14 +48,45 @@ class GraphiteHandler(Handler):
         self.keepalive = bool(self.config['keepalive'])
         self.keepaliveinterval = int(self.config['keepaliveinterval'])
         self.batch_size = int(self.config['batch'])
+        self.udp_mtu = int(self.config['udp_mtu'])
         self.max_backlog_multiplier = int(
             self.config['max_backlog_multiplier'])
         self.trim_backlog_multiplier = int(
             self.config['trim_backlog_multiplier'])
         self.metrics = []
 
+        # In async mode an I/O thread owns the connection, and _send only
+        # hands the data over to it
+        self.transport = None
+        transport = self.config['transport'].lower().strip()
+        if transport == 'async':
+            self.transport = AsyncTransport(
+                self.host, self.port, self.proto,
+                max_buffer=int(self.config['async_buffer_bytes']),
+                min_delay=float(self.config['reconnect_min_delay']),
+                max_delay=float(self.config['reconnect_max_delay']),
+                timeout=self.timeout, on_overflow=self._spool_data,
+                name='%s-transport' % self.__class__.__name__)
+            self.transport.start()
+        elif transport != 'blocking':
+            raise ValueError("Unknown transport: %s" % transport)
+
+        # Spool the backlog to disk rather than trimming it
+        self.spool = None
+        self.spool_drainer = None
+        if self.config['spool_path']:
+            self.spool = Spool(self._spool_directory(),
+                               int(self.config['spool_max_bytes']),
+                               int(self.config['spool_segment_bytes']))
+            self.spool_drainer = SpoolDrainer(
+                self.spool, self._send_spooled,
+                float(self.config['spool_drain_rate']),
+                on_error=self._spool_error)
+            self.spool_drainer.start()
+
         # Connect
-        self._connect()
+        if self.transport is None:
+            self._connect()
 
     def get_default_config_help(self):
         """
@@ -68,6 +104,24 @@ class GraphiteHandler(Handler):
             'trim_backlog_multiplier': 'Trim down how many batches',
             'keepalive': 'Enable keepalives for tcp streams',
             'keepaliveinterval': 'How frequently to send keepalives',
+            'udp_mtu': ('Largest datagram sent with proto = udp. A batch '
+                        'is sent in as few datagrams as fit'),
+            'spool_path': ('Directory to spool the backlog to instead of '
+                           'trimming it. Empty to disable'),
+            'spool_max_bytes': ('Size of the spool, beyond which the oldest'
+                                ' data is dropped'),
+            'spool_segment_bytes': 'Size of the spool segment files',
+            'spool_drain_rate': ('Bytes per second sent from the spool once '
+                                 'the server is reachable again'),
+            'transport': ('blocking: send from the threads publishing '
+                          'metrics. async: send from a dedicated thread '
+                          'with a non-blocking socket'),
+            'async_buffer_bytes': ('Data buffered by the async transport '
+                                   'beyond which the oldest is spooled or '
+                                   'dropped'),
+            'reconnect_min_delay': ('First delay before reconnecting, '
+                                    'doubled after each failure (async)'),
+            'reconnect_max_delay': 'Longest delay before reconnecting (async)',
         })
 
         return config
@@ -88,6 +142,15 @@ class GraphiteHandler(Handler):
             'trim_backlog_multiplier': 4,
             'keepalive': 0,
             'keepaliveinterval': 10,
+            'udp_mtu': 1432,
+            'spool_path': '',
+            'spool_max_bytes': 104857600,
+            'spool_segment_bytes': 8388608,
+            'spool_drain_rate': 1048576,
+            'transport': 'blocking',
+            'async_buffer_bytes': 16777216,
+            'reconnect_min_delay': 0.5,
+            'reconnect_max_delay': 60,
         })
 
         return config
@@ -107,6 +170,14 @@ class GraphiteHandler(Handler):
         if len(self.metrics) >= self.batch_size:
             self._send()
 
+    def process_batch(self, metrics):
+        """
+        Process a list of metrics, sending them to graphite in one write
+        """
+        self.metrics.extend([str(metric) for metric in metrics])
+        if len(self.metrics) >= self.batch_size:
+            self._send()
+
     def flush(self):
         """Flush metrics in queue"""
         self._send()
@@ -122,27 +193,43 @@ class GraphiteHandler(Handler):
             self._close()
             self._throttle_error("GraphiteHandler: Socket error, "
                                  "trying reconnect.")
+            self.stats.incr('reconnects')
             self._connect()
             self.socket.sendall(data)
             self._reset_errors()
+        self.stats.incr('bytes_sent', len(data))
 
     def _send(self):
         """
         Send data to graphite. Data that can not be sent will be queued.
         """
+        if self.transport is not None:
+            for data, count in self._packets():
+                self.transport.send(data)
+            self.metrics = []
+            return
+
         # Check to see if we have a valid socket. If not, try to connect.
         try:
             try:
                 if self.socket is None:
                     self.log.debug("GraphiteHandler: Socket is not connected. "
                                    "Reconnecting.")
+                    self.stats.incr('reconnects')
                     self._connect()
                 if self.socket is None:
                     self.log.debug("GraphiteHandler: Reconnect failed.")
                 else:
-                    # Send data to socket
-                    self._send_data(''.join(self.metrics))
-                    self.metrics = []
+                    # Send data to socket. Metrics are dropped from the
+                    # backlog as they are sent, so that the datagrams sent
+                    # before an error are not sent again
+                    sent = 0
+                    try:
+                        for data, count in self._packets():
+                            self._send_data(data)
+                            sent += count
+                    finally:
+                        del self.metrics[:sent]
             except Exception:
                 self._close()
                 self._throttle_error("GraphiteHandler: Error sending metrics.")
@@ -150,13 +237,151 @@ class GraphiteHandler(Handler):
         finally:
             if len(self.metrics) >= (
                     self.batch_size * self.max_backlog_multiplier):
-                trim_offset = (self.batch_size
-                               * self.trim_backlog_multiplier * -1)
-                self.log.warn('GraphiteHandler: Trimming backlog. Removing'
-                              + ' oldest %d and keeping newest %d metrics',
-                              len(self.metrics) - abs(trim_offset),
-                              abs(trim_offset))
-                self.metrics = self.metrics[trim_offset:]
+                if self.spool is None or not self._spool_backlog():
+                    self._trim_backlog()
+
+    def _packets(self):
+        """
+        Split the backlog in the writes to send: datagrams that fit the mtu
+        over UDP, a single write over TCP. Returns (data, number of metrics)
+        pairs.
+        """
+        if self.proto == 'udp':
+            return [(''.join(self.metrics[start:end]), end - start)
+                    for start, end in datagram_ranges(self.metrics,
+                                                      self.udp_mtu)]
+        return [(''.join(self.metrics), len(self.metrics))]
+
+    def _trim_backlog(self):
+        """
+        Drop the oldest metrics of the backlog
+        """
+        trim_offset = (self.batch_size
+                       * self.trim_backlog_multiplier * -1)
+        self.log.warn('GraphiteHandler: Trimming backlog. Removing'
+                      + ' oldest %d and keeping newest %d metrics',
+                      len(self.metrics) - abs(trim_offset),
+                      abs(trim_offset))
+        self.stats.incr('trimmed',
+                        len(self.metrics) - abs(trim_offset))
+        self.metrics = self.metrics[trim_offset:]
+
+    def _spool_directory(self):
+        """
+        The directory of the spool of this handler within spool_path. The
+        multi graphite handlers give every server its own directory, and
+        set `instance` to tell apart instances on the same host and port.
+        """
+        name = '%s_%d' % (self.host, self.port)
+        if self.config.get('instance'):
+            name += '_%s' % self.config['instance']
+        return os.path.join(self.config['spool_path'], name)
+
+    def _spool_data(self, data):
+        """
+        Spool data the async transport has no room for. Returns False if
+        it could not be written.
+        """
+        if self.spool is None:
+            return False
+        try:
+            self.spool.append(data)
+        except (IOError, OSError), e:
+            self._throttle_error("GraphiteHandler: Failed to spool %d "
+                                 "bytes. %s", len(data), e)
+            return False
+        return True
+
+    def _spool_backlog(self):
+        """
+        Move the backlog to the spool. Returns False if it could not be
+        written.
+        """
+        try:
+            self.spool.append(''.join(self.metrics))
+        except (IOError, OSError), e:
+            self._throttle_error("GraphiteHandler: Failed to spool %d "
+                                 "metrics. %s", len(self.metrics), e)
+            return False
+        self.log.debug("GraphiteHandler: Spooled %d metrics",
+                       len(self.metrics))
+        self.stats.incr('spooled', len(self.metrics))
+        self.metrics = []
+        return True
+
+    def _spool_error(self, e):
+        """
+        Report an error of the spool drainer thread
+        """
+        self._throttle_error("GraphiteHandler: Failed to read the spool. %s",
+                             e)
+
+    def _send_spooled(self, data):
+        """
+        Send data read from the spool, if the server is reachable. Called by
+        the spool drainer thread.
+        """
+        if self.transport is not None:
+            # Only refill the buffer of a live connection, so data does not
+            # bounce between the buffer and the spool
+            if (not self.transport.connected
+                    or self.transport.buffered
+                    >= self.transport.max_buffer / 2):
+                return False
+            self.transport.send(data)
+            self.stats.incr('spool_replayed_bytes', len(data))
+            return True
+
+        # Reconnecting is left to the publishing threads: a connection
+        # attempt may take up to timeout seconds, and would hold the lock
+        # they wait for
+        if self.socket is None:
+            return False
+        self.lock.acquire()
+        try:
+            if self.socket is None:
+                return False
+            try:
+                self._send_data(data)
+            except Exception:
+                self._close()
+                return False
+            self.stats.incr('spool_replayed_bytes', len(data))
+            return True
+        finally:
+            self.lock.release()
+
+    def get_internal_metrics(self):
+        metrics = super(GraphiteHandler, self).get_internal_metrics()
+        if self.transport is not None:
+            metrics['bytes_sent'] = self.transport.bytes_sent
+            metrics['reconnects'] = self.transport.reconnects
+            metrics['async_buffered_bytes'] = self.transport.buffered
+            metrics['async_dropped_bytes'] = self.transport.dropped_bytes
+        if self.spool is not None:
+            metrics['spool_bytes'] = len(self.spool)
+            metrics['spool_dropped_bytes'] = self.spool.dropped_bytes
+        return metrics
+
+    def _shutdown(self, timeout=None):
+        """
+        Flush what is left, and spool what could not be sent
+        """
+        super(GraphiteHandler, self)._shutdown(timeout)
+        if self.spool_drainer is not None:
+            self.spool_drainer.stop(timeout)
+        if self.transport is not None:
+            for data in self.transport.stop(timeout):
+                self._spool_data(data)
+        if self.spool is None:
+            return
+        self.lock.acquire()
+        try:
+            if self.metrics:
+                self._spool_backlog()
+            self.spool.close()
+        finally:
+            self.lock.release()
 
     def _connect(self):
         """
@@ -89,6 +89,24 @@ class GraphitePickleHandler(GraphiteHandler):
             # Clear Batch
             self.batch = []
 
+    def process_batch(self, metrics):
+        """
+        Process a list of metrics, pickling them into as few messages as the
+        batch size allows
+        """
+        self.batch.extend([(metric.path, (metric.timestamp, metric.value))
+                           for metric in metrics])
+        if len(self.batch) >= self.batch_size:
+            # Log
+            self.log.debug("GraphitePickleHandler: Sending batch size: %d",
+                           len(self.batch))
+            # Pickle the batch of metrics
+            self.metrics = [self._pickle_batch()]
+            # Send pickled batch
+            self._send()
+            # Clear Batch
+            self.batch = []
+
     def _pickle_batch(self):
         """
         Pickle the metrics into a form that can be understood
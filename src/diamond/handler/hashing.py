@@ -0,0 +1,132 @@
+# coding=utf-8
+
+"""
+Consistent hashing of metric paths to graphite destinations.
+
+The ring is the one carbon-relay uses with RELAY_METHOD = consistent-hashing:
+every destination (server, instance) is placed 100 times on a ring of 2^16
+positions, at the first 4 hex digits of the md5 of "('server', 'instance'):i",
+and a metric goes to the first destinations found on the ring from the
+position of its path. Given the same DESTINATIONS, diamond and carbon-relay
+send a metric to the same carbon-cache, so diamond can replace the relay.
+"""
+
+import bisect
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from diamond.util import LRUCache
+
+
+def compact_hash(string):
+    return int(md5(string).hexdigest()[:4], 16)
+
+
+class ConsistentHashRing(object):
+    """
+    carbon.hashing.ConsistentHashRing
+    """
+
+    def __init__(self, nodes, replica_count=100):
+        self.ring = []
+        self.positions = set()
+        self.nodes = set()
+        self.replica_count = replica_count
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        self.nodes.add(node)
+        for i in range(self.replica_count):
+            position = compact_hash("%s:%d" % (node, i))
+            while position in self.positions:
+                position += 1
+            self.positions.add(position)
+            bisect.insort(self.ring, (position, node))
+
+    def get_nodes(self, key):
+        """
+        Return every node, in ring order from the position of key
+        """
+        nodes = []
+        position = compact_hash(key)
+        index = bisect.bisect_left(self.ring, (position, None)) % len(
+            self.ring)
+        last_index = (index - 1) % len(self.ring)
+        while len(nodes) < len(self.nodes) and index != last_index:
+            node = self.ring[index][1]
+            if node not in nodes:
+                nodes.append(node)
+            index = (index + 1) % len(self.ring)
+        return nodes
+
+
+def parse_destination(destination):
+    """
+    Split a carbon-relay style destination, host[:port[:instance]], into a
+    (host, port, instance) tuple. port and instance default to None.
+    """
+    parts = destination.strip().split(':')
+    host = parts[0]
+    port = None
+    instance = None
+    if len(parts) > 1 and parts[1]:
+        port = int(parts[1])
+    if len(parts) > 2 and parts[2]:
+        instance = parts[2]
+    return (host, port, instance)
+
+
+class MetricRouter(object):
+    """
+    Picks the destinations of a metric path like carbon-relay's
+    ConsistentHashingRouter: the first replication_factor destinations on
+    distinct servers
+    """
+
+    def __init__(self, destinations, replication_factor=1,
+                 cache_size=10000):
+        """
+        destinations is a list of (host, instance) tuples
+        """
+        self.replication_factor = replication_factor
+        self.ring = ConsistentHashRing(destinations)
+        # Destinations, by (host, instance)
+        self.index = dict([(destination, i)
+                           for i, destination in enumerate(destinations)])
+        # path -> indexes into destinations
+        self.cache = LRUCache(cache_size)
+
+    def get_destinations(self, path):
+        """
+        Return the indexes of the destinations of a metric path
+        """
+        indexes = self.cache.get(path)
+        if indexes is None:
+            indexes = []
+            servers = set()
+            for node in self.ring.get_nodes(path):
+                if node[0] in servers:
+                    continue
+                servers.add(node[0])
+                indexes.append(self.index[node])
+                if len(servers) >= self.replication_factor:
+                    break
+            self.cache.put(path, indexes)
+        return indexes
+
+    def group(self, metrics):
+        """
+        Return a dict of destination index to the list of metrics going there
+        """
+        groups = {}
+        for metric in metrics:
+            for index in self.get_destinations(metric.path):
+                group = groups.get(index)
+                if group is None:
+                    group = groups[index] = []
+                group.append(metric)
+        return groups
@@ -18,6 +18,7 @@ Enable this handler
 
 from Handler import Handler
 from graphite import GraphiteHandler
+from copy import deepcopy
 
 
 class HostedGraphiteHandler(Handler):
@@ -31,7 +32,12 @@ class HostedGraphiteHandler(Handler):
 
         self.key = self.config['apikey'].lower().strip()
 
-        self.graphite = GraphiteHandler(self.config)
+        # This handler queues, locks and flushes; the GraphiteHandler only
+        # sends, under the same lock
+        config = deepcopy(self.config)
+        config['queue_size'] = 0
+        self.graphite = GraphiteHandler(config)
+        self.lock = self.graphite.lock
 
     def get_default_config_help(self):
         """
@@ -78,15 +84,22 @@ class HostedGraphiteHandler(Handler):
         metric = self.key + '.' + str(metric)
         self.graphite.process(metric)
 
-    def _process(self, metric):
+    def process_batch(self, metrics):
         """
-        Process a metric by sending it to graphite
+        Process a list of metrics by sending them to graphite
         """
-        metric = self.key + '.' + str(metric)
-        self.graphite._process(metric)
-
-    def _flush(self):
-        self.graphite._flush()
+        self.graphite.process_batch([self.key + '.' + str(metric)
+                                     for metric in metrics])
+
+    def _shutdown(self, timeout=None):
+        super(HostedGraphiteHandler, self)._shutdown(timeout)
+        self.graphite._shutdown(timeout)
+
+    def get_internal_metrics(self):
+        metrics = self.graphite.get_internal_metrics()
+        metrics.update(super(HostedGraphiteHandler,
+                             self).get_internal_metrics())
+        return metrics
 
     def flush(self):
         self.graphite.flush()
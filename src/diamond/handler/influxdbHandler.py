@@ -134,6 +134,19 @@ class InfluxdbHandler(Handler):
             # Send pickled batch
             self._send()
 
+    def process_batch(self, metrics):
+        # Add all the data to the batch
+        for metric in metrics:
+            self.batch.setdefault(metric.path, []).append([metric.timestamp,
+                                                           metric.value])
+        self.batch_count += len(metrics)
+        # If there are sufficient metrics, then send them in one request
+        if self.batch_count >= self.batch_size:
+            # Log
+            self.log.debug("InfluxdbHandler: Sending batch size: %d",
+                           self.batch_count)
+            self._send()
+
     def _send(self):
         """
         Send data to Influxdb. Data that can not be sent will be kept in queued.
@@ -4,10 +4,18 @@
 Send metrics to a [graphite](http://graphite.wikidot.com/) using the default
 interface. Unlike GraphiteHandler, this one supports multiple graphite servers.
 Specify them as a list of hosts divided by comma.
+
+Every metric is sent to all the hosts, unless relay_method is set to
+consistent-hashing. Each metric then only goes to replication_factor hosts,
+picked the way carbon-relay does with the same hosts as DESTINATIONS, which
+takes the relay out of the path. Hosts can be given as host:port:instance
+like carbon-relay destinations.
 """
 
 from Handler import Handler
 from graphite import GraphiteHandler
+from hashing import MetricRouter
+from hashing import parse_destination
 from copy import deepcopy
 
 
@@ -28,9 +36,33 @@ class MultiGraphiteHandler(Handler):
 
         # Initialize Options
         hosts = self.config['host']
-        for host in hosts:
+        if isinstance(hosts, basestring):
+            hosts = [hosts]
+        hosts = [parse_destination(destination) for destination in hosts]
+        destinations = [(host, instance) for host, port, instance in hosts]
+
+        self.router = None
+        if self.config['relay_method'] == 'consistent-hashing':
+            # The ring knows destinations by (host, instance) only
+            for i, destination in enumerate(destinations):
+                if destination in destinations[:i]:
+                    raise ValueError(
+                        "Destinations on the same host need distinct "
+                        "instances with consistent-hashing, as with "
+                        "carbon-relay: %s" % self.config['host'])
+            self.router = MetricRouter(
+                destinations, int(self.config['replication_factor']))
+        elif self.config['relay_method'] != 'all':
+            raise ValueError("Unknown relay_method: %s"
+                             % self.config['relay_method'])
+
+        for host, port, instance in hosts:
             config = deepcopy(self.config)
             config['host'] = host
+            if port is not None:
+                config['port'] = port
+            if instance is not None:
+                config['instance'] = instance
             self.handlers.append(GraphiteHandler(config))
 
     def get_default_config_help(self):
@@ -40,13 +72,20 @@ class MultiGraphiteHandler(Handler):
         config = super(MultiGraphiteHandler, self).get_default_config_help()
 
         config.update({
-            'host': 'Hostname, Hostname, Hostname',
+            'host': ('Hostname, Hostname, Hostname. Each can be given as '
+                     'host:port:instance'),
             'port': 'Port',
             'proto': 'udp or tcp',
             'timeout': '',
             'batch': 'How many to store before sending to the graphite server',
             'max_backlog_multiplier': 'how many batches to store before trimming',  # NOQA
             'trim_backlog_multiplier': 'Trim down how many batches',
+            'relay_method': ('all: send every metric to every host. '
+                             'consistent-hashing: shard metrics over the '
+                             'hosts like carbon-relay. Hosts on the same '
+                             'address need distinct instances'),
+            'replication_factor': ('Number of hosts each metric is sent to '
+                                   'with consistent-hashing'),
         })
 
         return config
@@ -65,6 +104,8 @@ class MultiGraphiteHandler(Handler):
             'batch': 1,
             'max_backlog_multiplier': 5,
             'trim_backlog_multiplier': 4,
+            'relay_method': 'all',
+            'replication_factor': 1,
         })
 
         return config
@@ -74,8 +115,24 @@ class MultiGraphiteHandler(Handler):
         Process a metric by passing it to GraphiteHandler
         instances
         """
-        for handler in self.handlers:
-            handler.process(metric)
+        if self.router is None:
+            for handler in self.handlers:
+                handler.process(metric)
+            return
+        for index in self.router.get_destinations(metric.path):
+            self.handlers[index].process(metric)
+
+    def process_batch(self, metrics):
+        """
+        Process a list of metrics by passing it to GraphiteHandler
+        instances
+        """
+        if self.router is None:
+            for handler in self.handlers:
+                handler.process_batch(metrics)
+            return
+        for index, group in self.router.group(metrics).items():
+            self.handlers[index].process_batch(group)
 
     def flush(self):
         """Flush metrics in queue"""
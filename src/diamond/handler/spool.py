@@ -0,0 +1,279 @@
+# coding=utf-8
+
+"""
+On-disk spool for data a handler could not send.
+
+The spool is a directory of append-only segment files. Each record is a
+4 byte big endian length followed by the data. Records are appended to the
+newest segment, and a new segment is started once it reaches the segment
+size. They are read back in order from the oldest segment, which is deleted
+once it has been read entirely, so both writes and reads are sequential.
+
+When the spool grows past its size cap the oldest segments are deleted, so
+a long outage loses the oldest data rather than filling the disk.
+
+Segments left by a previous run of the daemon are picked up again. The read
+position within a segment is not saved, so after a restart the records of
+the oldest segment that were already sent before it may be sent again.
+
+A spool holds an exclusive lock on its directory until it is closed, so two
+spools never read and delete each other's segments.
+"""
+
+import errno
+import fcntl
+import os
+import struct
+import threading
+import time
+
+HEADER = struct.Struct('!I')
+SUFFIX = '.spool'
+LOCK_FILE = 'lock'
+
+
+class Spool(object):
+    """
+    A size capped, segmented, append-only queue of strings on disk
+    """
+
+    def __init__(self, directory, max_bytes, segment_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = max(1, min(segment_bytes, max_bytes))
+        self.lock = threading.Lock()
+        # Bytes dropped when the size cap was reached
+        self.dropped_bytes = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.lock_file = open(os.path.join(directory, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            self.lock_file.close()
+            self.lock_file = None
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            raise IOError(e.errno, "Spool directory %s is used by another "
+                          "spool" % directory)
+
+        # Sequence numbers of the segments, oldest first
+        self.segments = sorted([int(f[:-len(SUFFIX)])
+                                for f in os.listdir(directory)
+                                if f.endswith(SUFFIX)
+                                and f[:-len(SUFFIX)].isdigit()])
+        self.size = sum([os.path.getsize(self._segment_path(segment))
+                         for segment in self.segments])
+        self.writer = None
+        self.reader = None
+        # Record read by peek, not popped yet
+        self.peeked = None
+        # Bumped when the peeked record is deleted before it was popped
+        self.generation = 0
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, '%020d%s' % (segment, SUFFIX))
+
+    def __len__(self):
+        """
+        Bytes held by the spool, read or not
+        """
+        return self.size
+
+    def empty(self):
+        self.lock.acquire()
+        try:
+            return self.size == 0
+        finally:
+            self.lock.release()
+
+    def append(self, data):
+        """
+        Add a record at the end of the spool
+        """
+        record = HEADER.pack(len(data)) + data
+        self.lock.acquire()
+        try:
+            if (self.writer is None or self.writer.tell() + len(record)
+                    > self.segment_bytes):
+                self._roll()
+            self.writer.write(record)
+            self.writer.flush()
+            self.size += len(record)
+            self._enforce_cap()
+        finally:
+            self.lock.release()
+
+    def _roll(self):
+        """
+        Start a new segment
+        """
+        if self.writer is not None:
+            self.writer.close()
+        if self.segments:
+            segment = self.segments[-1] + 1
+        else:
+            segment = 1
+        self.segments.append(segment)
+        self.writer = open(self._segment_path(segment), 'ab')
+
+    def _enforce_cap(self):
+        """
+        Delete the oldest segments while the spool is over its size cap,
+        keeping the one being written
+        """
+        while self.size > self.max_bytes and len(self.segments) > 1:
+            self.dropped_bytes += self._remove_oldest()
+
+    def _remove_oldest(self):
+        segment = self.segments.pop(0)
+        path = self._segment_path(segment)
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+            self._forget_peeked()
+        size = os.path.getsize(path)
+        os.unlink(path)
+        self.size -= size
+        return size
+
+    def _forget_peeked(self):
+        if self.peeked is not None:
+            self.peeked = None
+            self.generation += 1
+
+    def peek(self):
+        """
+        Return the oldest record without removing it, or None if the spool
+        is empty
+        """
+        return self.peek_record()[0]
+
+    def peek_record(self):
+        """
+        Return the oldest record and the generation to pass to pop
+        """
+        self.lock.acquire()
+        try:
+            if self.peeked is None:
+                self.peeked = self._read()
+            return self.peeked, self.generation
+        finally:
+            self.lock.release()
+
+    def pop(self, generation=None):
+        """
+        Remove the oldest record, once it has been handled. Given the
+        generation returned by peek_record, does nothing if that record was
+        deleted in the meantime, which leaves the next one in place.
+        """
+        self.lock.acquire()
+        try:
+            if generation is not None and generation != self.generation:
+                return
+            if self.peeked is None:
+                self.peeked = self._read()
+            self.peeked = None
+        finally:
+            self.lock.release()
+
+    def _read(self):
+        """
+        Read the next record, deleting the segments that were read entirely
+        """
+        while self.segments:
+            if self.reader is None:
+                self.reader = open(self._segment_path(self.segments[0]), 'rb')
+            header = self.reader.read(HEADER.size)
+            if len(header) == HEADER.size:
+                length = HEADER.unpack(header)[0]
+                data = self.reader.read(length)
+                if len(data) == length:
+                    return data
+            # End of the segment, or a record cut short by a crash
+            if self.writer is not None and len(self.segments) == 1:
+                # The segment being written was read entirely: delete it,
+                # the next record starts a new one
+                self.writer.close()
+                self.writer = None
+            self.reader.close()
+            self.reader = None
+            self._remove_oldest()
+        return None
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for f in (self.writer, self.reader):
+                if f is not None:
+                    f.close()
+            self.writer = None
+            self.reader = None
+            self._forget_peeked()
+            if self.lock_file is not None:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+                self.lock_file.close()
+                self.lock_file = None
+        finally:
+            self.lock.release()
+
+
+class SpoolDrainer(object):
+    """
+    A thread replaying spooled records through a send function, at about
+    `rate` bytes per second. The send function returns False when the
+    record could not be sent, to be retried later. Errors reading the spool
+    are passed to on_error.
+    """
+
+    def __init__(self, spool, send, rate, interval=1.0, on_error=None):
+        self.spool = spool
+        self.send = send
+        self.rate = rate
+        self.interval = interval
+        self.on_error = on_error
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='spool-drainer')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def drain(self, budget):
+        """
+        Send spooled records until about budget bytes were sent. Returns the
+        number of bytes sent.
+        """
+        sent = 0
+        while sent < budget:
+            data, generation = self.spool.peek_record()
+            if data is None:
+                break
+            if not self.send(data):
+                break
+            # The spool may have dropped the record while it was sent
+            self.spool.pop(generation)
+            sent += len(data)
+        return sent
+
+    def _run(self):
+        while not self._stop.isSet():
+            start = time.time()
+            try:
+                self.drain(self.rate * self.interval)
+            except Exception, e:
+                if self.on_error is not None:
+                    self.on_error(e)
+            self._stop.wait(max(0, self.interval - (time.time() - start)))
@@ -25,9 +25,15 @@ having the python library called statsd and this handler's module being called
 statsd, so we use an odd name for this handler. This doesn't affect the usage
 of this handler.
 
+With udp_mtu set, the handler formats the statsd lines itself and packs as
+many as fit in each datagram, instead of sending a datagram per metric
+through python-statsd, which is then not needed. The statsd server must
+accept several metrics per datagram, as etsy statsd does since v0.4.0.
+
 """
 
 from Handler import Handler
+from datagram import DatagramSender
 import logging
 try:
     import statsd
@@ -46,16 +52,21 @@ class StatsdHandler(Handler):
         Handler.__init__(self, config)
         logging.debug("Initialized statsd handler.")
 
-        if not statsd:
-            self.log.error('statsd import failed. Handler disabled')
-
         # Initialize Options
         self.host = self.config['host']
         self.port = int(self.config['port'])
         self.batch_size = int(self.config['batch'])
+        self.udp_mtu = int(self.config['udp_mtu'])
         self.metrics = []
         self.old_values = {}
 
+        # Send packed datagrams ourselves, rather than through the client
+        self.sender = None
+        if self.udp_mtu > 0:
+            self.sender = DatagramSender(self.host, self.port, self.udp_mtu)
+        elif not statsd:
+            self.log.error('statsd import failed. Handler disabled')
+
         # Connect
         self._connect()
 
@@ -69,6 +80,9 @@ class StatsdHandler(Handler):
             'host': '',
             'port': '',
             'batch': '',
+            'udp_mtu': ('Pack the metrics of a batch into datagrams of at '
+                        'most this many bytes. 0 sends a datagram per metric '
+                        'with python-statsd'),
         })
 
         return config
@@ -83,6 +97,7 @@ class StatsdHandler(Handler):
             'host': '',
             'port': 1234,
             'batch': 1,
+            'udp_mtu': 0,
         })
 
         return config
@@ -101,6 +116,9 @@ class StatsdHandler(Handler):
         """
         Send data to statsd. Fire and forget.  Cross fingers and it'll arrive.
         """
+        if self.sender is not None:
+            self._send_packed()
+            return
         if not statsd:
             return
         for metric in self.metrics:
@@ -121,12 +139,7 @@ class StatsdHandler(Handler):
                     statsd.Gauge(prefix, self.connection).send(
                         name, metric.value)
             else:
-                # To send a counter, we need to just send the delta
-                # but without any time delta changes
-                value = metric.raw_value
-                if metric.path in self.old_values:
-                    value = value - self.old_values[metric.path]
-                self.old_values[metric.path] = metric.raw_value
+                value = self._counter_delta(metric)
 
                 if hasattr(statsd, 'StatsClient'):
                     self.connection.incr(metric.path, value)
@@ -136,6 +149,36 @@ class StatsdHandler(Handler):
 
         self.metrics = []
 
+    def _send_packed(self):
+        """
+        Send the batch as statsd lines packed into datagrams
+        """
+        lines = []
+        for metric in self.metrics:
+            if metric.metric_type == 'GAUGE':
+                lines.append('%s:%s|g\n' % (metric.path, metric.value))
+            else:
+                delta = self._counter_delta(metric)
+                lines.append('%s:%s|c\n' % (metric.path, delta))
+        self.metrics = []
+        try:
+            self.stats.incr('bytes_sent', self.sender.send(lines))
+        except Exception, e:
+            self.sender.close()
+            self._throttle_error("StatsdHandler: Error sending metrics. %s",
+                                 e)
+
+    def _counter_delta(self, metric):
+        """
+        To send a counter, we need to just send the delta but without any
+        time delta changes
+        """
+        value = metric.raw_value
+        if metric.path in self.old_values:
+            value = value - self.old_values[metric.path]
+        self.old_values[metric.path] = metric.raw_value
+        return value
+
     def flush(self):
         """Flush metrics in queue"""
         self._send()
@@ -144,7 +187,7 @@ class StatsdHandler(Handler):
         """
         Connect to the statsd server
         """
-        if not statsd:
+        if self.sender is not None or not statsd:
             return
 
         if hasattr(statsd, 'StatsClient'):
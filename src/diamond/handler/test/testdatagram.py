@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import socket
+
+from test import unittest
+from mock import Mock
+from mock import call
+from mock import patch
+
+import configobj
+
+from diamond.handler.datagram import pack_datagrams
+from diamond.handler.graphite import GraphiteHandler
+from diamond.handler.stats_d import StatsdHandler
+from diamond.metric import Metric
+
+
+class TestPackDatagrams(unittest.TestCase):
+
+    def test_pack(self):
+        lines = ['a' * 5 + '\n', 'b' * 5 + '\n', 'c' * 20 + '\n', 'd\n']
+        self.assertEqual(pack_datagrams(lines, 12),
+                         [lines[0] + lines[1], lines[2], lines[3]])
+        self.assertEqual(pack_datagrams(lines, 100), [''.join(lines)])
+        self.assertEqual(pack_datagrams([], 100), [])
+
+
+class TestUDPHandlers(unittest.TestCase):
+
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(5)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_statsd(self):
+        config = configobj.ConfigObj()
+        config['host'] = '127.0.0.1'
+        config['port'] = self.server.getsockname()[1]
+        config['batch'] = 3
+        config['udp_mtu'] = 64
+
+        handler = StatsdHandler(config)
+        handler.process(Metric('servers.host.cpu.idle', 10, raw_value=10,
+                               timestamp=123, metric_type='GAUGE'))
+        handler.process(Metric('servers.host.net.rx', 5, raw_value=100,
+                               timestamp=123, metric_type='COUNTER'))
+        handler.process(Metric('servers.host.net.rx', 5, raw_value=120,
+                               timestamp=123, metric_type='COUNTER'))
+
+        self.assertEqual(self.server.recv(1500),
+                         'servers.host.cpu.idle:10|g\n'
+                         'servers.host.net.rx:100|c\n')
+        self.assertEqual(self.server.recv(1500), 'servers.host.net.rx:20|c\n')
+        self.assertEqual(handler.sender.datagrams_sent, 2)
+
+    def test_graphite(self):
+        config = configobj.ConfigObj()
+        config['proto'] = 'udp'
+        config['batch'] = 3
+        config['udp_mtu'] = 40
+
+        handler = GraphiteHandler(config)
+        send_mock = Mock()
+        patch_send = patch.object(GraphiteHandler, '_send_data', send_mock)
+        patch_send.start()
+        for i in range(3):
+            handler.process(Metric('metricname%d' % i, 0, timestamp=123))
+        patch_send.stop()
+
+        self.assertEqual(send_mock.call_args_list, [
+            call('metricname0 0 123\nmetricname1 0 123\n'),
+            call('metricname2 0 123\n'),
+        ])
+
+    def test_graphite_send_error(self):
+        config = configobj.ConfigObj()
+        config['proto'] = 'udp'
+        config['batch'] = 3
+        config['udp_mtu'] = 40
+
+        handler = GraphiteHandler(config)
+        send_mock = Mock(side_effect=[None, socket.error('refused')])
+        patch_send = patch.object(GraphiteHandler, '_send_data', send_mock)
+        patch_send.start()
+        try:
+            for i in range(3):
+                handler.process(Metric('metricname%d' % i, 0, timestamp=123))
+        except socket.error:
+            pass
+        patch_send.stop()
+
+        # The datagram that was sent is not sent again
+        self.assertEqual(handler.metrics, ['metricname2 0 123\n'])
+
+if __name__ == "__main__":
+    unittest.main()
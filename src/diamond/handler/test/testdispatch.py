@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import threading
+
+from test import unittest
+import configobj
+
+from diamond.handler.Handler import Handler
+from diamond.handler.dispatch import DispatchQueue
+from diamond.metric import Metric
+
+
+class RecordingHandler(Handler):
+
+    def __init__(self, config=None):
+        Handler.__init__(self, config)
+        self.processed = []
+        self.flushes = 0
+
+    def process(self, metric):
+        self.processed.append(metric)
+
+    def flush(self):
+        self.flushes += 1
+
+
+class TestDispatchQueue(unittest.TestCase):
+
+    def make_queue(self, overflow, maxsize=2):
+        self.gate = threading.Event()
+        self.items = []
+
+        def process(items):
+            self.gate.wait(5)
+            self.items.extend(items)
+
+        return DispatchQueue('test', process, lambda: None, maxsize,
+                             overflow=overflow, block_timeout=0.01)
+
+    def test_drop_oldest(self):
+        queue = self.make_queue('drop_oldest', maxsize=2)
+        # Block the worker on the first item, then overfill the queue
+        queue.put(0)
+        queue.join(0.1)
+        for i in range(1, 5):
+            queue.put(i)
+        self.gate.set()
+        queue.stop(5)
+
+        self.assertEqual(self.items, [0, 3, 4])
+        self.assertEqual(queue.dropped, 2)
+
+    def test_drop_newest(self):
+        queue = self.make_queue('drop_newest', maxsize=2)
+        queue.put(0)
+        queue.join(0.1)
+        for i in range(1, 5):
+            queue.put(i)
+        self.gate.set()
+        queue.stop(5)
+
+        self.assertEqual(self.items, [0, 1, 2])
+        self.assertEqual(queue.dropped, 2)
+
+    def test_block_with_deadline(self):
+        queue = self.make_queue('block', maxsize=1)
+        queue.put(0)
+        queue.join(0.1)
+        self.assertTrue(queue.put(1))
+        # Queue is full and the worker is stuck, so this times out
+        self.assertFalse(queue.put(2))
+        self.gate.set()
+        queue.stop(5)
+
+        self.assertEqual(self.items, [0, 1])
+        self.assertEqual(queue.dropped, 1)
+
+    def test_invalid_policy(self):
+        self.assertRaises(ValueError, DispatchQueue, 'test', None, None, 1,
+                          overflow='explode')
+
+
+class TestHandlerDispatch(unittest.TestCase):
+
+    def test_queued_handler(self):
+        config = configobj.ConfigObj()
+        config['queue_size'] = 100
+
+        handler = RecordingHandler(config)
+        metrics = [Metric('metricname%d' % i, i, timestamp=123)
+                   for i in range(10)]
+        for metric in metrics:
+            handler._process(metric)
+        handler._flush()
+        handler._shutdown(5)
+
+        self.assertEqual(handler.processed, metrics)
+        self.assertEqual(handler.flushes, 1)
+        self.assertEqual(handler.get_queue_stats(),
+                         {'depth': 0, 'dropped': 0})
+
+    def test_synchronous_handler(self):
+        handler = RecordingHandler(configobj.ConfigObj())
+        metric = Metric('metricname', 0, timestamp=123)
+        handler._process(metric)
+
+        self.assertTrue(handler.dispatch_queue is None)
+        self.assertEqual(handler.processed, [metric])
+
+if __name__ == "__main__":
+    unittest.main()
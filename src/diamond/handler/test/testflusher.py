@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+import configobj
+
+from diamond.handler.Handler import Handler
+from diamond.handler.flusher import HandlerFlusher
+from diamond.metric import Metric
+
+
+class CountingHandler(Handler):
+
+    def __init__(self, config=None):
+        Handler.__init__(self, config)
+        self.flushes = 0
+
+    def process(self, metric):
+        pass
+
+    def flush(self):
+        self.flushes += 1
+
+
+class TestFlushPolicy(unittest.TestCase):
+
+    def make_handler(self, **options):
+        config = configobj.ConfigObj()
+        config.update(options)
+        return CountingHandler(config)
+
+    def test_flush_after_every_run_by_default(self):
+        handler = self.make_handler()
+        handler._process(Metric('metricname', 0, timestamp=123))
+        handler._flush()
+        self.assertEqual(handler.flushes, 1)
+
+    def test_lingering_handler_is_flushed_when_due(self):
+        handler = self.make_handler(flush_linger=10)
+        flusher = HandlerFlusher([handler])
+        self.assertEqual(flusher.tick, 1.0)
+
+        handler._process(Metric('metricname', 0, timestamp=123))
+        # Collector runs no longer flush
+        handler._flush()
+        self.assertEqual(handler.flushes, 0)
+
+        handler._flush_if_due(handler.pending_since + 5)
+        self.assertEqual(handler.flushes, 0)
+        handler._flush_if_due(handler.pending_since + 10)
+        self.assertEqual(handler.flushes, 1)
+
+        # Nothing left to flush
+        handler._flush_if_due(handler.pending_since + 20)
+        self.assertEqual(handler.flushes, 1)
+
+    def test_max_batch(self):
+        handler = self.make_handler(flush_linger=10, flush_max_batch=3)
+        handler._process_batch([Metric('metricname', i, timestamp=123)
+                                for i in range(2)])
+        self.assertEqual(handler.flushes, 0)
+        handler._process(Metric('metricname', 2, timestamp=123))
+        self.assertEqual(handler.flushes, 1)
+        self.assertEqual(handler.pending_metrics, 0)
+
+    def test_max_bytes(self):
+        metric = Metric('metricname', 0, timestamp=123)
+        handler = self.make_handler(flush_linger=10,
+                                    flush_max_bytes=len(str(metric)) * 2)
+        handler._process(metric)
+        self.assertEqual(handler.flushes, 0)
+        handler._process(metric)
+        self.assertEqual(handler.flushes, 1)
+
+    def test_shutdown_flushes(self):
+        handler = self.make_handler(flush_linger=10)
+        handler._process(Metric('metricname', 0, timestamp=123))
+        handler._shutdown(5)
+        self.assertEqual(handler.flushes, 1)
+
+if __name__ == "__main__":
+    unittest.main()
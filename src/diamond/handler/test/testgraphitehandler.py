@@ -112,6 +112,36 @@ class TestGraphiteHandler(unittest.TestCase):
         self.assertEqual(sendmock.call_count, len(expected_data))
         self.assertEqual(sendmock.call_args_list, expected_data)
 
+    def test_batch_single_write(self):
+        config = configobj.ConfigObj()
+        config['host'] = 'graphite.example.com'
+        config['batch'] = 1
+
+        metrics = [
+            Metric('metricname1', 0, timestamp=123),
+            Metric('metricname2', 0, timestamp=123),
+            Metric('metricname3', 0, timestamp=123),
+        ]
+
+        expected_data = [
+            call("metricname1 0 123\nmetricname2 0 123\nmetricname3 0 123\n"),
+        ]
+
+        handler = GraphiteHandler(config)
+
+        patch_sock = patch.object(handler, 'socket', True)
+        sendmock = Mock()
+        patch_send = patch.object(GraphiteHandler, '_send_data', sendmock)
+
+        patch_sock.start()
+        patch_send.start()
+        handler._process_batch(metrics)
+        patch_send.stop()
+        patch_sock.stop()
+
+        self.assertEqual(sendmock.call_count, len(expected_data))
+        self.assertEqual(sendmock.call_args_list, expected_data)
+
     def test_backlog(self):
         config = configobj.ConfigObj()
         config['host'] = 'graphite.example.com'
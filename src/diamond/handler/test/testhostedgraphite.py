@@ -0,0 +1,42 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.graphite import GraphiteHandler
+from diamond.handler.hostedgraphite import HostedGraphiteHandler
+from diamond.metric import Metric
+
+
+class TestHostedGraphiteHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.patch_connect = patch.object(GraphiteHandler, '_connect', Mock())
+        self.patch_connect.start()
+
+    def tearDown(self):
+        self.patch_connect.stop()
+
+    def test_process_batch(self):
+        config = configobj.ConfigObj()
+        config['apikey'] = 'KEY'
+        config['batch'] = 2
+        handler = HostedGraphiteHandler(config)
+        handler.graphite.socket = Mock()
+        # The graphite handler sends under the lock of this handler
+        self.assertTrue(handler.graphite.lock is handler.lock)
+
+        handler._process_batch([Metric('metric%d' % i, 0, timestamp=123)
+                                for i in range(2)])
+        handler.graphite.socket.sendall.assert_called_once_with(
+            'key.metric0 0 123\nkey.metric1 0 123\n')
+        # Processed like by any other handler
+        self.assertEqual(handler.get_internal_metrics()['process_count'], 1)
+
+if __name__ == "__main__":
+    unittest.main()
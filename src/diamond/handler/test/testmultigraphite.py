@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.graphite import GraphiteHandler
+from diamond.handler.hashing import ConsistentHashRing
+from diamond.handler.hashing import MetricRouter
+from diamond.handler.hashing import compact_hash
+from diamond.handler.hashing import parse_destination
+from diamond.handler.multigraphite import MultiGraphiteHandler
+from diamond.metric import Metric
+
+
+class TestHashing(unittest.TestCase):
+
+    def test_ring(self):
+        # md5('a') is 0cc175b9c0f1b6a831c399e269772661
+        self.assertEqual(compact_hash('a'), 0x0cc1)
+
+        nodes = [('10.0.0.1', None), ('10.0.0.2', None), ('10.0.0.3', None)]
+        ring = ConsistentHashRing(nodes)
+        self.assertEqual(len(ring.ring), 300)
+        self.assertEqual(len(set([p for p, n in ring.ring])), 300)
+        self.assertEqual(sorted(ring.get_nodes('servers.host.cpu.idle')),
+                         sorted(nodes))
+
+        # Adding a node only moves the keys that now belong to it
+        keys = ['servers.host%d.cpu.idle' % i for i in range(200)]
+        before = dict([(key, ring.get_nodes(key)[0]) for key in keys])
+        ring.add_node(('10.0.0.4', None))
+        for key in keys:
+            node = ring.get_nodes(key)[0]
+            if node != ('10.0.0.4', None):
+                self.assertEqual(node, before[key])
+
+    def test_parse_destination(self):
+        self.assertEqual(parse_destination('carbon1'),
+                         ('carbon1', None, None))
+        self.assertEqual(parse_destination('carbon1:2004:a'),
+                         ('carbon1', 2004, 'a'))
+
+    def test_replication(self):
+        destinations = [('10.0.0.1', 'a'), ('10.0.0.1', 'b'),
+                        ('10.0.0.2', 'a'), ('10.0.0.3', 'a')]
+        router = MetricRouter(destinations, replication_factor=2)
+        for i in range(50):
+            indexes = router.get_destinations('metric%d' % i)
+            self.assertEqual(len(indexes), 2)
+            # Replicas go to distinct servers
+            servers = set([destinations[index][0] for index in indexes])
+            self.assertEqual(len(servers), 2)
+        self.assertEqual(len(router.cache), 50)
+
+
+class TestMultiGraphiteHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.patch_connect = patch.object(GraphiteHandler, '_connect', Mock())
+        self.patch_connect.start()
+
+    def tearDown(self):
+        self.patch_connect.stop()
+
+    def test_duplicate_destinations(self):
+        config = configobj.ConfigObj()
+        config['host'] = ['127.0.0.1:2004', '127.0.0.1:2104']
+        config['relay_method'] = 'consistent-hashing'
+        self.assertRaises(ValueError, MultiGraphiteHandler, config)
+
+        config['host'] = ['127.0.0.1:2004:a', '127.0.0.1:2104:b']
+        handler = MultiGraphiteHandler(config)
+        indexes = set()
+        for i in range(100):
+            indexes.update(handler.router.get_destinations('metric%d' % i))
+        self.assertEqual(indexes, set([0, 1]))
+
+    def test_consistent_hashing(self):
+        config = configobj.ConfigObj()
+        config['host'] = ['carbon1:2003:a', 'carbon2:2103:b']
+        config['relay_method'] = 'consistent-hashing'
+        handler = MultiGraphiteHandler(config)
+        self.assertEqual([h.port for h in handler.handlers], [2003, 2103])
+
+        for h in handler.handlers:
+            h.process_batch = Mock()
+        metrics = [Metric('servers.host%d.cpu.idle' % i, 0, timestamp=123)
+                   for i in range(20)]
+        handler.process_batch(metrics)
+
+        sent = []
+        for index, h in enumerate(handler.handlers):
+            for metric in h.process_batch.call_args[0][0]:
+                self.assertEqual(
+                    handler.router.get_destinations(metric.path), [index])
+                sent.append(metric)
+        # Each metric is sent once
+        self.assertEqual(sorted([m.path for m in sent]),
+                         sorted([m.path for m in metrics]))
+
+    def test_all(self):
+        config = configobj.ConfigObj()
+        config['host'] = ['carbon1', 'carbon2']
+        handler = MultiGraphiteHandler(config)
+        for h in handler.handlers:
+            h.process = Mock()
+        handler.process(Metric('metric', 0, timestamp=123))
+        for h in handler.handlers:
+            self.assertEqual(h.process.call_count, 1)
+
+if __name__ == "__main__":
+    unittest.main()
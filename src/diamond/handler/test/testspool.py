@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+import shutil
+import tempfile
+import threading
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.graphite import GraphiteHandler
+from diamond.handler.multigraphite import MultiGraphiteHandler
+from diamond.handler.spool import Spool
+from diamond.handler.spool import SpoolDrainer
+from diamond.metric import Metric
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def segments(self):
+        return [f for f in os.listdir(self.tmpdir) if f.endswith('.spool')]
+
+    def test_fifo(self):
+        spool = Spool(self.tmpdir, 1000, 30)
+        for i in range(5):
+            spool.append('record%d\n' % i)
+        # Records are split over segments of at most 30 bytes
+        self.assertEqual(len(self.segments()), 3)
+
+        self.assertEqual(spool.peek(), 'record0\n')
+        self.assertEqual(spool.peek(), 'record0\n')
+        spool.pop()
+        spool.append('record5\n')
+        records = []
+        while spool.peek() is not None:
+            records.append(spool.peek())
+            spool.pop()
+        self.assertEqual(records, ['record%d\n' % i for i in range(1, 6)])
+        # Segments are deleted once read
+        self.assertTrue(spool.empty())
+        self.assertEqual(self.segments(), [])
+
+    def test_size_cap(self):
+        spool = Spool(self.tmpdir, 40, 20)
+        for i in range(5):
+            spool.append('record%d\n' % i)
+        self.assertTrue(len(spool) <= 40)
+        self.assertEqual(spool.dropped_bytes, 24)
+        self.assertEqual(spool.peek(), 'record2\n')
+
+    def test_reopen(self):
+        spool = Spool(self.tmpdir, 1000, 100)
+        spool.append('record0\n')
+        spool.close()
+
+        spool = Spool(self.tmpdir, 1000, 100)
+        spool.append('record1\n')
+        self.assertEqual(spool.peek(), 'record0\n')
+        spool.pop()
+        self.assertEqual(spool.peek(), 'record1\n')
+
+    def test_directory_lock(self):
+        spool = Spool(self.tmpdir, 1000, 100)
+        self.assertRaises(IOError, Spool, self.tmpdir, 1000, 100)
+        spool.close()
+        Spool(self.tmpdir, 1000, 100).close()
+
+    def test_drainer(self):
+        spool = Spool(self.tmpdir, 1000, 100)
+        for i in range(3):
+            spool.append('record%d\n' % i)
+        send = Mock(side_effect=[True, False, True, True])
+        drainer = SpoolDrainer(spool, send, 1000)
+
+        # Stops at the first record that could not be sent
+        self.assertEqual(drainer.drain(100), 8)
+        self.assertEqual(drainer.drain(10), 16)
+        self.assertEqual([c[0][0] for c in send.call_args_list],
+                         ['record0\n', 'record1\n', 'record1\n',
+                          'record2\n'])
+        self.assertEqual(spool.peek(), None)
+
+    def test_drainer_keeps_records_after_dropped_one(self):
+        spool = Spool(self.tmpdir, 40, 20)
+        spool.append('record0\n')
+        spool.append('record1\n')
+        sent = []
+
+        def send(data):
+            if not sent:
+                # The cap drops the segment of the record being sent
+                spool.append('record2\n')
+                spool.append('record3\n')
+            sent.append(data)
+            return True
+
+        drainer = SpoolDrainer(spool, send, 1000)
+        drainer.drain(1000)
+        self.assertEqual(sent, ['record%d\n' % i for i in range(4)])
+
+    def test_drainer_reports_errors(self):
+        spool = Mock()
+        spool.peek_record.side_effect = IOError('broken')
+        errors = []
+        reported = threading.Event()
+
+        def on_error(e):
+            errors.append(e)
+            reported.set()
+
+        drainer = SpoolDrainer(spool, Mock(), 1000, 0.01, on_error)
+        drainer.start()
+        reported.wait(5)
+        drainer.stop(5)
+        self.assertTrue(isinstance(errors[0], IOError))
+
+
+class TestGraphiteHandlerSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_backlog_is_spooled(self):
+        config = configobj.ConfigObj()
+        config['batch'] = 2
+        config['max_backlog_multiplier'] = 2
+        config['spool_path'] = self.tmpdir
+
+        patch_connect = patch.object(GraphiteHandler, '_connect', Mock())
+        patch_send = patch.object(GraphiteHandler, '_send_data', Mock())
+        patch_connect.start()
+        patch_send.start()
+        try:
+            handler = GraphiteHandler(config)
+            handler.spool_drainer.stop()
+            for i in range(5):
+                handler.process(Metric('metric%d' % i, 0, timestamp=123))
+            handler._shutdown()
+        finally:
+            patch_send.stop()
+            patch_connect.stop()
+
+        self.assertEqual(handler.metrics, [])
+        spool = Spool(os.path.join(self.tmpdir, 'localhost_2003'), 1000,
+                      1000)
+        self.assertEqual(spool.peek(), ''.join(['metric%d 0 123\n' % i
+                                               for i in range(4)]))
+        spool.pop()
+        self.assertEqual(spool.peek(), 'metric4 0 123\n')
+
+    def test_replay_needs_a_connection(self):
+        config = configobj.ConfigObj()
+        config['spool_path'] = self.tmpdir
+
+        connect = Mock()
+        patch_connect = patch.object(GraphiteHandler, '_connect', connect)
+        patch_send = patch.object(GraphiteHandler, '_send_data', Mock())
+        patch_connect.start()
+        patch_send.start()
+        try:
+            handler = GraphiteHandler(config)
+            handler.spool_drainer.stop()
+            connect.reset_mock()
+            # The drainer does not try to connect
+            self.assertFalse(handler._send_spooled('metric 0 123\n'))
+            self.assertEqual(connect.call_count, 0)
+
+            handler.socket = Mock()
+            self.assertTrue(handler._send_spooled('metric 0 123\n'))
+            handler._send_data.assert_called_once_with('metric 0 123\n')
+            handler.socket = None
+            handler._shutdown()
+        finally:
+            patch_send.stop()
+            patch_connect.stop()
+
+    def test_multi_graphite_spools(self):
+        config = configobj.ConfigObj()
+        config['host'] = ['127.0.0.1:2004:a', '127.0.0.1:2104:b',
+                          'graphite']
+        config['spool_path'] = self.tmpdir
+
+        patch_connect = patch.object(GraphiteHandler, '_connect', Mock())
+        patch_connect.start()
+        try:
+            handler = MultiGraphiteHandler(config)
+            for sub in handler.handlers:
+                sub._shutdown()
+        finally:
+            patch_connect.stop()
+
+        # Every server gets a spool directory of its own
+        self.assertEqual([sub.spool.directory for sub in handler.handlers],
+                         [os.path.join(self.tmpdir, name)
+                          for name in ('127.0.0.1_2004_a', '127.0.0.1_2104_b',
+                                       'graphite_2003')])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import socket
+import time
+
+from test import unittest
+
+import configobj
+
+from diamond.handler.graphite import GraphiteHandler
+from diamond.handler.transport import AsyncTransport
+from diamond.metric import Metric
+
+
+def unused_port():
+    """
+    Return a local port nothing listens on
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def receive(server, size):
+    """
+    Accept a connection and read size bytes from it
+    """
+    server.settimeout(5)
+    conn, _ = server.accept()
+    conn.settimeout(5)
+    data = ''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    conn.close()
+    return data
+
+
+class TestAsyncTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_send(self):
+        transport = AsyncTransport('127.0.0.1', self.port)
+        transport.start()
+        transport.send('metric1 1 123\n')
+        transport.send('metric2 2 123\n')
+        data = receive(self.server, 28)
+        self.assertEqual(transport.stop(5), [])
+        self.assertEqual(data, 'metric1 1 123\nmetric2 2 123\n')
+        self.assertEqual(transport.bytes_sent, 28)
+
+    def test_unreachable(self):
+        overflow = []
+
+        def on_overflow(data):
+            overflow.append(data)
+            return True
+
+        transport = AsyncTransport('127.0.0.1', unused_port(), max_buffer=10,
+                                   min_delay=0.01, max_delay=0.04,
+                                   on_overflow=on_overflow)
+        transport.start()
+        start = time.time()
+        for i in range(5):
+            transport.send('metric%d\n' % i)
+        # Producers never wait for the connection
+        self.assertTrue(time.time() - start < 0.5)
+
+        time.sleep(0.2)
+        self.assertTrue(transport.reconnects > 1)
+        self.assertEqual(transport.delay, 0.04)
+        self.assertEqual(overflow, ['metric%d\n' % i for i in range(4)])
+        self.assertEqual(transport.stop(1), ['metric4\n'])
+
+
+class TestGraphiteHandlerAsync(unittest.TestCase):
+
+    def test_process(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        try:
+            config = configobj.ConfigObj()
+            config['host'] = '127.0.0.1'
+            config['port'] = server.getsockname()[1]
+            config['transport'] = 'async'
+            handler = GraphiteHandler(config)
+            handler.process(Metric('metricname', 1, timestamp=123))
+            data = receive(server, 17)
+            handler._shutdown(5)
+        finally:
+            server.close()
+        self.assertEqual(data, 'metricname 1 123\n')
+        self.assertEqual(handler.metrics, [])
+
+    def test_transport_is_normalized(self):
+        config = configobj.ConfigObj()
+        config['host'] = '127.0.0.1'
+        config['port'] = 1
+        config['transport'] = ' Async '
+        handler = GraphiteHandler(config)
+        try:
+            self.assertNotEqual(handler.transport, None)
+        finally:
+            handler._shutdown(5)
+
+        config['transport'] = 'sideways'
+        self.assertRaises(ValueError, GraphiteHandler, config)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import gzip
+import json
+import StringIO
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.tsdb import TSDBHandler
+from diamond.handler.tsdb import parse_tags
+from diamond.metric import Metric
+
+
+def make_metric(name, value):
+    return Metric('servers.myhost.cpu.total.%s' % name, value,
+                  timestamp=1234567, host='myhost')
+
+
+class TestTSDBHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.patch_connect = patch.object(TSDBHandler, '_connect', Mock())
+        self.patch_connect.start()
+
+    def tearDown(self):
+        self.patch_connect.stop()
+
+    def test_parse_tags(self):
+        self.assertEqual(parse_tags(''), {})
+        self.assertEqual(parse_tags(' env=prod dc=ams'),
+                         {'env': 'prod', 'dc': 'ams'})
+        self.assertEqual(parse_tags(['env=prod', 'dc=ams']),
+                         {'env': 'prod', 'dc': 'ams'})
+        self.assertRaises(ValueError, parse_tags, 'env')
+
+    def test_telnet_tags(self):
+        config = configobj.ConfigObj()
+        config['host'] = 'localhost'
+        # As in diamond.conf.example
+        config['tags'] = 'env=prod dc=ams'
+        handler = TSDBHandler(config)
+        self.assertEqual(handler._format(make_metric('idle', 1)),
+                         'put cpu.total.idle 1234567 1 hostname=myhost '
+                         'dc=ams env=prod\n')
+
+        # configobj splits values containing commas into lists
+        config['tags'] = ['env=prod', 'dc=ams']
+        handler = TSDBHandler(config)
+        self.assertEqual(handler.tags, ' dc=ams env=prod')
+
+    def test_telnet_batch(self):
+        config = configobj.ConfigObj()
+        config['host'] = 'localhost'
+        config['batch'] = 2
+        handler = TSDBHandler(config)
+        handler.socket = Mock()
+
+        handler.process(make_metric('idle', 1))
+        self.assertEqual(handler.socket.sendall.call_count, 0)
+        handler.process(make_metric('user', 2))
+        handler.process(make_metric('system', 3))
+        handler.flush()
+
+        self.assertEqual(
+            [c[0][0] for c in handler.socket.sendall.call_args_list],
+            ['put cpu.total.idle 1234567 1 hostname=myhost\n'
+             'put cpu.total.user 1234567 2 hostname=myhost\n',
+             'put cpu.total.system 1234567 3 hostname=myhost\n'])
+
+    def test_http(self):
+        config = configobj.ConfigObj()
+        config['host'] = 'localhost'
+        config['port'] = 4242
+        config['batch'] = 2
+        config['protocol'] = 'http'
+        config['compression'] = 'gzip'
+        config['tags'] = 'env=prod'
+        handler = TSDBHandler(config)
+
+        connection = Mock()
+        connection.getresponse.return_value.status = 204
+        connection.getresponse.return_value.read.return_value = ''
+        handler.connection = connection
+
+        handler.process_batch([make_metric('idle', 1), make_metric('user', 2)])
+
+        self.assertEqual(connection.request.call_count, 1)
+        method, path, body, headers = connection.request.call_args[0]
+        self.assertEqual((method, path), ('POST', '/api/put'))
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        body = gzip.GzipFile(fileobj=StringIO.StringIO(body)).read()
+        self.assertEqual(json.loads(body), [
+            {'metric': 'cpu.total.idle', 'timestamp': 1234567, 'value': 1,
+             'tags': {'hostname': 'myhost', 'env': 'prod'}},
+            {'metric': 'cpu.total.user', 'timestamp': 1234567, 'value': 2,
+             'tags': {'hostname': 'myhost', 'env': 'prod'}},
+        ])
+        # The connection is kept for the next batch
+        self.assertEqual(handler.connection, connection)
+
+if __name__ == "__main__":
+    unittest.main()
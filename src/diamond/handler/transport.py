@@ -0,0 +1,320 @@
+# coding=utf-8
+
+"""
+Non-blocking transport for stream based handlers.
+
+The transport owns the connection to the server and a thread that does all
+the network I/O with a non-blocking socket and select. Handlers only append
+data to its buffer, which never blocks: when the server is slow or down the
+buffer grows up to its size cap, and then the oldest data is handed to an
+overflow callback (the handler spool) or dropped.
+
+Failed connection attempts are retried with an exponential backoff, from
+`min_delay` up to `max_delay` seconds, without involving the handler.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+# Errors of a non-blocking connect or send that mean "try again later"
+RETRY_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS,
+                errno.EALREADY, errno.EINTR)
+
+
+class AsyncTransport(object):
+    """
+    A connection to host:port fed from a buffer by an I/O thread
+    """
+
+    # Upper bound of the time spent in select
+    MAX_WAIT = 1.0
+
+    def __init__(self, host, port, proto='tcp', max_buffer=16777216,
+                 min_delay=0.5, max_delay=60, timeout=15, on_overflow=None,
+                 name='transport'):
+        self.host = host
+        self.port = port
+        self.proto = proto
+        self.max_buffer = max_buffer
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        # How long a connection attempt may take
+        self.timeout = timeout
+        self.on_overflow = on_overflow
+        self.name = name
+        self.log = logging.getLogger('diamond')
+
+        self.lock = threading.Lock()
+        self.chunks = deque()
+        self.buffered = 0
+        # Bytes of the first chunk already sent
+        self.offset = 0
+
+        self.socket = None
+        self.connected = False
+        self.connect_started = None
+        self.delay = min_delay
+        self.next_attempt = 0
+        self.failures = 0
+
+        # Counters, read by the handler for its internal metrics
+        self.bytes_sent = 0
+        self.reconnects = 0
+        self.dropped_bytes = 0
+
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the I/O thread, after it sent what it could within timeout
+        seconds. Returns the data that could not be sent.
+        """
+        stopped = True
+        if self._thread is not None:
+            self._running = False
+            self._wake()
+            self._thread.join(timeout)
+            stopped = not self._thread.isAlive()
+            self._thread = None
+        self.lock.acquire()
+        try:
+            unsent = list(self.chunks)
+            if unsent:
+                unsent[0] = unsent[0][self.offset:]
+            self.chunks.clear()
+            self.buffered = 0
+            self.offset = 0
+        finally:
+            self.lock.release()
+        # A thread stuck past the timeout is left its socket, and exits on
+        # its next wake up
+        if stopped and self._wake_w is not None:
+            self._disconnect()
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            self._wake_r = self._wake_w = None
+        return unsent
+
+    def send(self, data):
+        """
+        Queue data to be sent. Never blocks.
+        """
+        if not data:
+            return
+        overflow = []
+        self.lock.acquire()
+        try:
+            self.chunks.append(data)
+            self.buffered += len(data)
+            # Keep the chunk being sent, as part of it may be on the wire
+            while self.buffered > self.max_buffer and len(self.chunks) > 1:
+                if self.offset:
+                    chunk = self.chunks[1]
+                    del self.chunks[1]
+                else:
+                    chunk = self.chunks.popleft()
+                self.buffered -= len(chunk)
+                overflow.append(chunk)
+        finally:
+            self.lock.release()
+
+        for chunk in overflow:
+            if self.on_overflow is None or not self.on_overflow(chunk):
+                self.dropped_bytes += len(chunk)
+        self._wake()
+
+    def _wake(self):
+        if self._wake_w is None:
+            return
+        try:
+            os.write(self._wake_w, 'x')
+        except OSError:
+            # The pipe is full, so the thread is going to wake up anyway
+            pass
+
+    def _connect(self):
+        """
+        Start a connection attempt
+        """
+        if self.proto == 'udp':
+            stream = socket.SOCK_DGRAM
+        else:
+            stream = socket.SOCK_STREAM
+        self.socket = socket.socket(socket.AF_INET, stream)
+        self.socket.setblocking(0)
+        self.connect_started = time.time()
+        self.reconnects += 1
+        result = self.socket.connect_ex((self.host, self.port))
+        if result == 0:
+            self._connected()
+        elif result not in RETRY_ERRNOS:
+            self._failed(os.strerror(result))
+
+    def _connected(self):
+        self.connected = True
+        self.delay = self.min_delay
+        if self.failures:
+            self.log.info("%s: Connected to %s:%d after %d failed attempts",
+                          self.name, self.host, self.port, self.failures)
+        self.failures = 0
+
+    def _failed(self, reason):
+        """
+        Close the connection, and retry later
+        """
+        self._disconnect()
+        if self.failures == 0:
+            self.log.error("%s: Connection to %s:%d failed: %s", self.name,
+                           self.host, self.port, reason)
+        else:
+            self.log.debug("%s: Connection to %s:%d failed: %s", self.name,
+                           self.host, self.port, reason)
+        self.failures += 1
+        self.next_attempt = time.time() + self.delay
+        self.delay = min(self.delay * 2, self.max_delay)
+
+    def _disconnect(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except socket.error:
+                pass
+        self.socket = None
+        self.connected = False
+        # A chunk partly sent on a closed TCP connection is sent whole
+        # again on the next one, rather than as a truncated line
+        self.lock.acquire()
+        try:
+            self.offset = 0
+        finally:
+            self.lock.release()
+
+    def _write(self):
+        """
+        Send as much of the buffer as the socket takes
+        """
+        while True:
+            self.lock.acquire()
+            try:
+                if not self.chunks:
+                    return
+                chunk = self.chunks[0]
+                offset = self.offset
+            finally:
+                self.lock.release()
+
+            try:
+                sent = self.socket.send(chunk[offset:])
+            except socket.error, e:
+                if e.args[0] in RETRY_ERRNOS:
+                    return
+                if self.proto == 'udp':
+                    # Datagrams are not retried
+                    sent = len(chunk) - offset
+                else:
+                    self._failed(str(e))
+                    return
+
+            self.bytes_sent += sent
+            self.lock.acquire()
+            try:
+                if offset + sent >= len(chunk):
+                    self.chunks.popleft()
+                    self.buffered -= len(chunk)
+                    self.offset = 0
+                else:
+                    self.offset = offset + sent
+                    return
+            finally:
+                self.lock.release()
+
+    def _run(self):
+        while True:
+            running = self._running
+            now = time.time()
+            if self.socket is None and now >= self.next_attempt:
+                self._connect()
+
+            wait = self.MAX_WAIT
+            if self.socket is None:
+                wait = max(0, min(wait, self.next_attempt - now))
+
+            readers = [self._wake_r]
+            writers = []
+            if self.socket is not None:
+                if not self.connected or self.buffered:
+                    writers.append(self.socket)
+                if self.connected and self.proto != 'udp':
+                    # Carbon never writes back: readable means closed
+                    readers.append(self.socket)
+
+            # Exit once the buffer is sent, or can't be
+            if not running and (self.socket is None or not self.buffered):
+                return
+
+            try:
+                readable, writable, _ = select.select(readers, writers, [],
+                                                      wait)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if self._wake_r in readable:
+                try:
+                    while os.read(self._wake_r, 4096):
+                        pass
+                except OSError:
+                    pass
+
+            if self.socket is None:
+                continue
+
+            if not self.connected:
+                if self.socket in writable:
+                    error = self.socket.getsockopt(socket.SOL_SOCKET,
+                                                   socket.SO_ERROR)
+                    if error:
+                        self._failed(os.strerror(error))
+                        continue
+                    self._connected()
+                elif time.time() - self.connect_started > self.timeout:
+                    self._failed('timed out')
+                    continue
+                else:
+                    continue
+
+            if self.socket in readable:
+                try:
+                    data = self.socket.recv(4096)
+                except socket.error, e:
+                    if e.args[0] not in RETRY_ERRNOS:
+                        self._failed(str(e))
+                        continue
+                    data = None
+                if data == '':
+                    self._failed('connection closed by the server')
+                    continue
+
+            if self.socket in writable or self.buffered:
+                self._write()
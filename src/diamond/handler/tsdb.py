@@ -34,10 +34,43 @@ yourself.
 `    handlers = diamond.handler.tsdb.TSDBHandler
 `
 
+- metrics are buffered and sent `batch` at a time, in a single write. Set
+`flush_linger` to also gather the metrics of several collector runs.
+
+- with `protocol = http` the metrics are posted as JSON to the /api/put
+endpoint of OpenTSDB 2.x, over a kept alive connection and optionally
+gzipped. The metric is named `{Collector}.{Metric}`, and tagged with the
+host and the `tags` option, given as `key=value` pairs. `format` only
+applies to the telnet protocol.
+
 """
 
 from Handler import Handler
+import httplib
 import socket
+import zlib
+
+try:
+    import json
+    json  # workaround for pyflakes issue #13
+except ImportError:
+    import simplejson as json
+
+
+def parse_tags(tags):
+    """
+    Parse the `key=value key=value` tags option into a dict. Takes a string,
+    or a list of strings as configobj splits options containing commas.
+    """
+    if isinstance(tags, basestring):
+        tags = [tags]
+    parsed = {}
+    for part in ' '.join(tags).replace(',', ' ').split():
+        if '=' not in part:
+            raise ValueError("Invalid tag, expected key=value: %s" % part)
+        key, value = part.split('=', 1)
+        parsed[key] = value
+    return parsed
 
 
 class TSDBHandler(Handler):
@@ -55,16 +88,30 @@ class TSDBHandler(Handler):
 
         # Initialize Data
         self.socket = None
+        self.connection = None
 
         # Initialize Options
         self.host = self.config['host']
         self.port = int(self.config['port'])
         self.timeout = int(self.config['timeout'])
         self.metric_format = str(self.config['format'])
-        self.tags = str(self.config['tags'])
+        self.tag_dict = parse_tags(self.config['tags'])
+        # Appended to the put commands by {tags}, space separated
+        self.tags = ''.join([' %s=%s' % (key, self.tag_dict[key])
+                             for key in sorted(self.tag_dict)])
+        self.batch_size = int(self.config['batch'])
+        self.protocol = self.config['protocol']
+        self.metrics = []
+
+        # HTTP API
+        self.http_path = self.config['http_path']
+        self.compress = str(self.config['compression']).lower() == 'gzip'
+        if self.protocol not in ('telnet', 'http'):
+            raise ValueError("Unknown protocol: %s" % self.protocol)
 
         # Connect
-        self._connect()
+        if self.protocol == 'telnet':
+            self._connect()
 
     def get_default_config_help(self):
         """
@@ -76,8 +123,13 @@ class TSDBHandler(Handler):
             'host': '',
             'port': '',
             'timeout': '',
-            'format': '',
-            'tags': '',
+            'format': 'Put command of the telnet protocol',
+            'tags': 'Tags added to every metric, as key=value pairs',
+            'batch': 'How many metrics to send at once',
+            'protocol': ('telnet: put commands over TCP. http: JSON posted '
+                         'to the HTTP API of OpenTSDB 2.x'),
+            'http_path': 'Path of the HTTP put endpoint',
+            'compression': 'gzip to compress HTTP requests, none otherwise',
         })
 
         return config
@@ -95,6 +147,10 @@ class TSDBHandler(Handler):
             'format': '{Collector}.{Metric} {timestamp} {value} hostname={host}'
                       '{tags}',
             'tags': '',
+            'batch': 1,
+            'protocol': 'telnet',
+            'http_path': '/api/put',
+            'compression': 'none',
         })
 
         return config
@@ -109,7 +165,91 @@ class TSDBHandler(Handler):
         """
         Process a metric by sending it to TSDB
         """
+        self.metrics.append(metric)
+        if len(self.metrics) >= self.batch_size:
+            self._send_batch()
+
+    def process_batch(self, metrics):
+        """
+        Process a list of metrics by sending them to TSDB in one write
+        """
+        self.metrics.extend(metrics)
+        if len(self.metrics) >= self.batch_size:
+            self._send_batch()
 
+    def flush(self):
+        """Flush metrics in queue"""
+        self._send_batch()
+
+    def _send_batch(self):
+        """
+        Send the buffered metrics in a single write or request
+        """
+        if not self.metrics:
+            return
+        metrics, self.metrics = self.metrics, []
+        if self.protocol == 'http':
+            self._post(metrics)
+        else:
+            self._send(''.join([self._format(metric) for metric in metrics]))
+
+    def _datapoint(self, metric):
+        """
+        Return a metric as a data point of the HTTP API
+        """
+        tags = {'hostname': metric.host}
+        tags.update(self.tag_dict)
+        return {
+            'metric': '%s.%s' % (metric.getCollectorPath(),
+                                 metric.getMetricPath()),
+            'timestamp': metric.timestamp,
+            'value': metric.value,
+            'tags': tags,
+        }
+
+    def _post(self, metrics):
+        """
+        Post metrics to the HTTP API, retrying once on a fresh connection
+        when the kept alive one was closed
+        """
+        body = json.dumps([self._datapoint(metric) for metric in metrics])
+        headers = {'Content-Type': 'application/json'}
+        if self.compress:
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            headers['Content-Encoding'] = 'gzip'
+
+        for attempt in range(2):
+            try:
+                if self.connection is None:
+                    self.connection = httplib.HTTPConnection(
+                        self.host, self.port, timeout=self.timeout)
+                self.connection.request('POST', self.http_path, body,
+                                        headers)
+                response = self.connection.getresponse()
+                content = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                self._close()
+                if attempt == 0:
+                    continue
+                self._throttle_error("TSDBHandler: Failed posting %d "
+                                     "metrics. %s", len(metrics), e)
+                self.stats.incr('errors')
+                return
+            break
+
+        self.stats.incr('bytes_sent', len(body))
+        if response.status >= 300:
+            self._throttle_error("TSDBHandler: %s rejected %d metrics: %d "
+                                 "%s", self.http_path, len(metrics),
+                                 response.status, content[:200])
+            self.stats.incr('errors')
+
+    def _format(self, metric):
+        """
+        Format a metric as a TSDB put command
+        """
         metric_str = self.metric_format.format(
             Collector=metric.getCollectorPath(),
             Path=metric.path,
@@ -119,8 +259,7 @@ class TSDBHandler(Handler):
             value=metric.value,
             tags=self.tags
         )
-        # Just send the data as a string
-        self._send("put " + str(metric_str) + "\n")
+        return "put " + str(metric_str) + "\n"
 
     def _send(self, data):
         """
@@ -142,6 +281,7 @@ class TSDBHandler(Handler):
             try:
                 # Send data to socket
                 self.socket.sendall(data)
+                self.stats.incr('bytes_sent', len(data))
                 # Done
                 break
             except socket.error, e:
@@ -189,3 +329,6 @@ class TSDBHandler(Handler):
         if self.socket is not None:
             self.socket.close()
         self.socket = None
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
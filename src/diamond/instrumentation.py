@@ -0,0 +1,188 @@
+# coding=utf-8
+
+"""
+Diamond's own metrics.
+
+Collectors, handlers and the scheduler keep counters and timings about what
+they do. The server registers each of them with the module level `registry`
+when it loads them, and the InternalMetricsCollector periodically publishes
+everything registered, along with the resource usage of the daemon process,
+through the normal handlers.
+
+#### Dependencies
+
+ * /proc/self/statm for the resident set size
+
+"""
+
+import gc
+import os
+import resource
+import threading
+
+from diamond.collector import Collector
+
+
+class Stats(object):
+    """
+    Counters and timings of one component.
+
+    Updates are not locked: a Stats instance must only be updated by one
+    thread at a time, which is the case for a collector run or a handler
+    holding its lock.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        # name -> [count, total seconds, max seconds] since the last snapshot
+        self.timers = {}
+
+    def incr(self, name, value=1):
+        """
+        Add value to a counter
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def timing(self, name, seconds):
+        """
+        Record a duration
+        """
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    def snapshot(self):
+        """
+        Return the counters, and the average and maximum of the timings
+        recorded since the previous snapshot
+        """
+        values = dict(self.counters)
+        timers, self.timers = self.timers, {}
+        for name, (count, total, maximum) in timers.items():
+            values[name + '_count'] = count
+            values[name + '_avg_ms'] = total / count * 1000
+            values[name + '_max_ms'] = maximum * 1000
+        return values
+
+
+class Registry(object):
+    """
+    The components whose metrics are published by the InternalMetricsCollector
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # prefix -> callable returning a dict of metric name to value
+        self.sources = {}
+
+    def register(self, prefix, source):
+        """
+        Register a callable returning the metrics of a component. Replaces any
+        source registered under the same prefix.
+        """
+        self.lock.acquire()
+        try:
+            self.sources[prefix] = source
+        finally:
+            self.lock.release()
+
+    def unregister(self, prefix):
+        self.lock.acquire()
+        try:
+            self.sources.pop(prefix, None)
+        finally:
+            self.lock.release()
+
+    def collect(self):
+        """
+        Return a list of (metric name, value) for all registered components
+        """
+        self.lock.acquire()
+        try:
+            sources = self.sources.items()
+        finally:
+            self.lock.release()
+
+        metrics = []
+        for prefix, source in sorted(sources):
+            for name, value in source().items():
+                metrics.append(('%s.%s' % (prefix, name), value))
+        return metrics
+
+registry = Registry()
+
+
+def get_process_metrics():
+    """
+    Return the resource usage of the daemon process
+    """
+    metrics = {
+        'threads': threading.activeCount(),
+    }
+
+    try:
+        f = open('/proc/self/statm')
+        try:
+            rss_pages = int(f.read().split()[1])
+        finally:
+            f.close()
+        metrics['rss'] = rss_pages * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        # Not linux, fall back to the peak resident set size
+        metrics['max_rss'] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    for generation, count in enumerate(gc.get_count()):
+        metrics['gc.generation%d' % generation] = count
+    metrics['gc.garbage'] = len(gc.garbage)
+    metrics['fds'] = _count_fds()
+    return metrics
+
+
+def _count_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return 0
+
+
+class InternalMetricsCollector(Collector):
+    """
+    Publishes the metrics of Diamond itself: collector runs, handler latency
+    and backlog, scheduler lag and the resource usage of the process. The
+    server always loads this collector, it only needs to be enabled.
+    """
+
+    def get_default_config_help(self):
+        config_help = super(InternalMetricsCollector,
+                            self).get_default_config_help()
+        config_help.update({
+            'path': 'Prefix of the internal metrics',
+        })
+        return config_help
+
+    def get_default_config(self):
+        """
+        Returns the default collector settings
+        """
+        config = super(InternalMetricsCollector, self).get_default_config()
+        config.update({
+            'path': 'diamond',
+            'interval': 60,
+        })
+        return config
+
+    def collect(self):
+        for name, value in registry.collect():
+            if isinstance(value, float):
+                self.publish(name, value, precision=2)
+            else:
+                self.publish(name, value)
+
+        for name, value in get_process_metrics().items():
+            self.publish('process.' + name, value)
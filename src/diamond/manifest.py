@@ -0,0 +1,149 @@
+# coding=utf-8
+
+"""
+Discover collectors without importing them.
+
+Importing every collector module at startup pays for all their optional
+dependencies, even though most collectors are disabled. In manifest mode the
+server parses the collector modules instead, to find the collector classes
+they define and the `enabled` default of their get_default_config, and only
+imports the modules with a collector enabled by the configuration.
+
+The parse results are kept per file along with its mtime, and can be saved
+to a cache file so that unchanged modules are not parsed again on the next
+start.
+"""
+
+import ast
+import os
+import tempfile
+
+try:
+    import cPickle as pickle
+    pickle  # workaround for pyflakes issue #13
+except ImportError:
+    import pickle as pickle
+
+MANIFEST_VERSION = 1
+
+
+def scan_collectors(filename):
+    """
+    Return a dict of collector class name to the value of 'enabled' in its
+    default config (None if it doesn't set one) for the collector classes
+    defined in filename. Returns None if the file can't be parsed.
+    """
+    try:
+        f = open(filename)
+        try:
+            tree = ast.parse(f.read(), filename)
+        finally:
+            f.close()
+    except (IOError, SyntaxError, TypeError):
+        return None
+
+    collectors = {}
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        # Same rules as Server.load_collectors, by name
+        if node.name.startswith('parent_'):
+            continue
+        if not [base for base in node.bases
+                if _base_name(base).endswith('Collector')]:
+            continue
+        collectors[node.name] = _default_enabled(node)
+    return collectors
+
+
+def _base_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return ''
+
+
+def _default_enabled(classdef):
+    """
+    Find the 'enabled' key of the dicts in get_default_config
+    """
+    for node in classdef.body:
+        if (not isinstance(node, ast.FunctionDef)
+                or node.name != 'get_default_config'):
+            continue
+        for child in ast.walk(node):
+            if not isinstance(child, ast.Dict):
+                continue
+            for key, value in zip(child.keys, child.values):
+                if not isinstance(key, ast.Str) or key.s != 'enabled':
+                    continue
+                if isinstance(value, ast.Str):
+                    return value.s
+                if isinstance(value, ast.Name):
+                    return value.id
+    return None
+
+
+class CollectorManifest(object):
+    """
+    The collector classes of every collector module, cached by mtime
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        # filename -> (mtime, {class name: default enabled})
+        self.entries = {}
+        self.dirty = False
+        if cache_file and os.path.exists(cache_file):
+            self.load()
+
+    def get_collectors(self, filename):
+        """
+        Return the collector classes defined in filename, or None if they
+        can't be known without importing it
+        """
+        mtime = os.stat(filename).st_mtime
+        entry = self.entries.get(filename)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        collectors = scan_collectors(filename)
+        self.entries[filename] = (mtime, collectors)
+        self.dirty = True
+        return collectors
+
+    def load(self):
+        f = open(self.cache_file, 'rb')
+        try:
+            try:
+                state = pickle.load(f)
+            except Exception:
+                # A corrupt cache is rebuilt
+                return
+        finally:
+            f.close()
+        if state.get('version') == MANIFEST_VERSION:
+            self.entries = state['entries']
+
+    def save(self):
+        """
+        Write the manifest to the cache file, if it changed
+        """
+        if not self.cache_file or not self.dirty:
+            return
+        state = {'version': MANIFEST_VERSION, 'entries': self.entries}
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(self.cache_file),
+                                       prefix='.manifest')
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmpname, self.cache_file)
+        except:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            raise
+        self.dirty = False
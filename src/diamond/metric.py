@@ -8,6 +8,13 @@ from error import DiamondException
 
 class Metric(object):
 
+    # Metrics are created for every published value, so keep them compact.
+    # The underscored slots cache derived values and are filled lazily; a
+    # Metric must not be modified once it has been handed to the handlers.
+    __slots__ = ('path', 'value', 'raw_value', 'timestamp', 'precision',
+                 'host', 'metric_type', 'ttl',
+                 '_str', '_path_prefix', '_collector_path', '_metric_path')
+
     _METRIC_TYPES = ['COUNTER', 'GAUGE']
 
     def __init__(self, path, value, raw_value=None, timestamp=None, precision=0,
@@ -64,20 +71,56 @@ class Metric(object):
         self.metric_type = metric_type
         self.ttl = ttl
 
+    @classmethod
+    def trusted(cls, path, value, timestamp, precision=0, host=None,
+                metric_type='COUNTER', ttl=None, raw_value=None):
+        """
+        Create a new instance of the Metric class without any validation
+
+        Only for callers that already guarantee a non-empty path, a numeric
+        value, an int timestamp and a valid metric_type.
+        """
+        metric = cls.__new__(cls)
+        metric.path = path
+        metric.value = value
+        metric.raw_value = raw_value
+        metric.timestamp = timestamp
+        metric.precision = precision
+        metric.host = host
+        metric.metric_type = metric_type
+        metric.ttl = ttl
+        return metric
+
+    def __getstate__(self):
+        return dict([(slot, getattr(self, slot)) for slot in self.__slots__
+                     if hasattr(self, slot)])
+
+    def __setstate__(self, state):
+        for slot, value in state.iteritems():
+            setattr(self, slot, value)
+
     def __repr__(self):
         """
         Return the Metric as a string
         """
+        try:
+            return self._str
+        except AttributeError:
+            pass
+
         if not isinstance(self.precision, (int, long)):
             log = logging.getLogger('diamond')
             log.warn('Metric %s does not have a valid precision', self.path)
             self.precision = 0
 
         # Set the format string
-        fstring = "%%s %%0.%if %%i\n" % self.precision
+        fstring = _FORMATS.get(self.precision)
+        if fstring is None:
+            fstring = "%%s %%0.%if %%i\n" % self.precision
 
-        # Return formated string
-        return fstring % (self.path, self.value, self.timestamp)
+        # Cache and return formated string
+        self._str = fstring % (self.path, self.value, self.timestamp)
+        return self._str
 
     @classmethod
     def parse(cls, string):
@@ -104,13 +147,19 @@ class Metric(object):
             servers.host.cpu.total.idle
             return "servers"
         """
+        try:
+            return self._path_prefix
+        except AttributeError:
+            pass
+
         # If we don't have a host name, assume it's just the first part of the
         # metric path
         if self.host is None:
-            return self.path.split('.')[0]
-
-        offset = self.path.index(self.host) - 1
-        return self.path[0:offset]
+            self._path_prefix = self.path.split('.')[0]
+        else:
+            offset = self.path.index(self.host) - 1
+            self._path_prefix = self.path[0:offset]
+        return self._path_prefix
 
     def getCollectorPath(self):
         """
@@ -118,15 +167,21 @@ class Metric(object):
             servers.host.cpu.total.idle
             return "cpu"
         """
+        try:
+            return self._collector_path
+        except AttributeError:
+            pass
+
         # If we don't have a host name, assume it's just the third part of the
         # metric path
         if self.host is None:
-            return self.path.split('.')[2]
-
-        offset = self.path.index(self.host)
-        offset += len(self.host) + 1
-        endoffset = self.path.index('.', offset)
-        return self.path[offset:endoffset]
+            self._collector_path = self.path.split('.')[2]
+        else:
+            offset = self.path.index(self.host)
+            offset += len(self.host) + 1
+            endoffset = self.path.index('.', offset)
+            self._collector_path = self.path[offset:endoffset]
+        return self._collector_path
 
     def getMetricPath(self):
         """
@@ -134,14 +189,25 @@ class Metric(object):
             servers.host.cpu.total.idle
             return "total.idle"
         """
+        try:
+            return self._metric_path
+        except AttributeError:
+            pass
+
         # If we don't have a host name, assume it's just the fourth+ part of the
         # metric path
         if self.host is None:
             path = self.path.split('.')[3:]
-            return '.'.join(path)
+            self._metric_path = '.'.join(path)
+        else:
+            prefix = '.'.join([self.getPathPrefix(), self.host,
+                               self.getCollectorPath()])
+
+            offset = len(prefix) + 1
+            self._metric_path = self.path[offset:]
+        return self._metric_path
 
-        prefix = '.'.join([self.getPathPrefix(), self.host,
-                           self.getCollectorPath()])
 
-        offset = len(prefix) + 1
-        return self.path[offset:]
+# Precomputed graphite line formats for the common precisions
+_FORMATS = dict([(precision, "%%s %%0.%if %%i\n" % precision)
+                 for precision in range(10)])
@@ -0,0 +1,71 @@
+# coding=utf-8
+
+"""
+Drop metrics before they are published.
+
+Collectors take `metrics_whitelist` and `metrics_blacklist` options, each a
+regular expression or a list of them, matched against the beginning of the
+metric name the collector publishes (without the hostname and path prefix).
+Set in the [[default]] collector section, they apply to every collector.
+
+When a whitelist is set only the metrics it matches are published, and the
+blacklist is ignored. Otherwise the metrics the blacklist matches are dropped.
+The patterns of a list are combined into a single regular expression, and the
+decision for every name is cached, so a dropped metric costs one cache lookup
+and never reaches the handlers.
+"""
+
+import re
+
+from diamond.util import LRUCache
+
+
+def compile_patterns(patterns):
+    """
+    Combine a regular expression or a list of them into a single compiled
+    one, or return None if there are none
+    """
+    if not patterns:
+        return None
+    if isinstance(patterns, basestring):
+        patterns = [patterns]
+    patterns = [pattern for pattern in patterns if pattern]
+    if not patterns:
+        return None
+    return re.compile('|'.join(['(?:%s)' % pattern for pattern in patterns]))
+
+
+class MetricFilter(object):
+    """
+    Decides which metric names are published
+    """
+
+    def __init__(self, whitelist=None, blacklist=None, cache_size=10000):
+        self.whitelist = compile_patterns(whitelist)
+        if self.whitelist is None:
+            self.blacklist = compile_patterns(blacklist)
+        else:
+            self.blacklist = None
+        # name -> True if published
+        self.decisions = LRUCache(cache_size)
+
+    def __nonzero__(self):
+        """
+        False when the filter accepts every name
+        """
+        return self.whitelist is not None or self.blacklist is not None
+
+    def accepts(self, name):
+        """
+        Return True if the metric named name is to be published
+        """
+        decision = self.decisions.get(name)
+        if decision is None:
+            if self.whitelist is not None:
+                decision = self.whitelist.match(name) is not None
+            elif self.blacklist is not None:
+                decision = self.blacklist.match(name) is None
+            else:
+                decision = True
+            self.decisions.put(name, decision)
+        return decision
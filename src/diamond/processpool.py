@@ -0,0 +1,272 @@
+# coding=utf-8
+
+"""
+Run collectors in a persistent pool of worker processes.
+
+Collectors configured with `method = ProcessPool` do their collect() in a
+worker process, so CPU heavy collectors can use more than one core without
+contending with the handlers for the GIL. The metrics they publish are sent
+back to the daemon process over a pipe and fed to the handlers there.
+Counters published with publish_counter are derived in the daemon process,
+so the counter state stays in one place.
+
+A collector always runs in the same worker, so state it keeps between runs
+(including values passed to derivative() directly) is preserved.
+
+The server starts the pool before any other thread, so the workers are
+forked from a process with a single thread. A worker that died or timed out
+is forked again from the running daemon, so workers reset the locks of the
+logging module, which another thread may have held at the time of the fork.
+"""
+
+import logging
+import os
+import signal
+import sys
+import threading
+import traceback
+
+import configobj
+
+from diamond.timeout import CollectorTimeout
+from diamond.timeout import run_with_timeout
+
+try:
+    import multiprocessing
+    multiprocessing  # workaround for pyflakes issue #13
+except ImportError:
+    multiprocessing = None
+
+
+class CollectorProcessPool(object):
+    """
+    A fixed-size pool of worker processes running collectors
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.log = logging.getLogger('diamond')
+        self.workers = []
+
+    def start(self):
+        """
+        Start the worker processes. Should be called before any other thread
+        is started, as the workers are forked from the calling process.
+        """
+        if multiprocessing is None:
+            raise NotImplementedError("multiprocessing is not available")
+        for i in range(self.size - len(self.workers)):
+            self.workers.append(CollectorWorker(len(self.workers)))
+
+    def stop(self):
+        """
+        Terminate the worker processes
+        """
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+    def collect(self, collector, timeout=0):
+        """
+        Run collector.collect() in a worker process and publish the collected
+        metrics from the calling process. If the run takes longer than
+        timeout seconds, the worker is killed and CollectorTimeout is raised.
+        When the pool has been stopped, the collector runs in this process.
+        """
+        name = collector.__class__.__name__
+        if not self.workers:
+            if timeout > 0:
+                run_with_timeout(collector.collect, timeout, name)
+            else:
+                collector.collect()
+            return
+
+        # String hashes don't change during the life of the process, so a
+        # collector keeps running in the same worker
+        worker = self.workers[hash(name) % len(self.workers)]
+        records = worker.call(collector.__class__.__module__, name,
+                              collector.config.dict(), timeout)
+
+        metrics = []
+        for record in records:
+            if record[0] == 'metric':
+                metrics.append(record[1])
+            else:
+                name, value, kwargs = record[1:]
+                collector.publish_counter(name, value, **kwargs)
+        collector.publish_metrics(metrics)
+
+
+class CollectorWorker(object):
+    """
+    A worker process and the pipe used to talk to it
+    """
+
+    def __init__(self, number):
+        self.number = number
+        self.log = logging.getLogger('diamond')
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=worker_main, args=(child_conn,),
+            name='diamond-collector-worker-%d' % self.number)
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def stop(self, sig=signal.SIGTERM):
+        if self.process is not None and self.process.is_alive():
+            self.kill(sig)
+            self.process.join(5)
+        self.process = None
+
+    def kill(self, sig):
+        """
+        Send a signal to the worker and the processes it started
+        """
+        try:
+            os.killpg(self.process.pid, sig)
+        except OSError:
+            # The worker has not made its own process group yet
+            try:
+                os.kill(self.process.pid, sig)
+            except OSError:
+                pass
+
+    def restart(self, sig=signal.SIGTERM):
+        self.stop(sig)
+        self.conn.close()
+        self.start()
+
+    def call(self, modname, clsname, config, timeout=0):
+        """
+        Run a collector in the worker process and return what it published
+        """
+        self.lock.acquire()
+        try:
+            if not self.process.is_alive():
+                self.log.error("Collector worker %d died, restarting it",
+                               self.number)
+                self.restart()
+            try:
+                self.conn.send((modname, clsname, config))
+                if timeout > 0 and not self.conn.poll(timeout):
+                    # Kill the hung worker along with its children
+                    self.restart(signal.SIGKILL)
+                    raise CollectorTimeout("%s timed out after %ss in worker "
+                                           "%d" % (clsname, timeout,
+                                                   self.number))
+                status, result = self.conn.recv()
+            except (EOFError, IOError):
+                # The worker died while running the collector
+                self.restart()
+                raise
+        finally:
+            self.lock.release()
+
+        if status == 'error':
+            raise WorkerError(result)
+        return result
+
+
+class WorkerError(Exception):
+    """
+    An exception raised by a collector in a worker process
+    """
+    pass
+
+
+def reset_logging_locks():
+    """
+    Replace the locks of the logging module and its handlers, which may have
+    been held by another thread of the parent process when it forked
+    """
+    logging._lock = threading.RLock()
+    for ref in logging._handlerList:
+        handler = ref()
+        if handler is not None:
+            handler.createLock()
+
+
+def worker_main(conn):
+    """
+    Main loop of a worker process
+    """
+    # Run in a process group of our own, so that the processes started by
+    # collectors can be killed along with the worker
+    os.setpgrp()
+    reset_logging_locks()
+    # The daemon process handles the signals
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    collectors = {}
+    while True:
+        try:
+            modname, clsname, config = conn.recv()
+        except (EOFError, IOError):
+            return
+
+        try:
+            key = (modname, clsname)
+            # Build the collector again whenever its config changed
+            if key not in collectors or collectors[key][0] != config:
+                collectors[key] = (config, build_collector(modname, clsname,
+                                                           config))
+            collector = collectors[key][1]
+
+            del collector.records[:]
+            try:
+                collector.collect()
+            finally:
+                collector.last_values.next_cycle()
+            conn.send(('ok', collector.records))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+
+
+def build_collector(modname, clsname, config):
+    """
+    Create an instance of a collector in a worker process. The instance
+    records what it publishes instead of handing it to handlers.
+    """
+    __import__(modname, globals(), locals(), ['*'])
+    cls = getattr(sys.modules[modname], clsname)
+
+    collector_config = configobj.ConfigObj()
+    collector_config['server'] = {'collectors_config_path': ''}
+    collector_config['collectors'] = {'default': config}
+    # Counter state is kept and saved by the daemon process
+    collector_config['collectors']['default']['counter_state_path'] = ''
+    collector = cls(collector_config, [])
+    collector.records = []
+
+    def publish_counter(name, value, precision=0, max_value=0,
+                        time_delta=True, interval=None, allow_negative=False,
+                        instance=None):
+        # Counters are derived by the daemon process
+        collector.records.append(('counter', name, value, {
+            'precision': precision,
+            'max_value': max_value,
+            'time_delta': time_delta,
+            'interval': interval,
+            'allow_negative': allow_negative,
+            'instance': instance,
+        }))
+
+    def publish_metric(metric):
+        collector.records.append(('metric', metric))
+
+    def publish_metrics(metrics):
+        for metric in metrics:
+            collector.records.append(('metric', metric))
+
+    collector.publish_counter = publish_counter
+    collector.publish_metric = publish_metric
+    collector.publish_metrics = publish_metrics
+    return collector
@@ -0,0 +1,144 @@
+# coding=utf-8
+
+"""
+On-demand profiling of collectors and handlers.
+
+A profiling session is started by sending SIGUSR2 to the daemon, or at
+startup with `profile_at_start`. While it lasts, the next `profile_runs` runs
+of every collector and all the work the handlers do are profiled with
+cProfile. When the session is over, after `profile_duration` seconds, one
+profile per collector and per handler is written to `profile_path`, to be read
+with pstats or any tool understanding its format.
+
+When no session is running the hooks cost a single attribute lookup, so they
+are always compiled in.
+
+Profiles can't be nested, so the handler work done in a collector thread while
+the collector is profiled is part of the collector profile. Handler profiles
+hold what the handlers do in their own threads (dispatch queues, flusher).
+"""
+
+import cProfile
+import logging
+import os
+import threading
+import time
+
+# The current ProfileSession, None when not profiling
+session = None
+
+
+class ProfileSession(object):
+    """
+    Profiles collected over a limited amount of time
+    """
+
+    def __init__(self, directory, runs, duration):
+        self.directory = directory
+        self.runs = runs
+        self.started = time.time()
+        self.deadline = self.started + duration
+        self.log = logging.getLogger('diamond')
+        self.lock = threading.Lock()
+        # key -> cProfile.Profile
+        self.profiles = {}
+        # key -> number of profiled collector runs
+        self.counts = {}
+        self._local = threading.local()
+
+    def run_collector(self, name, func):
+        """
+        Call func, profiling it if the collector has not been profiled for
+        enough runs yet
+        """
+        key = 'collector-' + name
+        self.lock.acquire()
+        try:
+            count = self.counts.get(key, 0)
+            if count < self.runs:
+                self.counts[key] = count + 1
+        finally:
+            self.lock.release()
+        if count >= self.runs:
+            return func()
+        return self.call(key, func)
+
+    def call(self, key, func, *args):
+        """
+        Call func, adding its profile to the profile named key
+        """
+        # A thread can only run one profiler at a time
+        if getattr(self._local, 'profiling', False):
+            return func(*args)
+
+        self.lock.acquire()
+        try:
+            profile = self.profiles.get(key)
+            if profile is None:
+                profile = self.profiles[key] = cProfile.Profile()
+        finally:
+            self.lock.release()
+
+        self._local.profiling = True
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            self._local.profiling = False
+
+    def dump(self):
+        """
+        Write the profiles to the profile directory
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))
+        self.lock.acquire()
+        try:
+            profiles = self.profiles.items()
+        finally:
+            self.lock.release()
+
+        for key, profile in profiles:
+            filename = os.path.join(self.directory,
+                                    '%s-%s.prof' % (key, stamp))
+            profile.dump_stats(filename)
+        self.log.info("Wrote %d profiles to %s", len(profiles),
+                      self.directory)
+
+
+def start(directory, runs=5, duration=600):
+    """
+    Start a profiling session, unless one is already running
+    """
+    global session
+    if session is not None:
+        return False
+    session = ProfileSession(directory, runs, duration)
+    logging.getLogger('diamond').info(
+        "Profiling the next %d runs of every collector for %ds", runs,
+        duration)
+    return True
+
+
+def stop():
+    """
+    End the profiling session and write its profiles
+    """
+    global session
+    current, session = session, None
+    if current is not None:
+        current.dump()
+
+
+def tick(now=None):
+    """
+    End the profiling session if its time is up
+    """
+    current = session
+    if current is None:
+        return
+    if now is None:
+        now = time.time()
+    if now >= current.deadline:
+        stop()
@@ -4,13 +4,16 @@
 
 This task scheduler is designed to be used from inside your own program.
 You can schedule Python functions to be called at specific intervals or
-days. It uses the standard 'sched' module for the actual task scheduling,
-but provides much more:
+days. Pending task executions are kept in a heap, so adding and cancelling a
+task costs O(log n) and O(1) respectively, and it provides:
 
 * repeated tasks (at intervals, or on specific days)
 * error handling (exceptions in tasks don't kill the scheduler)
 * optional to run scheduler in its own thread or separate process
 * optional to run a task in its own thread or separate process
+* optional alignment of interval tasks on the wall clock, so that a task
+  with a 60 second interval fires on the minute
+* per task drift (how late it started) and overrun accounting
 
 If the threading module is available, you can use the various Threaded
 variants of the scheduler and associated tasks. If threading is not
@@ -21,6 +24,10 @@ There are three Scheduler classes:
 
     Scheduler    ThreadedScheduler    ForkedScheduler
 
+The ThreadedScheduler can also run tasks on a fixed-size pool of worker
+threads (the pooled processmethod), instead of starting a new thread for
+every execution of every task.
+
 You usually add new tasks to a scheduler using the add_interval_task or
 add_daytime_task methods, with the appropriate processmethod argument
 to select sequential, threaded or forked processing. NOTE: it is impossible
@@ -33,13 +40,16 @@ and use schedule_task or schedule_task_abs:
     WeekdayTask     ThreadedWeekdayTask     ForkedWeekdayTask
     MonthdayTask    ThreadedMonthdayTask    ForkedMonthdayTask
 
+    PooledIntervalTask    PooledSingleTask
+    PooledWeekdayTask     PooledMonthdayTask
+
 Kronos is the Greek God of Time.
 
 Kronos scheduler (c) Irmen de Jong.
 This version has been extracted from the Turbogears source repository
-and slightly changed to be completely stand-alone again. Also some fixes
-have been made to make it work on Python 2.6 (sched module changes).
-The version in Turbogears is based on the original stand-alone Kronos.
+and slightly changed to be completely stand-alone again. The sched module
+based queue has since been replaced by a heap maintained by the Scheduler
+itself. The version in Turbogears is based on the original stand-alone Kronos.
 This is open-source software, released under the MIT Software License:
 http://www.opensource.org/licenses/mit-license.php
 
@@ -57,6 +67,11 @@ __all__ = [
     "ForkedWeekdayTask",
     "IntervalTask",
     "MonthdayTask",
+    "PooledIntervalTask",
+    "PooledMonthdayTask",
+    "PooledSingleTask",
+    "PooledTaskMixin",
+    "PooledWeekdayTask",
     "Scheduler",
     "SingleTask",
     "Task",
@@ -67,12 +82,13 @@ __all__ = [
     "ThreadedTaskMixin",
     "ThreadedWeekdayTask",
     "WeekdayTask",
+    "WorkerPool",
 ]
 
 import os
 import sys
-import sched
 import time
+import heapq
 import logging
 import traceback
 import weakref
@@ -82,50 +98,25 @@ class method:
     sequential = "sequential"
     forked = "forked"
     threaded = "threaded"
-
-
-class SchedulerNotRunning(Exception):
-    """Interrupt a running scheduler.
-
-    This exception is used to break out of sched.sched.run when we
-    are not running.
-
-    """
-    pass
+    pooled = "pooled"
 
 
 class Scheduler:
     """The Scheduler itself."""
 
+    # Longest time to sleep before checking the running flag again
+    max_wait = 5
+
     def __init__(self):
         self.running = True
         self.log = logging.getLogger('diamond')
-        self.sched = sched.scheduler(time.time, self.__delayfunc)
-
-    def __delayfunc(self, delay):
-        # This delay function is basically a time.sleep() that is
-        # divided up, so that we can check the self.running flag while
-        # delaying. There is an additional check in here to ensure that the
-        # top item of the queue hasn't changed
-        if delay < 10:
-            time.sleep(delay)
-        else:
-            toptime = self._getqueuetoptime()
-            endtime = time.time() + delay
-            period = 5
-            stoptime = endtime - period
-            while (self.running
-                    and stoptime > time.time()
-                    and self._getqueuetoptime() == toptime):
-                time.sleep(period)
-
-            if self.running and self._getqueuetoptime() == toptime:
-                now = time.time()
-                if endtime > now:
-                    time.sleep(endtime - now)
-
-        if not self.running:
-            raise SchedulerNotRunning()
+        # Heap of [time, sequence, task] entries. Cancelled entries stay in
+        # the heap with task set to None until they reach the top.
+        self._queue = []
+        self._sequence = 0
+        self._pending = 0
+        # Largest delay in starting a task since the last get_internal_metrics
+        self.max_drift = 0.0
 
     def _acquire_lock(self):
         pass
@@ -133,14 +124,33 @@ class Scheduler:
     def _release_lock(self):
         pass
 
+    def get_internal_metrics(self):
+        """Return the number of scheduled tasks and the scheduling lag."""
+        metrics = {
+            'tasks': self._pending,
+            'max_lag_ms': self.max_drift * 1000,
+        }
+        self.max_drift = 0.0
+        if self._has_pool():
+            metrics['pool_queue'] = self.pool.queue.qsize()
+        return metrics
+
+    def _has_pool(self):
+        # Only the ThreadedScheduler has a worker pool
+        return False
+
     def add_interval_task(self, action, taskname, initialdelay, interval,
-                          processmethod, args, kw, abs=False):
+                          processmethod, args, kw, abs=False, align=False):
         """Add a new Interval Task to the schedule.
 
         A very short initialdelay or one of zero cannot be honored, you will
         see a slight delay before the task is first executed. This is because
         the scheduler needs to pick it up in its loop.
 
+        If align is True, the task runs at multiples of interval on the wall
+        clock, offset by initialdelay, instead of every interval seconds from
+        now.
+
         """
         if initialdelay < 0 or interval < 1:
             raise ValueError("Delay or interval must be >0")
@@ -152,6 +162,8 @@ class Scheduler:
             TaskClass = ThreadedIntervalTask
         elif processmethod == method.forked:
             TaskClass = ForkedIntervalTask
+        elif processmethod == method.pooled and self._has_pool():
+            TaskClass = PooledIntervalTask
         else:
             raise ValueError("Invalid processmethod")
         if not args:
@@ -159,7 +171,15 @@ class Scheduler:
         if not kw:
             kw = {}
         task = TaskClass(taskname, interval, action, args, kw, abs)
-        self.schedule_task(task, initialdelay)
+        if align:
+            task.align = True
+            now = time.time()
+            firsttime = now - now % interval + initialdelay % interval
+            if firsttime <= now:
+                firsttime += interval
+            self.schedule_task_abs(task, firsttime)
+        else:
+            self.schedule_task(task, initialdelay)
         return task
 
     def add_single_task(self, action, taskname, initialdelay, processmethod,
@@ -174,6 +194,8 @@ class Scheduler:
             TaskClass = ThreadedSingleTask
         elif processmethod == method.forked:
             TaskClass = ForkedSingleTask
+        elif processmethod == method.pooled and self._has_pool():
+            TaskClass = PooledSingleTask
         else:
             raise ValueError("Invalid processmethod")
         if not args:
@@ -203,6 +225,8 @@ class Scheduler:
                 TaskClass = ThreadedWeekdayTask
             elif processmethod == method.forked:
                 TaskClass = ForkedWeekdayTask
+            elif processmethod == method.pooled and self._has_pool():
+                TaskClass = PooledWeekdayTask
             else:
                 raise ValueError("Invalid processmethod")
             task = TaskClass(taskname, weekdays, timeonday, action, args, kw)
@@ -215,6 +239,8 @@ class Scheduler:
                 TaskClass = ThreadedMonthdayTask
             elif processmethod == method.forked:
                 TaskClass = ForkedMonthdayTask
+            elif processmethod == method.pooled and self._has_pool():
+                TaskClass = PooledMonthdayTask
             else:
                 raise ValueError("Invalid processmethod")
             task = TaskClass(taskname, monthdays, timeonday, action, args, kw)
@@ -228,17 +254,7 @@ class Scheduler:
         Low-level method for internal use.
 
         """
-        if self.running:
-            # lock the sched queue, if needed
-            self._acquire_lock()
-            try:
-                task.event = self.sched.enter(delay, 0, task,
-                                             (weakref.ref(self),))
-            finally:
-                self._release_lock()
-        else:
-            task.event = self.sched.enter(delay, 0, task,
-                                         (weakref.ref(self),))
+        self.schedule_task_abs(task, time.time() + delay)
 
     def schedule_task_abs(self, task, abstime):
         """Add a new task to the scheduler for the given absolute time value.
@@ -246,17 +262,17 @@ class Scheduler:
         Low-level method for internal use.
 
         """
-        if self.running:
-            # lock the sched queue, if needed
-            self._acquire_lock()
-            try:
-                task.event = self.sched.enterabs(abstime, 0, task,
-                                                (weakref.ref(self),))
-            finally:
-                self._release_lock()
-        else:
-            task.event = self.sched.enterabs(abstime, 0, task,
-                                            (weakref.ref(self),))
+        # lock the task queue, if needed
+        self._acquire_lock()
+        try:
+            self._sequence += 1
+            entry = [abstime, self._sequence, task]
+            heapq.heappush(self._queue, entry)
+            self._pending += 1
+            task.event = entry
+            self._notify()
+        finally:
+            self._release_lock()
 
     def start(self):
         """Start the scheduler."""
@@ -265,48 +281,88 @@ class Scheduler:
     def stop(self):
         """Remove all pending tasks and stop the Scheduler."""
         self.running = False
+        self._acquire_lock()
+        try:
+            self._notify()
+        finally:
+            self._release_lock()
         # Pending tasks are removed in _run.
 
     def cancel(self, task):
         """Cancel given scheduled task."""
-        self.sched.cancel(task.event)
-
-    if sys.version_info >= (2, 6):
-        # code for sched module of python 2.6+
-        def _getqueuetoptime(self):
-            return self.sched._queue[0].time
-
-        def _clearschedqueue(self):
-            self.sched._queue[:] = []
-
-    else:
-        # code for sched module of python 2.5 and older
-        def _getqueuetoptime(self):
-            return self.sched.queue[0][0]
+        self._acquire_lock()
+        try:
+            entry = task.event
+            if entry[2] is not None:
+                entry[2] = None
+                self._pending -= 1
+        finally:
+            self._release_lock()
+
+    def empty(self):
+        """Return True if no task is scheduled."""
+        return self._pending == 0
+
+    def _notify(self):
+        # Wake up the scheduling loop. Called with the lock held.
+        pass
 
-        def _clearschedqueue(self):
-            self.sched.queue[:] = []
+    def _wait(self, delay):
+        # Sleep until the next task is due. Called with the lock held. The
+        # sleep is divided up, so that we can check the self.running flag.
+        time.sleep(min(delay, self.max_wait))
 
     def _run(self):
         # Low-level run method to do the actual scheduling loop.
         while self.running:
             try:
-                self.sched.run()
-            except SchedulerNotRunning:
-                self._clearschedqueue()
+                self._acquire_lock()
+                try:
+                    # Discard cancelled entries
+                    while self._queue and self._queue[0][2] is None:
+                        heapq.heappop(self._queue)
+                    if not self._queue:
+                        # queue is empty; wait a while before checking again
+                        self._wait(self.max_wait)
+                        continue
+                    scheduled, sequence, task = self._queue[0]
+                    delay = scheduled - time.time()
+                    if delay > 0:
+                        self._wait(delay)
+                        continue
+                    heapq.heappop(self._queue)
+                    self._pending -= 1
+                finally:
+                    self._release_lock()
+
+                # How late the task is started
+                task.scheduled_time = scheduled
+                task.drift = time.time() - scheduled
+                if task.drift > self.max_drift:
+                    self.max_drift = task.drift
+                task(weakref.ref(self))
             except Exception, x:
                 self.log.error(
                     "ERROR DURING SCHEDULER EXECUTION %s \n %s",
                     x,
                     "".join(traceback.format_exception(*sys.exc_info())))
-            # queue is empty; sleep a short while before checking again
-            if self.running:
-                time.sleep(5)
+
+        # Remove pending tasks
+        self._acquire_lock()
+        try:
+            self._queue = []
+            self._pending = 0
+        finally:
+            self._release_lock()
 
 
 class Task(object):
     """Abstract base class of all scheduler tasks"""
 
+    # Maximum number of executions of this task that may be queued or running
+    # on a worker pool at the same time
+    max_concurrent = 1
+
     def __init__(self, name, action, args, kw):
         """This is an abstract class!"""
         self.name = name
@@ -314,6 +370,19 @@ class Task(object):
         self.args = args
         self.kw = kw
         self.log = logging.getLogger('diamond')
+        # Worker pool accounting
+        self.pending = 0
+        self.skipped = 0
+        self.queue_wait = 0.0
+        # Longest queue wait since the last get_internal_metrics
+        self.max_queue_wait = 0.0
+        # Time the current execution was scheduled for, and how late it was
+        # started
+        self.scheduled_time = None
+        self.drift = 0.0
+        # Number of times the task ran for longer than its interval, or
+        # missed its slot
+        self.overruns = 0
 
     def __call__(self, schedulerref):
         """Execute the task action in the scheduler's thread."""
@@ -332,6 +401,15 @@ class Task(object):
         """Execute the actual task."""
         self.action(*self.args, **self.kw)
 
+    def get_internal_metrics(self):
+        """Return the worker pool statistics of the task."""
+        metrics = {
+            'pool_skipped_runs': self.skipped,
+            'pool_max_queue_wait_ms': self.max_queue_wait * 1000,
+        }
+        self.max_queue_wait = 0.0
+        return metrics
+
     def handle_exception(self, exc):
         """Handle any exception that occured during task execution."""
         self.log.error("ERROR DURING TASK EXECUTION %s \n %s", exc,
@@ -351,19 +429,35 @@ class IntervalTask(Task):
     def __init__(self, name, interval, action, args=None, kw=None, abs=False):
         Task.__init__(self, name, action, args, kw)
         self.absolute = abs
+        self.align = False
         self.interval = interval
         self.duration = 0
 
     def execute(self):
         """ Execute the actual task."""
         start_time = time.time()
-        self.action(*self.args, **self.kw)
+        result = self.action(*self.args, **self.kw)
         end_time = time.time()
         self.duration = int(end_time - start_time)
+        if end_time - start_time > self.interval:
+            self.overruns += 1
+        # Actions may return a new interval to adapt their schedule
+        if (isinstance(result, (int, long, float))
+                and not isinstance(result, bool) and result > 0):
+            self.interval = result
 
     def reschedule(self, scheduler):
         """Reschedule this task according to its interval (in seconds)."""
-        if self.absolute and self.duration:
+        if self.align and self.scheduled_time is not None:
+            # Run in the next slot, skipping the slots we already missed
+            nexttime = self.scheduled_time + self.interval
+            now = time.time()
+            if nexttime <= now:
+                missed = int((now - nexttime) // self.interval) + 1
+                self.overruns += missed
+                nexttime += missed * self.interval
+            scheduler.schedule_task_abs(self, nexttime)
+        elif self.absolute and self.duration:
             if self.duration < self.interval:
                 scheduler.schedule_task(self, self.interval - self.duration)
             else:
@@ -456,16 +550,90 @@ class MonthdayTask(DayTaskRescheduler, Task):
 try:
     import threading
 
+    import Queue
+
+    class WorkerPool(object):
+        """A fixed-size pool of threads executing tasks."""
+
+        def __init__(self, size):
+            self.size = size
+            self.log = logging.getLogger('diamond')
+            self.queue = Queue.Queue()
+            self.threads = []
+            self._lock = threading.Lock()
+
+        def start(self):
+            """Start the worker threads."""
+            for i in range(self.size - len(self.threads)):
+                thread = threading.Thread(target=self._worker,
+                                          name='pool-%d' % len(self.threads))
+                thread.setDaemon(True)
+                thread.start()
+                self.threads.append(thread)
+
+        def stop(self, timeout=5):
+            """Stop the worker threads once they finish their current task."""
+            for thread in self.threads:
+                self.queue.put(None)
+            for thread in self.threads:
+                thread.join(timeout)
+            self.threads = []
+
+        def submit(self, task):
+            """Queue a task execution, unless too many are already pending.
+
+            Returns False if the execution was skipped.
+
+            """
+            self._lock.acquire()
+            try:
+                if task.pending >= task.max_concurrent:
+                    task.skipped += 1
+                    self.log.debug("Skipped task %s, %d executions pending",
+                                   task.name, task.pending)
+                    return False
+                task.pending += 1
+            finally:
+                self._lock.release()
+            self.queue.put((task, time.time()))
+            return True
+
+        def _worker(self):
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                task, queued = item
+                task.queue_wait = time.time() - queued
+                task.max_queue_wait = max(task.max_queue_wait,
+                                          task.queue_wait)
+                try:
+                    try:
+                        task.execute()
+                    except Exception, x:
+                        task.handle_exception(x)
+                finally:
+                    self._lock.acquire()
+                    task.pending -= 1
+                    self._lock.release()
+
     class ThreadedScheduler(Scheduler):
         """A Scheduler that runs in its own thread."""
 
-        def __init__(self):
+        def __init__(self, pool_size=0):
             Scheduler.__init__(self)
-            # we require a lock around the task queue
-            self._lock = threading.Lock()
+            # we require a lock around the task queue, which also wakes up
+            # the scheduling loop when a task is added
+            self._lock = threading.Condition(threading.Lock())
+            # optional pool of threads for the pooled processmethod
+            self.pool = None
+            if pool_size > 0:
+                self.pool = WorkerPool(pool_size)
 
         def start(self):
             """Splice off a thread in which the scheduler will run."""
+            if self.pool is not None:
+                self.pool.start()
             self.thread = threading.Thread(target=self._run)
             self.thread.setDaemon(True)
             self.thread.start()
@@ -477,6 +645,11 @@ try:
                 self.thread.join()
             except AttributeError:
                 pass
+            if self.pool is not None:
+                self.pool.stop()
+
+        def _has_pool(self):
+            return self.pool is not None
 
         def _acquire_lock(self):
             """Lock the thread's task queue."""
@@ -486,6 +659,14 @@ try:
             """Release the lock on the thread's task queue."""
             self._lock.release()
 
+        def _notify(self):
+            """Wake up the scheduling loop."""
+            self._lock.notify()
+
+        def _wait(self, delay):
+            """Wait until the next task is due or a new task is added."""
+            self._lock.wait(min(delay, self.max_wait))
+
     class ThreadedTaskMixin:
         """A mixin class to make a Task execute in a separate thread."""
 
@@ -525,6 +706,38 @@ try:
         """Monthday Task that executes in its own thread."""
         pass
 
+    class PooledTaskMixin:
+        """A mixin class to make a Task execute on the scheduler's pool."""
+
+        def __call__(self, schedulerref):
+            """Queue the task action on the worker pool."""
+            scheduler = schedulerref()
+            scheduler.pool.submit(self)
+            self.reschedule(scheduler)
+
+    class PooledIntervalTask(PooledTaskMixin, IntervalTask):
+        """Interval Task that executes on a worker pool."""
+
+        def __init__(self, name, interval, action, args=None, kw=None,
+                     abs=False):
+            # Force abs to be False, as in pooled mode we reschedule
+            # immediately.
+            super(PooledIntervalTask, self).__init__(name, interval, action,
+                                                     args=args, kw=kw,
+                                                     abs=False)
+
+    class PooledSingleTask(PooledTaskMixin, SingleTask):
+        """Single Task that executes on a worker pool."""
+        pass
+
+    class PooledWeekdayTask(PooledTaskMixin, WeekdayTask):
+        """Weekday Task that executes on a worker pool."""
+        pass
+
+    class PooledMonthdayTask(PooledTaskMixin, MonthdayTask):
+        """Monthday Task that executes on a worker pool."""
+        pass
+
 except ImportError:
     # threading is not available
     pass
@@ -551,7 +764,7 @@ if hasattr(os, "fork"):
                 # we are the parent
                 self.childpid = pid
                 # can no longer insert in the scheduler queue
-                del self.sched
+                del self._queue
 
         def stop(self):
             """Stop the scheduler and wait for the process to finish."""
@@ -7,6 +7,8 @@ import logging
 import traceback
 import configobj
 import inspect
+import multiprocessing
+import tempfile
 
 # Path Fix
 sys.path.append(
@@ -15,13 +17,29 @@ sys.path.append(
             os.path.dirname(__file__), "../")))
 
 import diamond
+from diamond import profiler
 
 from diamond.collector import Collector
+from diamond.collector import str_to_bool
 from diamond.handler.Handler import Handler
+from diamond.handler.flusher import HandlerFlusher
+from diamond.instrumentation import InternalMetricsCollector
+from diamond.instrumentation import registry
+from diamond.manifest import CollectorManifest
 from diamond.scheduler import ThreadedScheduler
+from diamond.processpool import CollectorProcessPool
 from diamond.util import load_class_from_name
 
 
+def section_dict(config, name):
+    """
+    Return a config section as a plain dict, for comparisons
+    """
+    if name not in config:
+        return {}
+    return config[name].dict()
+
+
 class Server(object):
     """
     Server class loads and starts Handlers and Collectors
@@ -36,8 +54,22 @@ class Server(object):
         self.handlers = []
         self.modules = {}
         self.tasks = {}
+        self.collectors = {}
+        # Collector classes by name, including disabled collectors
+        self.collector_classes = {}
+        # Config file path -> mtime, to detect config changes
+        self.config_mtimes = {}
+        self.flusher = None
+        self.process_pool = None
+        # Set in manifest mode, to skip importing disabled collectors
+        self.manifest = None
         # Initialize Scheduler
-        self.scheduler = ThreadedScheduler()
+        pool_size = 0
+        if 'server' in self.config and 'thread_pool_size' in self.config[
+                'server']:
+            pool_size = int(self.config['server']['thread_pool_size'])
+        self.scheduler = ThreadedScheduler(pool_size)
+        registry.register('scheduler', self.scheduler.get_internal_metrics)
 
     def load_config(self):
         """
@@ -67,10 +99,20 @@ class Server(object):
         """
         Load handlers
         """
+        for handler in self.build_handlers():
+            self.add_handler(handler)
+
+    def build_handlers(self):
+        """
+        Build the handlers of the current config. If one fails with an error
+        other than an import error, the handlers built so far are shut down
+        and the error is raised.
+        """
         if isinstance(self.config['server']['handlers'], basestring):
             handlers = [self.config['server']['handlers']]
             self.config['server']['handlers'] = handlers
 
+        built = []
         for h in self.config['server']['handlers']:
             try:
                 # Load Handler Class
@@ -94,13 +136,23 @@ class Server(object):
                     handler_config.merge(configobj.ConfigObj(configfile))
 
                 # Initialize Handler class
-                self.handlers.append(cls(handler_config))
+                built.append(cls(handler_config))
 
             except (ImportError, SyntaxError):
                 # Log Error
                 self.log.debug("Failed to load handler %s. %s", h,
                                traceback.format_exc())
                 continue
+            except Exception:
+                for handler in built:
+                    handler._shutdown(5)
+                raise
+        return built
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+        registry.register('handlers.' + handler.__class__.__name__,
+                          handler.get_internal_metrics)
 
     def load_collector(self, fqcn):
         """
@@ -172,6 +224,15 @@ class Server(object):
 
                 modname = f[:-3]
 
+                # Don't import modules whose collectors are all disabled
+                if (self.manifest is not None
+                        and not filter
+                        and modname not in self.modules
+                        and not self.has_enabled_collector(fpath)):
+                    self.log.debug("Skipped %s, no enabled collector",
+                                   modname)
+                    continue
+
                 # Stat module file to get mtime
                 st = os.stat(os.path.join(path, f))
                 mtime = st.st_mtime
@@ -225,11 +286,43 @@ class Server(object):
         # Return Collector classes
         return collectors
 
+    def has_enabled_collector(self, filename):
+        """
+        Tell from the manifest and the config whether the module in filename
+        defines an enabled collector. Modules the manifest knows nothing
+        about are assumed to.
+        """
+        collectors = self.manifest.get_collectors(filename)
+        if collectors is None:
+            return True
+
+        for name, default in collectors.items():
+            # Same precedence as Collector.__init__
+            enabled = default or False
+            sections = [self.config['collectors'].get('default', {}),
+                        self.config['collectors'].get(name, {})]
+            configfile = os.path.join(
+                self.config['server']['collectors_config_path'],
+                name) + '.conf'
+            if os.path.exists(configfile):
+                sections.append(configobj.ConfigObj(configfile))
+            for section in sections:
+                if 'enabled' in section:
+                    enabled = section['enabled']
+            try:
+                if str_to_bool(enabled):
+                    return True
+            except NotImplementedError:
+                # Let the collector complain about it
+                return True
+        return False
+
     def init_collector(self, cls):
         """
         Initialize collector
         """
         collector = None
+        self.collector_classes[cls.__name__] = cls
         try:
             # Initialize Collector
             collector = cls(self.config, self.handlers)
@@ -258,6 +351,9 @@ class Server(object):
                            c.__class__.__name__)
             return
 
+        # Tasks run on the worker pool, whose waits are reported
+        pooled_tasks = []
+
         # Get collector schedule
         for name, schedule in c.get_schedule().items():
             # Get scheduler args
@@ -276,6 +372,26 @@ class Server(object):
                     method = diamond.scheduler.method.threaded
                 elif c.config['method'] == 'Forked':
                     method = diamond.scheduler.method.forked
+                elif c.config['method'] == 'Pooled':
+                    if self.scheduler.pool is not None:
+                        method = diamond.scheduler.method.pooled
+                    else:
+                        self.log.warn("No thread pool configured, running "
+                                      "%s threaded", name)
+                        method = diamond.scheduler.method.threaded
+                elif c.config['method'] == 'ProcessPool':
+                    if self.process_pool is not None:
+                        c.process_pool = self.process_pool
+                    else:
+                        self.log.warn("No collector worker processes were "
+                                      "started, running %s threaded. "
+                                      "Restart diamond to run it in the "
+                                      "process pool", name)
+                    # The scheduling thread only waits for the worker
+                    if self.scheduler.pool is not None:
+                        method = diamond.scheduler.method.pooled
+                    else:
+                        method = diamond.scheduler.method.threaded
 
             # Schedule Collector
             if interval_task:
@@ -286,7 +402,8 @@ class Server(object):
                                                         method,
                                                         args,
                                                         None,
-                                                        True)
+                                                        True,
+                                                        c.config['align'])
             else:
                 task = self.scheduler.add_single_task(func,
                                                       name,
@@ -295,10 +412,278 @@ class Server(object):
                                                       args,
                                                       None)
 
+            # Limit concurrent executions on the worker pool
+            if 'max_concurrent' in c.config:
+                task.max_concurrent = int(c.config['max_concurrent'])
+
             # Log
             self.log.debug("Scheduled task: %s", name)
             # Add task to list
             self.tasks[name] = task
+            if method == diamond.scheduler.method.pooled:
+                pooled_tasks.append(task)
+
+        # Keep track of the scheduled collector
+        self.collectors[c.__class__.__name__] = c
+        registry.register('collectors.' + c.__class__.__name__,
+                          self.get_collector_metrics(c, pooled_tasks))
+
+    def get_collector_metrics(self, c, tasks):
+        """
+        Return the internal metrics source of a collector: its run statistics,
+        and how its tasks fared on the worker pool
+        """
+        if not tasks:
+            return c.get_internal_metrics
+
+        def get_internal_metrics():
+            metrics = c.get_internal_metrics()
+            metrics['pool_skipped_runs'] = 0
+            metrics['pool_max_queue_wait_ms'] = 0
+            for task in tasks:
+                task_metrics = task.get_internal_metrics()
+                metrics['pool_skipped_runs'] += (
+                    task_metrics['pool_skipped_runs'])
+                metrics['pool_max_queue_wait_ms'] = max(
+                    metrics['pool_max_queue_wait_ms'],
+                    task_metrics['pool_max_queue_wait_ms'])
+            return metrics
+        return get_internal_metrics
+
+    def uses_process_pool(self):
+        """
+        Return True if process_pool_size is set, or a collector config asks
+        for method = ProcessPool
+        """
+        if 'process_pool_size' in self.config['server']:
+            return True
+        for section in self.config.get('collectors', {}).values():
+            if (isinstance(section, dict)
+                    and section.get('method') == 'ProcessPool'):
+                return True
+        path = self.config['server'].get('collectors_config_path')
+        if path and os.path.isdir(path):
+            for f in os.listdir(path):
+                if not f.endswith('.conf'):
+                    continue
+                try:
+                    config = configobj.ConfigObj(os.path.join(path, f))
+                except configobj.ConfigObjError:
+                    continue
+                if config.get('method') == 'ProcessPool':
+                    return True
+        return False
+
+    def start_process_pool(self):
+        """
+        Start the pool of collector worker processes, if it's used. The
+        workers are forked from this process, so this is done before any
+        thread is started: a thread holding a lock while the process forks
+        would leave it held forever in the workers.
+        """
+        if self.process_pool is not None or not self.uses_process_pool():
+            return
+        size = int(self.config['server'].get('process_pool_size', 0))
+        if size <= 0:
+            size = multiprocessing.cpu_count()
+        self.process_pool = CollectorProcessPool(size)
+        self.process_pool.start()
+        self.log.info("Started %d collector worker processes", size)
+
+    def get_config_files(self):
+        """
+        Return the main config file, and the handler and collector config
+        files
+        """
+        files = []
+        if 'configfile' in self.config:
+            files.append(os.path.abspath(self.config['configfile']))
+        for key in ('handlers_config_path', 'collectors_config_path'):
+            path = self.config['server'].get(key)
+            if not path or not os.path.isdir(path):
+                continue
+            for f in os.listdir(path):
+                if f.endswith('.conf'):
+                    files.append(os.path.join(path, f))
+        return files
+
+    def get_config_changes(self):
+        """
+        Return the config files created, modified or removed since the last
+        call
+        """
+        mtimes = {}
+        for filename in self.get_config_files():
+            try:
+                mtimes[filename] = os.stat(filename).st_mtime
+            except OSError:
+                # Removed in the meantime
+                continue
+
+        changed = set()
+        for filename in set(mtimes) | set(self.config_mtimes):
+            if mtimes.get(filename) != self.config_mtimes.get(filename):
+                changed.add(filename)
+        self.config_mtimes = mtimes
+        return changed
+
+    def reload_changed_config(self):
+        """
+        Reconstruct the handlers and collectors whose config changed since the
+        last call, and only those
+        """
+        changed = self.get_config_changes()
+        if not changed:
+            return
+
+        handlers_changed = False
+        affected = set()
+
+        configfile = None
+        if 'configfile' in self.config:
+            configfile = os.path.abspath(self.config['configfile'])
+        if configfile in changed:
+            self.log.info("Config file changed, reloading it.")
+            old_config = self.config
+            self.load_config()
+            if (section_dict(old_config, 'server')
+                    != section_dict(self.config, 'server')
+                    or section_dict(old_config, 'handlers')
+                    != section_dict(self.config, 'handlers')):
+                handlers_changed = True
+
+            old_collectors = section_dict(old_config, 'collectors')
+            new_collectors = section_dict(self.config, 'collectors')
+            if old_collectors.get('default') != new_collectors.get('default'):
+                affected.update(self.collector_classes)
+            for name in set(old_collectors) | set(new_collectors):
+                if old_collectors.get(name) != new_collectors.get(name):
+                    affected.add(name)
+            affected.discard('default')
+
+        handlers_config_path = self.config['server'].get(
+            'handlers_config_path')
+        collectors_config_path = self.config['server'].get(
+            'collectors_config_path')
+        for filename in changed:
+            if filename == configfile:
+                continue
+            directory = os.path.normpath(os.path.dirname(filename))
+            if (handlers_config_path
+                    and directory == os.path.normpath(handlers_config_path)):
+                handlers_changed = True
+            elif (collectors_config_path and directory
+                    == os.path.normpath(collectors_config_path)):
+                affected.add(os.path.basename(filename)[:-len('.conf')])
+
+        if handlers_changed:
+            self.reload_handlers()
+
+        # Collectors never loaded, as their module was skipped while they
+        # were disabled, need their module loaded
+        unknown = [name for name in affected
+                   if name not in self.collector_classes]
+        if unknown:
+            collectors_path = self.config['server']['collectors_path']
+            for cls in self.load_collectors(collectors_path).values():
+                self.collector_classes.setdefault(cls.__name__, cls)
+            if self.manifest is not None:
+                self.save_manifest()
+
+        for name in affected:
+            if name in self.collector_classes:
+                self.reload_collector(name)
+
+    def reload_handlers(self):
+        """
+        Replace the handlers with new ones built from the current config
+        """
+        self.log.info("Handler config changed, reloading handlers.")
+        old_handlers = list(self.handlers)
+        # Collectors share this list, so replace its content
+        del self.handlers[:]
+        if self.flusher is not None:
+            self.flusher.stop(5)
+        # The old handlers release their spool directories before the new
+        # ones take them over
+        for handler in old_handlers:
+            handler._shutdown(5)
+        for handler in old_handlers:
+            registry.unregister('handlers.' + handler.__class__.__name__)
+
+        try:
+            handlers = self.build_handlers()
+        except Exception:
+            self.log.error("Failed to reload the handlers, keeping the "
+                           "previous ones. %s", traceback.format_exc())
+            # Build the previous handlers again, from their own config
+            handlers = []
+            for old in old_handlers:
+                try:
+                    handlers.append(old.__class__(old.config))
+                except Exception:
+                    self.log.error("Failed to restore handler %s. %s",
+                                   old.__class__.__name__,
+                                   traceback.format_exc())
+        for handler in handlers:
+            self.add_handler(handler)
+
+        if self.flusher is not None:
+            self.flusher = HandlerFlusher(self.handlers)
+            self.flusher.start()
+
+    def reload_collector(self, name):
+        """
+        Reconstruct and reschedule a collector, keeping its counter state
+        """
+        self.log.info("Config of %s changed, reloading it.", name)
+        old = self.collectors.get(name)
+        c = self.init_collector(self.collector_classes[name])
+        if c is None:
+            return
+        if old is not None:
+            c.last_values = old.last_values
+
+        if c.config['enabled'] is not True:
+            self.unschedule_collector(name)
+            return
+        self.schedule_collector(c)
+
+    def unschedule_collector(self, name):
+        """
+        Cancel the tasks of a collector that got disabled
+        """
+        old = self.collectors.pop(name, None)
+        if old is None:
+            return
+        for taskname in old.get_schedule():
+            if taskname in self.tasks:
+                self.scheduler.cancel(self.tasks.pop(taskname))
+                self.log.debug("Canceled task: %s", taskname)
+        registry.unregister('collectors.' + name)
+
+    def save_manifest(self):
+        """
+        Save the collector manifest to its cache file
+        """
+        try:
+            self.manifest.save()
+        except (IOError, OSError):
+            self.log.error("Failed to save the collector manifest. %s",
+                           traceback.format_exc())
+
+    def start_profiling(self):
+        """
+        Start profiling collectors and handlers, as configured by the
+        profile_* server options
+        """
+        server_config = self.config['server']
+        directory = server_config.get('profile_path', '')
+        if not directory:
+            directory = os.path.join(tempfile.gettempdir(), 'diamond-profiles')
+        runs = int(server_config.get('profile_runs', 5))
+        duration = float(server_config.get('profile_duration', 600))
+        profiler.start(directory, runs, duration)
 
     def run(self):
         """
@@ -308,6 +693,9 @@ class Server(object):
         # Set Running Flag
         self.running = True
 
+        # Fork the collector workers while there is no other thread
+        self.start_process_pool()
+
         # Load handlers
         if 'handlers_path' in self.config['server']:
             handlers_path = self.config['server']['handlers_path']
@@ -318,9 +706,18 @@ class Server(object):
         self.load_config()
 
         # Load collectors
+        if str_to_bool(self.config['server'].get('collector_manifest',
+                                                 False)):
+            self.manifest = CollectorManifest(
+                self.config['server'].get('collector_manifest_cache'))
         collectors_path = self.config['server']['collectors_path']
         self.load_include_path(collectors_path)
         collectors = self.load_collectors(collectors_path)
+        if self.manifest is not None:
+            self.save_manifest()
+        # Diamond's own metrics, published when the collector is enabled
+        collectors.setdefault(InternalMetricsCollector.__name__,
+                              InternalMetricsCollector)
 
         # Setup Collectors
         for cls in collectors.values():
@@ -329,6 +726,9 @@ class Server(object):
             # Schedule Collector
             self.schedule_collector(c)
 
+        # Remember the config files, to reload them when they change
+        self.get_config_changes()
+
         # Start main loop
         self.mainloop()
 
@@ -339,6 +739,9 @@ class Server(object):
         # Set Running Flag
         self.running = True
 
+        # Fork the collector workers while there is no other thread
+        self.start_process_pool()
+
         # Load handlers
         if 'handlers_path' in self.config['server']:
             handlers_path = self.config['server']['handlers_path']
@@ -388,25 +791,50 @@ class Server(object):
         # Log
         self.log.info('Started task scheduler.')
 
-        # Initialize reload timer
+        # Start flushing handlers that linger
+        self.flusher = HandlerFlusher(self.handlers)
+        self.flusher.start()
+
+        if str_to_bool(self.config['server'].get('profile_at_start', False)):
+            self.start_profiling()
+
+        # Initialize reload timers
         time_since_reload = 0
+        time_since_config_check = 0
+        config_check_interval = int(
+            self.config['server'].get('config_check_interval', 60))
 
         # Main Loop
         while self.running:
             time.sleep(1)
             time_since_reload += 1
+            time_since_config_check += 1
+
+            # Reload what changed in the config files
+            if (reload and config_check_interval > 0
+                    and time_since_config_check >= config_check_interval):
+                try:
+                    self.reload_changed_config()
+                except Exception:
+                    self.log.error("Failed to reload the config. %s",
+                                   traceback.format_exc())
+                time_since_config_check = 0
+
+            # Write the profiles once the profiling session is over
+            profiler.tick()
 
             # Check if its time to reload collectors
-            if (reload
-                    and time_since_reload
-                    > int(self.config['server']['collectors_reload_interval'])):
-                self.log.debug("Reloading config.")
-                self.load_config()
-                # Log
+            reload_interval = int(
+                self.config['server']['collectors_reload_interval'])
+            if reload and time_since_reload > reload_interval:
+                # Config changes are picked up by reload_changed_config, so
+                # only look for new or modified collector modules
                 self.log.debug("Reloading collectors.")
                 # Load collectors
                 collectors_path = self.config['server']['collectors_path']
                 collectors = self.load_collectors(collectors_path)
+                if self.manifest is not None:
+                    self.save_manifest()
                 # Setup any Collectors that were loaded
                 for cls in collectors.values():
                     # Initialize Collector
@@ -418,7 +846,7 @@ class Server(object):
                 time_since_reload = 0
 
             # Is the queue empty and we won't attempt to reload it? Exit
-            if not reload and len(self.scheduler.sched._queue) == 0:
+            if not reload and self.scheduler.empty():
                 self.running = False
 
         # Log
@@ -427,6 +855,19 @@ class Server(object):
         self.scheduler.stop()
         # Log
         self.log.info('Stopped task scheduler.')
+        # Stop collector worker processes
+        if self.process_pool is not None:
+            self.process_pool.stop()
+        # Save counter values
+        for collector in self.collectors.values():
+            collector.save_counter_state()
+        # Write the profiles of an unfinished profiling session
+        profiler.stop()
+        # Stop flushing, handlers are flushed one last time below
+        self.flusher.stop(5)
+        # Drain handler dispatch queues
+        for handler in self.handlers:
+            handler._shutdown(5)
         # Log
         self.log.debug("Exiting.")
 
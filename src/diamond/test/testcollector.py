@@ -2,10 +2,27 @@
 # coding=utf-8
 ################################################################################
 
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from test import get_collector_config
 from test import unittest
+from mock import Mock
 import configobj
 
 from diamond.collector import Collector
+from diamond.timeout import CollectorTimeout
+from diamond.timeout import run_with_timeout
+
+
+class ThreeMetricsCollector(Collector):
+
+    def collect(self):
+        self.publish('cpu.user', 1)
+        self.publish_many([('cpu.idle', 2), ('cpu.nice', 3)])
 
 
 class BaseCollectorTest(unittest.TestCase):
@@ -20,3 +37,221 @@ class BaseCollectorTest(unittest.TestCase):
         }
         c = Collector(config, [])
         self.assertEquals('custom.localhost', c.get_hostname())
+
+    def test_publish_many(self):
+        config = get_collector_config('default', {
+            'hostname': 'custom.localhost',
+        })
+        handler = Mock()
+        c = Collector(config, [handler])
+        c.publish_many([('cpu.user', 1), ('cpu.idle', 2)])
+
+        self.assertEqual(handler._process_batch.call_count, 1)
+        metrics = handler._process_batch.call_args[0][0]
+        self.assertEqual([m.path for m in metrics],
+                         ['servers.custom.localhost.Collector.cpu.user',
+                          'servers.custom.localhost.Collector.cpu.idle'])
+        self.assertEqual([m.value for m in metrics], [1, 2])
+
+    def test_run_is_one_batch(self):
+        config = get_collector_config('default', {
+            'hostname': 'custom.localhost',
+        })
+        handler = Mock()
+        c = ThreeMetricsCollector(config, [handler])
+        c._run()
+
+        self.assertEqual(handler._process.call_count, 0)
+        self.assertEqual(handler._process_batch.call_count, 1)
+        self.assertEqual([m.value for m in
+                          handler._process_batch.call_args[0][0]],
+                         [1, 2, 3])
+        # Outside of runs, metrics are handed over as they are published
+        c.publish('cpu.user', 4)
+        self.assertEqual(handler._process.call_count, 1)
+
+    def test_settings(self):
+        config = get_collector_config('default', {
+            'interval': '30',
+            'ttl_multiplier': '1.5',
+            'byte_unit': 'bit byte',
+            'measure_collector_time': 'True',
+        })
+        c = Collector(config, [])
+        self.assertEqual(c.settings.interval, 30)
+        self.assertEqual(c.settings.byte_unit, ('bit', 'byte'))
+        self.assertTrue(c.settings.measure_collector_time is True)
+        self.assertEqual(c.metric_ttl, 45)
+        self.assertRaises(TypeError, setattr, c.settings, 'interval', 10)
+
+        # The settings follow the config
+        c.config['interval'] = '60'
+        self.assertEqual(c.settings.interval, 60)
+        self.assertEqual(c.metric_ttl, 90)
+        # Setting the same value again keeps them
+        settings = c.settings
+        c.config['interval'] = '60'
+        self.assertTrue(c.settings is settings)
+
+    def test_counter_ttl(self):
+        # Counters are only evicted by age when asked to
+        c = Collector(get_collector_config('default', {}), [])
+        self.assertEqual(c.last_values.ttl, 0)
+        config = get_collector_config('default', {'counter_ttl': '10'})
+        c = Collector(config, [])
+        self.assertEqual(c.last_values.ttl, 10)
+
+    def test_metric_path_cache(self):
+        config = get_collector_config('default', {
+            'hostname': 'custom.localhost',
+        })
+        c = Collector(config, [])
+        self.assertEqual(c.get_metric_path('cpu.user'),
+                         'servers.custom.localhost.Collector.cpu.user')
+        self.assertEqual(c.get_metric_path('cpu.user', instance='vm1'),
+                         'instances.vm1.Collector.cpu.user')
+
+        # Memoized paths are forgotten when the config changes
+        c.config['path'] = 'cpu'
+        self.assertEqual(c.get_metric_path('user'),
+                         'servers.custom.localhost.cpu.user')
+
+    def test_counter_state_survives_restart(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            config = get_collector_config('default', {
+                'counter_state_path': tmpdir,
+            })
+            c = Collector(config, [])
+            self.assertEqual(c.derivative('bytes', 100), 0)
+            # Pretend the value was recorded 10 seconds ago
+            c.last_values.values['bytes'][2] = time.time() - 10
+            c.save_counter_state()
+
+            c = Collector(config, [])
+            # The rate uses the elapsed time, not the configured interval
+            self.assertAlmostEqual(c.derivative('bytes', 200), 10, places=0)
+            self.assertAlmostEqual(c.derivative('bytes', 500), 1, places=2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_run_stats(self):
+        config = get_collector_config('default', {
+            'interval': 10,
+        })
+        c = Collector(config, [])
+        c.record_run_time(1)
+        c.record_run_time(12)
+        self.assertEqual(c.overruns, 1)
+
+        # A run that starts while the previous one is running is skipped
+        c.collect_running = True
+        c._run()
+        self.assertEqual(c.skipped_runs, 1)
+
+    def test_adaptive_interval(self):
+        config = get_collector_config('default', {
+            'interval': 10,
+            'adaptive_interval': True,
+        })
+        c = Collector(config, [])
+        for i in range(5):
+            c.record_run_time(12)
+        c.adapt_interval()
+        self.assertEqual(c.get_interval(), 15)
+
+        # Capped at adaptive_max_factor times the interval
+        for i in range(5):
+            c.record_run_time(100)
+        c.adapt_interval()
+        self.assertEqual(c.get_interval(), 40)
+
+        # And back once the collector is fast again
+        for i in range(5):
+            c.record_run_time(1)
+        c.adapt_interval()
+        self.assertEqual(c.get_interval(), 10)
+
+
+class HangingCollector(Collector):
+
+    def collect(self):
+        self.process = self.popen(['sleep', '10'])
+        self.gate.wait(5)
+        self.publish('late', 1)
+
+
+class HangingDerivativeCollector(Collector):
+
+    def collect(self):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.rate = self.derivative('counter', self.value, time_delta=False)
+
+
+class TimeoutTest(unittest.TestCase):
+
+    def test_run_is_abandoned(self):
+        handler = Mock()
+        config = get_collector_config('default', {'timeout': 0.2})
+        c = HangingCollector(config, [handler])
+        c.gate = threading.Event()
+        c._run()
+
+        self.assertEqual(c.timeouts, 1)
+        self.assertFalse(c.collect_running)
+        # The process started by the run was killed
+        self.assertNotEqual(c.process.poll(), None)
+        # The metrics of a run reach the handlers as one batch
+        self.assertEqual(handler._process_batch.call_count, 1)
+        paths = [m.path for m in handler._process_batch.call_args[0][0]]
+        self.assertEqual(len(paths), 1)
+        self.assertTrue(paths[0].endswith('collector_timeouts'))
+
+        # Metrics published by the abandoned run are dropped
+        thread = list(c.abandoned_threads)[0]
+        c.gate.set()
+        thread.join(5)
+        self.assertEqual(handler._process_batch.call_count, 1)
+        self.assertEqual(handler._process.call_count, 0)
+
+    def test_popen_is_left_alone(self):
+        popen = subprocess.Popen
+        config = get_collector_config('default', {'timeout': 0.2})
+        c = HangingCollector(config, [Mock()])
+        c.gate = threading.Event()
+        c._run()
+        c.gate.set()
+        self.assertTrue(subprocess.Popen is popen)
+
+    def test_abandoned_run_keeps_counters(self):
+        config = get_collector_config('default', {'timeout': 0.2})
+        c = HangingDerivativeCollector(config, [Mock()])
+        c.gate = None
+        c.value = 10
+        c._run()
+
+        # The late derivative of the abandoned run is not stored
+        c.gate = threading.Event()
+        c.value = 1000
+        c._run()
+        self.assertEqual(c.timeouts, 1)
+        thread = list(c.abandoned_threads)[0]
+        c.gate.set()
+        thread.join(5)
+
+        c.gate = None
+        c.value = 15
+        c._run()
+        self.assertEqual(c.rate, 5)
+
+    def test_exceptions_are_raised_again(self):
+        def fail():
+            raise KeyError('missing')
+        self.assertRaises(KeyError, run_with_timeout, fail, 5, 'test')
+
+    def test_timeout(self):
+        gate = threading.Event()
+        self.assertRaises(CollectorTimeout, run_with_timeout,
+                          lambda: gate.wait(5), 0.1, 'test')
+        gate.set()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+import shutil
+import tempfile
+import time
+
+from test import unittest
+
+from diamond.counterstore import CounterStore
+
+
+class TestCounterStore(unittest.TestCase):
+
+    def test_ttl_eviction(self):
+        store = CounterStore(ttl=1)
+        store['a'] = 1
+        store['b'] = 1
+        store.next_cycle()
+
+        # b is not updated anymore
+        store['a'] = 2
+        store.next_cycle()
+        self.assertTrue('b' in store)
+
+        store['a'] = 3
+        store.next_cycle()
+        self.assertFalse('b' in store)
+        self.assertEqual(store['a'], 3)
+        self.assertEqual(store.evicted, 1)
+
+    def test_max_size_eviction(self):
+        store = CounterStore(max_size=2)
+        store['a'] = 1
+        store.next_cycle()
+        store['b'] = 1
+        store['c'] = 1
+        store.next_cycle()
+
+        self.assertEqual(len(store), 2)
+        self.assertFalse('a' in store)
+
+    def test_unbounded(self):
+        store = CounterStore()
+        for cycle in range(5):
+            store[cycle] = cycle
+            store.next_cycle()
+
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.get(0), 0)
+        self.assertEqual(store.get('missing'), None)
+
+
+class TestCounterStorePersistence(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'Test.counters')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_and_load(self):
+        store = CounterStore()
+        store['a'] = 1
+        store[('vm1', 'b')] = 2
+        store.save(self.filename)
+
+        self.assertEqual(os.listdir(self.tmpdir), ['Test.counters'])
+
+        restored = CounterStore()
+        self.assertEqual(restored.load(self.filename, 60), 2)
+        self.assertEqual(restored['a'], 1)
+        self.assertEqual(restored[('vm1', 'b')], 2)
+        self.assertTrue('a' in restored.restored)
+
+        # Restored markers only last for one cycle
+        restored.next_cycle()
+        self.assertEqual(restored.restored, {})
+        self.assertEqual(restored['a'], 1)
+
+    def test_load_discards_stale(self):
+        store = CounterStore()
+        store.now = time.time() - 120
+        store['old'] = 1
+        store.now = time.time()
+        store['new'] = 2
+        store.save(self.filename)
+
+        restored = CounterStore()
+        self.assertEqual(restored.load(self.filename, 60), 1)
+        self.assertFalse('old' in restored)
+        self.assertEqual(restored['new'], 2)
+
+if __name__ == "__main__":
+    unittest.main()
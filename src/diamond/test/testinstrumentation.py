@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+from mock import Mock
+import configobj
+
+from diamond.instrumentation import InternalMetricsCollector
+from diamond.instrumentation import Registry
+from diamond.instrumentation import Stats
+from diamond.instrumentation import registry
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_snapshot(self):
+        stats = Stats()
+        stats.incr('bytes_sent', 10)
+        stats.incr('bytes_sent', 5)
+        stats.timing('flush', 0.001)
+        stats.timing('flush', 0.003)
+
+        self.assertEqual(stats.snapshot(), {
+            'bytes_sent': 15,
+            'flush_count': 2,
+            'flush_avg_ms': 2.0,
+            'flush_max_ms': 3.0,
+        })
+        # Timings are reset, counters are not
+        self.assertEqual(stats.snapshot(), {'bytes_sent': 15})
+
+
+class RegistryTest(unittest.TestCase):
+
+    def test_collect(self):
+        reg = Registry()
+        reg.register('handlers.TestHandler', lambda: {'queue_depth': 3})
+        reg.register('scheduler', lambda: {'tasks': 1})
+        self.assertEqual(reg.collect(), [('handlers.TestHandler.queue_depth',
+                                          3),
+                                         ('scheduler.tasks', 1)])
+
+        reg.unregister('scheduler')
+        self.assertEqual(len(reg.collect()), 1)
+
+
+class InternalMetricsCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        registry.register('test', lambda: {'latency': 1.5, 'count': 2})
+
+    def tearDown(self):
+        registry.unregister('test')
+
+    def test_collect(self):
+        config = configobj.ConfigObj()
+        config['server'] = {}
+        config['server']['collectors_config_path'] = ''
+        config['collectors'] = {}
+        config['collectors']['default'] = {
+            'hostname': 'custom.localhost',
+        }
+        handler = Mock()
+        c = InternalMetricsCollector(config, [handler])
+        c.collect()
+
+        metrics = dict((call[0][0].path, call[0][0].value)
+                       for call in handler._process.call_args_list)
+        self.assertEqual(
+            metrics['servers.custom.localhost.diamond.test.count'], 2)
+        self.assertEqual(
+            metrics['servers.custom.localhost.diamond.test.latency'], 1.5)
+        self.assertTrue(metrics['servers.custom.localhost.diamond.process.'
+                                'threads'] >= 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+import shutil
+import tempfile
+
+from test import unittest
+import configobj
+
+from diamond.manifest import CollectorManifest
+from diamond.manifest import scan_collectors
+from diamond.server import Server
+
+MODULE = '''
+import diamond.collector
+import some_missing_dependency
+
+
+class parent_BaseCollector(diamond.collector.Collector):
+    pass
+
+
+class FirstCollector(diamond.collector.Collector):
+
+    def get_default_config(self):
+        config = super(FirstCollector, self).get_default_config()
+        config.update({
+            'enabled': 'True',
+        })
+        return config
+
+
+class SecondCollector(parent_BaseCollector):
+    pass
+
+
+class Helper(object):
+    pass
+'''
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.module = os.path.join(self.tmpdir, 'example.py')
+        f = open(self.module, 'w')
+        f.write(MODULE)
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_scan_collectors(self):
+        self.assertEqual(scan_collectors(self.module), {
+            'FirstCollector': 'True',
+            'SecondCollector': None,
+        })
+
+    def test_cache(self):
+        cache_file = os.path.join(self.tmpdir, 'manifest')
+        manifest = CollectorManifest(cache_file)
+        collectors = manifest.get_collectors(self.module)
+        manifest.save()
+
+        manifest = CollectorManifest(cache_file)
+        self.assertFalse(manifest.dirty)
+        self.assertEqual(manifest.get_collectors(self.module), collectors)
+        self.assertFalse(manifest.dirty)
+
+    def test_has_enabled_collector(self):
+        config = configobj.ConfigObj()
+        config['server'] = {'collectors_config_path': self.tmpdir}
+        config['collectors'] = {'default': {}}
+        server = Server(config)
+        server.manifest = CollectorManifest()
+
+        # FirstCollector is enabled by default
+        self.assertTrue(server.has_enabled_collector(self.module))
+
+        config['collectors']['FirstCollector'] = {'enabled': 'False'}
+        self.assertFalse(server.has_enabled_collector(self.module))
+
+        # Collector config files have the last word
+        f = open(os.path.join(self.tmpdir, 'SecondCollector.conf'), 'w')
+        f.write('enabled = True\n')
+        f.close()
+        self.assertTrue(server.has_enabled_collector(self.module))
+
+if __name__ == "__main__":
+    unittest.main()
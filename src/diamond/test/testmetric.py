@@ -83,3 +83,27 @@ class TestMetric(unittest.TestCase):
 
         message = 'Actual %s, expected %s' % (actual_value, expected_value)
         self.assertEqual(actual_value, expected_value, message)
+
+    def testrepr(self):
+        metric = Metric('servers.host.cpu.total.idle', 1.234,
+                        timestamp=1234567, precision=2)
+
+        self.assertEqual(str(metric),
+                         'servers.host.cpu.total.idle 1.23 1234567\n')
+        # The serialized form is computed once
+        self.assertTrue(str(metric) is str(metric))
+
+    def testtrusted(self):
+        metric = Metric.trusted('servers.com.example.www.cpu.total.idle', 0,
+                                1234567, host='com.example.www')
+
+        self.assertEqual(metric.getCollectorPath(), 'cpu')
+        self.assertEqual(metric.getMetricPath(), 'total.idle')
+        self.assertEqual(metric.raw_value, None)
+        self.assertEqual(str(metric),
+                         'servers.com.example.www.cpu.total.idle 0 1234567\n')
+
+    def testslots(self):
+        metric = Metric('servers.host.cpu.total.idle', 0)
+
+        self.assertFalse(hasattr(metric, '__dict__'))
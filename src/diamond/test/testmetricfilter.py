@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+from mock import Mock
+import configobj
+
+from diamond.collector import Collector
+from diamond.metricfilter import MetricFilter
+
+
+class MetricFilterTest(unittest.TestCase):
+
+    def test_whitelist(self):
+        metric_filter = MetricFilter(whitelist=['cpu\.total', 'load'],
+                                     blacklist='cpu')
+        self.assertTrue(metric_filter.accepts('cpu.total.user'))
+        self.assertTrue(metric_filter.accepts('loadavg.01'))
+        self.assertFalse(metric_filter.accepts('cpu.cpu0.user'))
+        # Decisions are cached
+        self.assertFalse(metric_filter.decisions.get('cpu.cpu0.user'))
+
+    def test_blacklist(self):
+        metric_filter = MetricFilter(blacklist='cpu\.cpu[0-9]+\.')
+        self.assertTrue(metric_filter.accepts('cpu.total.user'))
+        self.assertFalse(metric_filter.accepts('cpu.cpu0.user'))
+
+    def test_empty(self):
+        self.assertFalse(MetricFilter())
+        self.assertFalse(MetricFilter(whitelist='', blacklist=[]))
+
+    def test_collector(self):
+        config = configobj.ConfigObj()
+        config['server'] = {}
+        config['server']['collectors_config_path'] = ''
+        config['collectors'] = {}
+        config['collectors']['default'] = {
+            'hostname': 'custom.localhost',
+            'metrics_blacklist': 'total\.',
+        }
+        handler = Mock()
+        c = Collector(config, [handler])
+        c.publish('total.user', 1)
+        c.publish_counter('total.idle', 1)
+        c.publish_many([('total.nice', 1), ('cpu0.user', 2)])
+        c.publish('cpu0.idle', 2)
+
+        self.assertEqual(c.metrics_filtered, 3)
+        self.assertEqual(handler._process.call_count, 1)
+        self.assertEqual(handler._process_batch.call_count, 1)
+        self.assertEqual(len(handler._process_batch.call_args[0][0]), 1)
+        # Dropped counters are not remembered either
+        self.assertEqual(len(c.last_values), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+import shutil
+import tempfile
+import time
+
+from test import unittest
+from mock import Mock
+import configobj
+
+from diamond.collector import Collector
+from diamond.processpool import CollectorProcessPool, WorkerError
+from diamond.server import Server
+from diamond.timeout import CollectorTimeout
+
+
+class PidCollector(Collector):
+
+    def collect(self):
+        self.publish('pid', os.getpid())
+        self.publish_counter('runs', self.config['runs'])
+
+
+class FailingCollector(Collector):
+
+    def collect(self):
+        raise ValueError('broken')
+
+
+class SlowCollector(Collector):
+
+    def collect(self):
+        time.sleep(10)
+
+
+def make_collector(cls, handler, runs=0):
+    config = configobj.ConfigObj()
+    config['server'] = {}
+    config['server']['collectors_config_path'] = ''
+    config['collectors'] = {}
+    config['collectors']['default'] = {
+        'hostname': 'custom.localhost',
+        'interval': 10,
+        'runs': runs,
+    }
+    return cls(config, [handler])
+
+
+class ProcessPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = CollectorProcessPool(2)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_metrics_are_published_by_the_parent(self):
+        handler = Mock()
+        c = make_collector(PidCollector, handler)
+
+        self.pool.collect(c)
+        c.config['runs'] = 50
+        self.pool.collect(c)
+
+        published = []
+        for call in handler._process.call_args_list:
+            published.append(call[0][0])
+        for call in handler._process_batch.call_args_list:
+            published.extend(call[0][0])
+        pids = [m.value for m in published if m.path.endswith('pid')]
+        self.assertEqual(len(pids), 2)
+        self.assertNotEqual(pids[0], os.getpid())
+        # Both runs happened in the same worker
+        self.assertEqual(pids[0], pids[1])
+
+        # The counter was derived in this process, from both runs
+        runs = [m.value for m in published if m.path.endswith('runs')]
+        self.assertEqual(runs, [0, 5])
+        self.assertEqual(c.last_values.get('runs'), 50)
+
+    def test_stopped_pool_collects_in_process(self):
+        handler = Mock()
+        collector = make_collector(PidCollector, handler)
+        self.pool.stop()
+        self.pool.collect(collector)
+
+        metric = handler._process.call_args_list[0][0][0]
+        self.assertTrue(metric.path.endswith('pid'))
+        self.assertEqual(metric.value, os.getpid())
+
+    def test_collector_errors_are_raised(self):
+        c = make_collector(FailingCollector, Mock())
+        self.assertRaises(WorkerError, self.pool.collect, c)
+        # The worker survives
+        self.assertRaises(WorkerError, self.pool.collect, c)
+
+    def test_hung_worker_is_replaced(self):
+        c = make_collector(SlowCollector, Mock())
+        worker = self.pool.workers[hash('SlowCollector') % 2]
+        pid = worker.process.pid
+
+        self.assertRaises(CollectorTimeout, self.pool.collect, c, 0.2)
+        self.assertNotEqual(worker.process.pid, pid)
+        self.assertTrue(worker.process.is_alive())
+
+
+class ServerProcessPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        config = configobj.ConfigObj()
+        config['server'] = {
+            'collectors_config_path': self.tmpdir,
+            'handlers': [],
+        }
+        config['collectors'] = {'default': {}}
+        self.server = Server(config)
+
+    def tearDown(self):
+        if self.server.process_pool is not None:
+            self.server.process_pool.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_pool_is_not_started_unless_used(self):
+        self.server.start_process_pool()
+        self.assertEqual(self.server.process_pool, None)
+
+    def test_pool_is_started_for_collector_config_files(self):
+        f = open(os.path.join(self.tmpdir, 'PidCollector.conf'), 'w')
+        f.write('method = ProcessPool\n')
+        f.close()
+        self.assertTrue(self.server.uses_process_pool())
+
+        self.server.config['server']['process_pool_size'] = 1
+        self.server.start_process_pool()
+        self.assertEqual(len(self.server.process_pool.workers), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+import pstats
+import shutil
+import tempfile
+
+from test import unittest
+from mock import Mock
+import configobj
+
+from diamond import profiler
+from diamond.collector import Collector
+from diamond.handler.Handler import Handler
+from diamond.metric import Metric
+
+
+class ProfiledCollector(Collector):
+
+    def collect(self):
+        self.publish('value', 1)
+
+
+class ProfiledHandler(Handler):
+
+    def process(self, metric):
+        pass
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        profiler.session = None
+        shutil.rmtree(self.tmpdir)
+
+    def test_profiles_are_written(self):
+        config = configobj.ConfigObj()
+        config['server'] = {}
+        config['server']['collectors_config_path'] = ''
+        config['collectors'] = {}
+        config['collectors']['default'] = {}
+        c = ProfiledCollector(config, [Mock()])
+        handler = ProfiledHandler(configobj.ConfigObj())
+
+        self.assertTrue(profiler.start(self.tmpdir, runs=1, duration=60))
+        self.assertFalse(profiler.start(self.tmpdir))
+        session = profiler.session
+        c._run()
+        c._run()
+        handler._process(Metric('metricname', 0, timestamp=123))
+
+        # Still running
+        profiler.tick(session.deadline - 1)
+        self.assertTrue(profiler.session is session)
+        profiler.tick(session.deadline)
+        self.assertTrue(profiler.session is None)
+
+        self.assertEqual(session.counts, {'collector-ProfiledCollector': 1})
+        files = sorted(os.listdir(self.tmpdir))
+        self.assertEqual(len(files), 2)
+        self.assertTrue(files[0].startswith('collector-ProfiledCollector-'))
+        self.assertTrue(files[1].startswith('handler-ProfiledHandler-'))
+
+        stats = pstats.Stats(os.path.join(self.tmpdir, files[0]))
+        # Only one of the two runs was profiled
+        collect = [value for key, value in stats.stats.items()
+                   if key[2] == 'collect']
+        self.assertEqual(collect[0][1], 1)
+
+if __name__ == "__main__":
+    unittest.main()
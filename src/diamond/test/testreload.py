@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+import shutil
+import tempfile
+
+from test import unittest
+import configobj
+
+from diamond.collector import Collector
+from diamond.handler.null import NullHandler
+from diamond.instrumentation import registry
+from diamond.server import Server
+
+
+class FirstCollector(Collector):
+
+    def collect(self):
+        pass
+
+
+class SecondCollector(Collector):
+
+    def collect(self):
+        pass
+
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        config = configobj.ConfigObj()
+        config['server'] = {
+            'collectors_config_path': self.tmpdir,
+            'handlers': [],
+        }
+        config['collectors'] = {'default': {'enabled': True, 'interval': 10}}
+        self.server = Server(config)
+        for cls in (FirstCollector, SecondCollector):
+            self.server.schedule_collector(self.server.init_collector(cls))
+        self.server.get_config_changes()
+
+    def tearDown(self):
+        self.server.scheduler.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def write_config(self, name, content):
+        f = open(os.path.join(self.tmpdir, name + '.conf'), 'w')
+        f.write(content)
+        f.close()
+
+    def test_reload_changed_collector(self):
+        first = self.server.collectors['FirstCollector']
+        second = self.server.collectors['SecondCollector']
+        first.last_values['FirstCollector.counter'] = 42
+
+        self.write_config('FirstCollector', 'interval = 30\n')
+        self.server.reload_changed_config()
+
+        reloaded = self.server.collectors['FirstCollector']
+        self.assertNotEqual(reloaded, first)
+        self.assertEqual(int(reloaded.config['interval']), 30)
+        self.assertEqual(reloaded.last_values.get('FirstCollector.counter'),
+                         42)
+        # Other collectors are left alone
+        self.assertEqual(self.server.collectors['SecondCollector'], second)
+
+        # Nothing changed since
+        self.server.reload_changed_config()
+        self.assertEqual(self.server.collectors['FirstCollector'], reloaded)
+
+    def test_disable_collector(self):
+        self.write_config('SecondCollector', 'enabled = False\n')
+        self.server.reload_changed_config()
+
+        self.assertFalse('SecondCollector' in self.server.collectors)
+        self.assertFalse([name for name in self.server.tasks
+                          if name.startswith('SecondCollector')])
+
+    def test_failed_handler_reload(self):
+        self.server.config['server']['handlers_config_path'] = self.tmpdir
+        self.server.config['server']['handlers'] = [
+            'diamond.handler.null.NullHandler']
+        self.server.config['handlers'] = {'default': {}}
+        self.server.reload_handlers()
+        self.assertTrue(isinstance(self.server.handlers[0], NullHandler))
+        self.assertTrue('handlers.NullHandler' in registry.sources)
+
+        # A broken config keeps the previous handlers
+        self.server.config['server']['handlers'] = [
+            'diamond.handler.tsdb.TSDBHandler']
+        self.server.config['handlers']['TSDBHandler'] = {
+            'protocol': 'unknown'}
+        self.server.reload_handlers()
+        self.assertEqual(len(self.server.handlers), 1)
+        self.assertTrue(isinstance(self.server.handlers[0], NullHandler))
+
+        # Removed handlers no longer publish internal metrics
+        self.server.config['server']['handlers'] = []
+        self.server.reload_handlers()
+        self.assertEqual(self.server.handlers, [])
+        self.assertFalse('handlers.NullHandler' in registry.sources)
+
+if __name__ == "__main__":
+    unittest.main()
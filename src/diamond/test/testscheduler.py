@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import threading
+import time
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.collector import Collector
+from diamond.instrumentation import registry
+
+from diamond.scheduler import IntervalTask
+from diamond.scheduler import PooledSingleTask
+from diamond.scheduler import Scheduler
+from diamond.scheduler import ThreadedScheduler
+from diamond.scheduler import WorkerPool
+from diamond.scheduler import method
+from diamond.server import Server
+
+
+class PoolCollector(Collector):
+
+    def collect(self):
+        pass
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_cancel(self):
+        scheduler = Scheduler()
+        self.assertTrue(scheduler.empty())
+
+        task = scheduler.add_single_task(Mock(), 'test', 100,
+                                         method.sequential, None, None)
+        self.assertFalse(scheduler.empty())
+
+        scheduler.cancel(task)
+        scheduler.cancel(task)
+        self.assertTrue(scheduler.empty())
+
+    def test_run_in_order(self):
+        runs = []
+        scheduler = ThreadedScheduler()
+        first = scheduler.add_single_task(runs.append, 'first', 0.1,
+                                          method.sequential, ['first'], None)
+        scheduler.add_single_task(runs.append, 'second', 0.2,
+                                  method.sequential, ['second'], None)
+        scheduler.add_single_task(runs.append, 'last', 0.3,
+                                  method.sequential, ['last'], None)
+        scheduler.start()
+        time.sleep(0.6)
+        scheduler.stop()
+
+        self.assertEqual(runs, ['first', 'second', 'last'])
+        self.assertTrue(scheduler.empty())
+        self.assertTrue(first.drift >= 0)
+
+    def test_aligned_first_run(self):
+        scheduler = Scheduler()
+        task = scheduler.add_interval_task(Mock(), 'test', 1, 60,
+                                           method.sequential, None, None,
+                                           align=True)
+        firsttime = task.event[0]
+
+        self.assertEqual(firsttime % 60, 1)
+        self.assertTrue(time.time() < firsttime <= time.time() + 60)
+
+    def test_aligned_reschedule_skips_missed_slots(self):
+        scheduler = Mock()
+        task = IntervalTask('test', 60, Mock())
+        task.align = True
+        task.scheduled_time = 6000.0 - 60 * 3
+
+        patch_time = patch('time.time', Mock(return_value=6000.0 + 10))
+        patch_time.start()
+        task.reschedule(scheduler)
+        patch_time.stop()
+
+        scheduler.schedule_task_abs.assert_called_once_with(task, 6060.0)
+        self.assertEqual(task.overruns, 3)
+
+    def test_action_adapts_interval(self):
+        task = IntervalTask('test', 60, Mock(return_value=120), [], {})
+        task.execute()
+        self.assertEqual(task.interval, 120)
+
+        task.action = Mock(return_value=None)
+        task.execute()
+        self.assertEqual(task.interval, 120)
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_concurrency_limit(self):
+        gate = threading.Event()
+        done = threading.Event()
+        runs = []
+
+        def action():
+            gate.wait(5)
+            runs.append(1)
+            done.set()
+
+        pool = WorkerPool(2)
+        pool.start()
+        task = PooledSingleTask('test', action, [], {})
+
+        self.assertTrue(pool.submit(task))
+        # The first execution is still pending, so this one is skipped
+        self.assertFalse(pool.submit(task))
+        self.assertEqual(task.skipped, 1)
+
+        gate.set()
+        done.wait(5)
+        pool.stop()
+
+        self.assertEqual(runs, [1])
+        self.assertTrue(task.queue_wait >= 0)
+        metrics = task.get_internal_metrics()
+        self.assertEqual(metrics['pool_skipped_runs'], 1)
+        self.assertEqual(metrics['pool_max_queue_wait_ms'],
+                         task.queue_wait * 1000)
+        # The longest wait is reset once reported
+        self.assertEqual(task.get_internal_metrics()[
+            'pool_max_queue_wait_ms'], 0)
+
+    def test_collector_metrics(self):
+        config = configobj.ConfigObj()
+        config['server'] = {
+            'collectors_config_path': '',
+            'handlers': [],
+            'thread_pool_size': 1,
+        }
+        config['collectors'] = {'default': {'enabled': True,
+                                            'method': 'Pooled'}}
+        server = Server(config)
+        try:
+            server.schedule_collector(server.init_collector(PoolCollector))
+            metrics = registry.sources['collectors.PoolCollector']()
+        finally:
+            server.scheduler.pool.stop()
+            registry.unregister('collectors.PoolCollector')
+        # The pool statistics come along with the collector run statistics
+        self.assertEqual(metrics['pool_skipped_runs'], 0)
+        self.assertEqual(metrics['pool_max_queue_wait_ms'], 0)
+        self.assertEqual(metrics['runs'], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+
+from diamond.util import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        # Touch a, so b becomes the least recently used key
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_pop_and_clear(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('a', 2)
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.pop('a'), 2)
+        self.assertEqual(cache.pop('a'), None)
+
+        cache.put('b', 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+# coding=utf-8
+
+"""
+Run collectors with a hard time limit.
+
+A collector with a `timeout` runs in a separate thread that the collector
+thread waits for. If the run takes longer than the timeout it is abandoned:
+the child processes it started through subprocess are killed, and the
+collector is free to run again on its next interval. Python threads can't
+be killed, so the abandoned thread is left to finish on its own, but what it
+publishes afterwards is dropped.
+
+Collectors start their child processes with Collector.popen(), which
+records the processes started from a timed thread. Processes started with
+subprocess directly are not known to the run, and are not killed.
+"""
+
+import subprocess
+import sys
+import threading
+
+from error import DiamondException
+
+_local = threading.local()
+
+
+class CollectorTimeout(DiamondException):
+    """
+    Raised when a collector run exceeds its timeout
+    """
+
+    def __init__(self, message, thread=None):
+        DiamondException.__init__(self, message)
+        # The abandoned thread, if the run happened in this process
+        self.thread = thread
+
+
+def popen(*args, **kwargs):
+    """
+    Start a subprocess.Popen, registering it with the timed run of the
+    calling thread so that it is killed if the run is abandoned
+    """
+    process = subprocess.Popen(*args, **kwargs)
+    processes = getattr(_local, 'processes', None)
+    if processes is not None:
+        processes.append(process)
+    return process
+
+
+def kill_processes(processes):
+    """
+    Kill the processes of an abandoned run that are still running
+    """
+    for process in processes:
+        try:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        except OSError:
+            # Already gone
+            pass
+
+
+def run_with_timeout(func, timeout, name):
+    """
+    Call func in a separate thread, waiting at most timeout seconds for it.
+    Exceptions raised by func are raised again in the calling thread, and
+    CollectorTimeout is raised if it did not return in time.
+    """
+    processes = []
+    result = {}
+
+    def target():
+        _local.processes = processes
+        try:
+            func()
+        except Exception:
+            result['exc_info'] = sys.exc_info()
+
+    thread = threading.Thread(target=target, name='%s-run' % name)
+    thread.setDaemon(True)
+    thread.start()
+    thread.join(timeout)
+
+    if thread.isAlive():
+        kill_processes(processes)
+        raise CollectorTimeout("%s timed out after %ss" % (name, timeout),
+                               thread)
+
+    if 'exc_info' in result:
+        exc_info = result['exc_info']
+        raise exc_info[0], exc_info[1], exc_info[2]
@@ -1,8 +1,10 @@
 # coding=utf-8
 
 import os
+import math
 import sys
 import inspect
+import threading
 
 
 def get_diamond_version():
@@ -50,3 +52,109 @@ def load_class_from_name(fqcn):
         raise TypeError("%s is not a class" % fqcn)
     # Return class
     return cls
+
+
+def percentile(values, percent):
+    """
+    Return the nearest-rank percentile of a list of numbers, or None if the
+    list is empty
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping holding at most `maxsize` keys. When full, the least
+    recently used key is evicted.
+    """
+
+    # Indexes into the links of the doubly linked list
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """
+        Remove all keys
+        """
+        self.lock.acquire()
+        try:
+            self.map = {}
+            self.root = []
+            self.root[:] = [self.root, self.root, None, None]
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.map)
+
+    def __contains__(self, key):
+        return key in self.map
+
+    def get(self, key, default=None):
+        """
+        Return the value for key, marking it as the most recently used
+        """
+        self.lock.acquire()
+        try:
+            link = self.map.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            self._append(link)
+            return link[self.VALUE]
+        finally:
+            self.lock.release()
+
+    def put(self, key, value):
+        """
+        Set the value for key, evicting the least recently used key if needed
+        """
+        self.lock.acquire()
+        try:
+            link = self.map.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[self.VALUE] = value
+            else:
+                if len(self.map) >= self.maxsize:
+                    oldest = self.root[self.NEXT]
+                    self._unlink(oldest)
+                    del self.map[oldest[self.KEY]]
+                link = [None, None, key, value]
+                self.map[key] = link
+            self._append(link)
+        finally:
+            self.lock.release()
+
+    def pop(self, key, default=None):
+        """
+        Remove key and return its value
+        """
+        self.lock.acquire()
+        try:
+            link = self.map.pop(key, None)
+            if link is None:
+                return default
+            self._unlink(link)
+            return link[self.VALUE]
+        finally:
+            self.lock.release()
+
+    def _unlink(self, link):
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+
+    def _append(self, link):
+        last = self.root[self.PREV]
+        link[self.PREV] = last
+        link[self.NEXT] = self.root
+        last[self.NEXT] = link
+        self.root[self.PREV] = link
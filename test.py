@@ -3,7 +3,9 @@
 ###############################################################################
 
 import os
+import gc
 import sys
+import time
 import unittest
 import inspect
 import traceback
@@ -23,6 +25,12 @@ try:
 except ImportError:
     from StringIO import StringIO
 
+try:
+    import json
+    json  # workaround for pyflakes issue #13
+except ImportError:
+    import simplejson as json
+
 try:
     from setproctitle import setproctitle
     setproctitle  # workaround for pyflakes issue #13
@@ -266,6 +274,141 @@ def getCollectorTests(path):
 
 ###############################################################################
 
+
+# Tests patch time.time, so keep a reference to the real one
+_now = time.time
+
+
+def class_attribute(instance, name):
+    """
+    Return the attribute of the instance's class bound to the instance, so
+    that attributes patched onto the class by the tests are honored
+    """
+    attr = getattr(type(instance), name)
+    try:
+        return attr.__get__(instance, type(instance))
+    except AttributeError:
+        # Mocks patched onto the class are not descriptors
+        return attr
+
+
+class CollectorBenchmark(object):
+    """
+    Measures collect() of every collector created by the unit tests, which
+    feed the collectors their fixtures
+    """
+
+    def __init__(self):
+        # collector name -> [runs, seconds, metrics, objects]
+        self.results = {}
+
+    def install(self):
+        from diamond.collector import Collector
+        self.collector_cls = Collector
+        self.original_init = Collector.__init__
+        benchmark = self
+
+        def __init__(collector, *args, **kwargs):
+            benchmark.original_init(collector, *args, **kwargs)
+            benchmark.instrument(collector)
+
+        Collector.__init__ = __init__
+
+    def uninstall(self):
+        self.collector_cls.__init__ = self.original_init
+
+    def instrument(self, collector):
+        name = collector.__class__.__name__
+        published = [0]
+
+        def publish(*args, **kwargs):
+            published[0] += 1
+            return class_attribute(collector, 'publish')(*args, **kwargs)
+
+        def collect(*args, **kwargs):
+            result = self.results.setdefault(name, [0, 0.0, 0, 0])
+            published[0] = 0
+            gc.collect()
+            objects = len(gc.get_objects())
+            start = _now()
+            try:
+                return class_attribute(collector, 'collect')(*args, **kwargs)
+            finally:
+                result[1] += _now() - start
+                result[0] += 1
+                result[2] += published[0]
+                # Objects still alive after the run, including what the
+                # mocks of the tests record
+                gc.collect()
+                result[3] += len(gc.get_objects()) - objects
+
+        collector.publish = publish
+        collector.collect = collect
+
+    def summary(self):
+        """
+        Return collector name -> per run time (ms), metrics and objects
+        """
+        summary = {}
+        for name, (runs, seconds, metrics, objects) in self.results.items():
+            summary[name] = {
+                'ms': seconds * 1000 / runs,
+                'metrics': float(metrics) / runs,
+                'objects': float(objects) / runs,
+            }
+        return summary
+
+
+def run_benchmark(suite, iterations, baseline_file=None, compare_file=None,
+                  threshold=10.0):
+    """
+    Run the collector tests iterations times, report the cost of collect()
+    for each collector and compare it with a baseline. Returns the number of
+    collectors that got slower than the baseline by more than threshold %.
+    """
+    benchmark = CollectorBenchmark()
+    benchmark.install()
+    try:
+        for i in range(iterations):
+            unittest.TextTestRunner(stream=StringIO(), verbosity=0).run(suite)
+    finally:
+        benchmark.uninstall()
+    summary = benchmark.summary()
+
+    if baseline_file:
+        f = open(baseline_file, 'w')
+        try:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+    baseline = {}
+    if compare_file:
+        f = open(compare_file)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+
+    regressions = 0
+    print "%-36s %10s %10s %10s %10s" % ('collector', 'ms/run', 'metrics',
+                                         'objects', 'vs base')
+    for name in sorted(summary):
+        result = summary[name]
+        change = ''
+        if name in baseline and baseline[name]['ms'] > 0:
+            percent = (result['ms'] / baseline[name]['ms'] - 1) * 100
+            change = '%+.1f%%' % percent
+            if percent > threshold:
+                change += ' !'
+                regressions += 1
+        print "%-36s %10.3f %10.1f %10.1f %10s" % (
+            name, result['ms'], result['metrics'], result['objects'], change)
+
+    return regressions
+
+###############################################################################
+
 if __name__ == "__main__":
     if setproctitle:
         setproctitle('test.py')
@@ -288,6 +431,26 @@ if __name__ == "__main__":
                       default=1,
                       action="count",
                       help="verbose")
+    parser.add_option("-b",
+                      "--benchmark",
+                      dest="benchmark",
+                      type="int",
+                      default=0,
+                      help="Benchmark collect() of the collectors by running"
+                           " their tests this many times")
+    parser.add_option("--save-baseline",
+                      dest="save_baseline",
+                      default=None,
+                      help="Save the benchmark results to this file")
+    parser.add_option("--compare",
+                      dest="compare",
+                      default=None,
+                      help="Compare the benchmark results with this file")
+    parser.add_option("--threshold",
+                      dest="threshold",
+                      type="float",
+                      default=10.0,
+                      help="Slowdown in % reported as a regression")
 
     # Parse Command Line Args
     (options, args) = parser.parse_args()
@@ -302,7 +465,8 @@ if __name__ == "__main__":
                                          'diamond'))
 
     getCollectorTests(cPath)
-    getCollectorTests(dPath)
+    if not options.benchmark:
+        getCollectorTests(dPath)
 
     loader = unittest.TestLoader()
     tests = []
@@ -313,6 +477,13 @@ if __name__ == "__main__":
                 continue
             tests.append(loader.loadTestsFromTestCase(c))
     suite = unittest.TestSuite(tests)
+
+    if options.benchmark:
+        regressions = run_benchmark(suite, options.benchmark,
+                                    options.save_baseline, options.compare,
+                                    options.threshold)
+        sys.exit(regressions and 1 or 0)
+
     results = unittest.TextTestRunner(verbosity=options.verbose).run(suite)
 
     results = str(results)